@@ -0,0 +1,176 @@
+"""
+Cold-start cost of each cloud function: import time of main.py, then the
+first CORS preflight and the first request rejected by validation, each in a
+fresh interpreter run with `python -X importtime`.
+
+For every function it reports:
+- wall time of `import main` and of the two requests
+- the heaviest modules main imports directly, from -X importtime
+- which clients the requests created (the LazyClients in main)
+- which heavy client libraries ended up in sys.modules
+
+By default the real client libraries are imported, so the function's
+requirements must be installed. `--standins` uses the stand-ins from
+standins.py instead, which leaves only the cost of the function's own code.
+`--ref` runs the same measurement on the functions as of a git revision, to
+compare against an earlier version.
+
+    python backend/benchmarks/cold_start.py --runs 5
+    python backend/benchmarks/cold_start.py --runs 5 --ref HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(BENCHMARKS_DIR))
+
+# Function directory -> (entry point, JSON body that fails validation)
+FUNCTIONS = {
+    "transaction-process-function": ("upload_form_data", None),
+    "get-user-data-function": ("get_user_data", {"collection": "sample_transactions"}),
+    "query-gemini-function": ("query_gemini", {"context": []}),
+}
+HEAVY_MODULES = (
+    "google.cloud.firestore", "google.cloud.storage", "google.cloud.pubsub_v1", "vertexai",
+    "google.cloud.aiplatform", "grpc",
+)
+
+PROBE = r"""
+import json, sys, time
+function_dir, benchmarks_dir, entry_point, invalid_body, use_standins = sys.argv[1:6]
+sys.path.insert(0, function_dir)
+if use_standins == "1":
+    sys.path.insert(0, benchmarks_dir)
+    import standins
+    standins.install()
+# functions_framework has already loaded these when a function is imported
+import flask
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+handler = getattr(main, entry_point)
+handler(Request(EnvironBuilder(method="OPTIONS").get_environ()))
+preflight = time.perf_counter()
+body = json.loads(invalid_body)
+invalid = EnvironBuilder(method="POST", json=body) if body is not None else EnvironBuilder(method="POST", data={})
+status = handler(Request(invalid.get_environ()))
+rejected = time.perf_counter()
+
+lazy = {name: value.initialized for name, value in vars(main).items() if type(value).__name__ == "LazyClient"}
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "options_ms": (preflight - imported) * 1000,
+    "invalid_ms": (rejected - preflight) * 1000,
+    "invalid_status": status[1] if isinstance(status, tuple) else None,
+    "lazy_clients": lazy,
+    "heavy_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+}))
+""".replace("HEAVY_MODULES", repr(HEAVY_MODULES))
+
+
+def parse_importtime(stderr):
+    """
+    {module: cumulative microseconds} for the modules `import main` imported directly,
+    from -X importtime output. A module is listed after the modules it imports,
+    one level of indentation deeper.
+    """
+    children = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == "main":
+                return children
+            children = {}
+    return {}
+
+
+def measure(function_dir, entry_point, invalid_body, use_standins):
+    env = {**os.environ, "GCP_PROJECT": os.environ.get("GCP_PROJECT", "local-benchmark"),
+           "GCP_REGION": os.environ.get("GCP_REGION", "us-central1")}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE, function_dir, BENCHMARKS_DIR, entry_point,
+         json.dumps(invalid_body), "1" if use_standins else "0"],
+        cwd=function_dir, env=env, capture_output=True, text=True,
+    )
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode != 0 or not lines:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "no output"
+        raise RuntimeError(error)
+    return json.loads(lines[-1]), parse_importtime(result.stderr)
+
+
+def checkout(ref, destination):
+    """Extracts backend/cloud-functions as of `ref` into `destination`."""
+    archive = subprocess.run(
+        ["git", "-C", REPO_DIR, "archive", ref, "backend/cloud-functions"], capture_output=True, check=True
+    )
+    subprocess.run(["tar", "-x", "-C", destination], input=archive.stdout, check=True)
+    return os.path.join(destination, "backend", "cloud-functions")
+
+
+def report(functions_dir, runs, use_standins, top):
+    for directory, (entry_point, invalid_body) in FUNCTIONS.items():
+        function_dir = os.path.join(functions_dir, directory)
+        samples, imports = [], {}
+        try:
+            for _ in range(runs):
+                sample, importtime = measure(function_dir, entry_point, invalid_body, use_standins)
+                samples.append(sample)
+                for name, micros in importtime.items():
+                    imports.setdefault(name, []).append(micros)
+        except RuntimeError as e:
+            print(f"{directory}: failed to import ({e})")
+            continue
+
+        def median(key):
+            return statistics.median(sample[key] for sample in samples)
+
+        last = samples[-1]
+        created = sorted(name for name, initialized in last["lazy_clients"].items() if initialized)
+        print(f"{directory} ({entry_point}, median of {runs})")
+        print(f"  import main        {median('import_ms'):8.1f}ms")
+        print(f"  OPTIONS            {median('options_ms'):8.1f}ms")
+        print(f"  invalid request    {median('invalid_ms'):8.1f}ms  (status {last['invalid_status']})")
+        print(f"  clients created    {', '.join(created) or 'none'}"
+              + ("" if last["lazy_clients"] else "  (no LazyClients in this version)"))
+        if not use_standins:
+            print(f"  heavy modules      {', '.join(last['heavy_modules']) or 'none'}")
+        heaviest = sorted(imports.items(), key=lambda item: statistics.median(item[1]), reverse=True)[:top]
+        print("  heaviest imports   " + ", ".join(
+            f"{name} {statistics.median(micros) / 1000:.1f}ms" for name, micros in heaviest
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per function")
+    parser.add_argument("--standins", action="store_true", help="use the stand-ins instead of the real libraries")
+    parser.add_argument("--ref", help="also measure the functions as of this git revision")
+    parser.add_argument("--top", type=int, default=5, help="heaviest imports to list")
+    args = parser.parse_args()
+
+    print("== working tree ==")
+    report(os.path.join(REPO_DIR, "backend", "cloud-functions"), args.runs, args.standins, args.top)
+    if args.ref:
+        with tempfile.TemporaryDirectory() as destination:
+            print(f"\n== {args.ref} ==")
+            report(checkout(args.ref, destination), args.runs, args.standins, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Receipt extraction latency, errors and model cost with gemini-2.5-pro alone
+(no deadline or retries, as before) vs the model tiers: flash-lite first,
+escalating to pro, with deadlines and jittered retries, and optionally a
+hedged flash-lite request.
+
+The stand-in models take `--fast-ms` / `--pro-ms` (+-25%). A `--stragglers`
+fraction of calls takes `--straggler-factor` times longer and a `--throttle`
+fraction fails with 429. On a `--hard` fraction of receipts flash-lite returns
+no amount and a low confidence, which sends them to pro. Latencies are scaled
+down from production (pro on a phone photo takes several seconds) so a run
+finishes quickly; the deadlines are scaled with them.
+
+Cost is in pro calls: every flash-lite call counts as 1/`--cost-ratio` of one.
+Calls that were abandoned at a deadline or lost a hedge are included.
+
+    python backend/benchmarks/extraction_tiers.py --receipts 200 --hard 0.15 --throttle 0.05
+"""
+import argparse
+import contextlib
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import standins
+
+FAST = "gemini-2.5-flash-lite"
+PRO = "gemini-2.5-pro"
+GOOD = '{"details": {"transaction_type": "groceries", "trasaction_amount": 1249.5, "confidence": 0.92}}'
+UNSURE = '{"details": {"transaction_type": "misc", "trasaction_amount": "na", "confidence": 0.35}}'
+
+
+class Throttled(Exception):
+    # Like google.api_core.exceptions.ResourceExhausted
+    code = 429
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def behavior(args, latency_ms, fails_hard_receipts):
+    """Output function of a stand-in model; receipts whose first byte is low enough are "hard"."""
+    def output(contents):
+        if random.random() < args.throttle:
+            time.sleep(0.02)
+            raise Throttled("429 Resource exhausted")
+        delay = latency_ms * random.uniform(0.75, 1.25)
+        if random.random() < args.stragglers:
+            delay *= args.straggler_factor
+        time.sleep(delay / 1000)
+        hard = contents[1].data[0] < args.hard * 256
+        return UNSURE if hard and fails_hard_receipts else GOOD
+
+    return output
+
+
+def run_mode(name, tiers, retries, args, receipts):
+    os.environ["EXTRACTION_TIERS"] = tiers
+    os.environ["EXTRACTION_RETRIES"] = str(retries)
+    os.environ["EXTRACTION_BACKOFF_SECONDS"] = str(args.backoff_ms / 1000)
+    latencies, errors, unresolved = [], [], []
+
+    def extract(receipt):
+        started = time.perf_counter()
+        try:
+            details, _ = module.extract_receipt_details(receipt)
+        except Exception as e:
+            errors.append(e)
+            return
+        latencies.append((time.perf_counter() - started) * 1000)
+        if module.extraction_problems(details, module.EXTRACTION_MIN_CONFIDENCE):
+            unresolved.append(details)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        module = standins.load_function("transaction-process-function", f"extraction_tiers_{name}")
+        models = {}
+        for tier in module.model_router.tiers:
+            model = models[tier.name] = tier.model.get()
+            model.latency = standins.Latency()
+            model.output = behavior(args, args.fast_ms if tier.name == FAST else args.pro_ms, tier.name == FAST)
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(extract, receipts))
+
+    # Calls are counted when they start, so abandoned ones are included
+    stats = module.model_router.stats()
+    fast_calls = models[FAST].calls if FAST in models else 0
+    pro_calls = models[PRO].calls if PRO in models else 0
+    return {
+        "latencies": latencies,
+        "errors": len(errors),
+        "unresolved": len(unresolved),
+        "served": stats["served"],
+        "retries": stats["retries"],
+        "hedges": stats["hedges"],
+        "calls": fast_calls + pro_calls,
+        "cost": pro_calls + fast_calls / args.cost_ratio,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--fast-ms", type=float, default=400, help="flash-lite latency")
+    parser.add_argument("--pro-ms", type=float, default=2000, help="pro latency")
+    parser.add_argument("--fast-deadline", type=float, default=2.5, help="flash-lite deadline in seconds")
+    parser.add_argument("--pro-deadline", type=float, default=10, help="pro deadline in seconds")
+    parser.add_argument("--hedge", type=float, default=0.8, help="hedge flash-lite after this many seconds")
+    parser.add_argument("--hard", type=float, default=0.15, help="fraction of receipts flash-lite can't read")
+    parser.add_argument("--throttle", type=float, default=0.05, help="fraction of calls failing with 429")
+    parser.add_argument("--stragglers", type=float, default=0.03, help="fraction of calls that are slow")
+    parser.add_argument("--straggler-factor", type=float, default=8)
+    parser.add_argument("--backoff-ms", type=float, default=200)
+    parser.add_argument("--cost-ratio", type=float, default=12, help="pro cost per call over flash-lite's")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    receipts = [os.urandom(1024) for _ in range(args.receipts)]
+    modes = {
+        "pro": (f"{PRO}=3600", 0),
+        "tiered": (f"{FAST}={args.fast_deadline},{PRO}={args.pro_deadline}", 2),
+        "hedged": (f"{FAST}={args.fast_deadline}/{args.hedge},{PRO}={args.pro_deadline}", 2),
+    }
+
+    print(f"{'mode':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>8}{'invalid':>9}{'calls':>7}{'cost':>8}"
+          f"{'retries':>9}{'hedges':>8}  served")
+    results = {}
+    for name, (tiers, retries) in modes.items():
+        result = results[name] = run_mode(name, tiers, retries, args, receipts)
+        latencies = result["latencies"]
+        print(f"{name:>8}{percentile(latencies, 0.5):>8.0f}ms{percentile(latencies, 0.95):>8.0f}ms"
+              f"{percentile(latencies, 0.99):>8.0f}ms{result['errors']:>8}{result['unresolved']:>9}{result['calls']:>7}"
+              f"{result['cost']:>8.1f}{result['retries']:>9}{result['hedges']:>8}  {result['served']}")
+
+    pro, tiered = results["pro"], results["tiered"]
+    print(f"\np50 {percentile(pro['latencies'], 0.5):.0f}ms -> {percentile(tiered['latencies'], 0.5):.0f}ms, "
+          f"cost {pro['cost']:.1f} -> {tiered['cost']:.1f} pro calls ({(1 - tiered['cost'] / pro['cost']) * 100:.0f}% lower)")
+
+
+if __name__ == "__main__":
+    main()
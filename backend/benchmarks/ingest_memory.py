@@ -0,0 +1,181 @@
+"""
+Peak memory of upload_form_data for large and concurrent uploads.
+
+Every measurement runs in a fresh subprocess that loads the transaction
+function against the local stand-ins and reports its peak resident set size
+(RSS) while it handles `--concurrency` uploads of the same receipt at once.
+The multipart request bodies are written to disk and read through werkzeug
+(install the function's requirements first), so the test requests add nothing
+to the peak.
+
+The receipts are real JPEGs: phone-camera-sized synthetic receipts (text
+lines, uneven lighting and sensor noise) of `--megapixels` each, or every
+image in `--receipts-dir`. With `--preprocess` the preprocessing stage decodes
+them with Pillow, as it does in production when PREPROCESS_ENABLED=1.
+
+Each receipt is run twice: "streaming" is the normal configuration, "in-memory"
+raises INLINE_MAX_BYTES so every upload is read into memory as it used to be.
+
+    python backend/benchmarks/ingest_memory.py --megapixels 12 24 48 --concurrency 4
+    python backend/benchmarks/ingest_memory.py --receipts-dir ./sample-receipts --preprocess
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import standins
+
+BOUNDARY = "ingest-memory-boundary"
+
+
+def synthetic_receipt(path, megapixels):
+    """Writes a phone-photo-like receipt JPEG of about `megapixels` and returns its size in bytes."""
+    from PIL import Image, ImageChops, ImageDraw
+
+    height = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    width = int(height * 3 / 4)
+    img = Image.linear_gradient("L").resize((width, height)).point(lambda v: 245 - v // 4)
+    draw = ImageDraw.Draw(img)
+    line = max(8, height // 80)
+    for y in range(line * 3, height - line * 3, line * 2):
+        draw.rectangle((width // 10, y, width - width // 10 - (y * 7919) % (width // 3), y + line), fill=40)
+    noise = Image.effect_noise((width, height), 24)
+    img = ImageChops.add(img, noise, scale=1.0, offset=-128)
+    Image.merge("RGB", (img, img.point(lambda v: v * 0.97), img.point(lambda v: v * 0.92))).save(
+        path, "JPEG", quality=92
+    )
+    return os.path.getsize(path)
+
+
+def write_body(receipt_path, body_path):
+    """Multipart body of an upload_form_data request for the receipt, built on disk."""
+    fields = {"transaction_time": str(int(time.time() * 1000)), "user": "memory-bench"}
+    with open(body_path, "wb") as body:
+        for name, value in fields.items():
+            body.write(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        body.write(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; '
+                   f'filename="{os.path.basename(receipt_path)}"\r\nContent-Type: image/jpeg\r\n\r\n'.encode())
+        with open(receipt_path, "rb") as receipt:
+            while chunk := receipt.read(1024 * 1024):
+                body.write(chunk)
+        body.write(f"\r\n--{BOUNDARY}--\r\n".encode())
+
+
+def reset_peak_rss():
+    """Starts a new peak RSS window (Linux); returns the current RSS in bytes."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+    return proc_status("VmRSS") or peak_rss()
+
+
+def peak_rss():
+    """Peak RSS in bytes since reset_peak_rss, or since the process started where that's unsupported."""
+    peak = proc_status("VmHWM")
+    if peak:
+        return peak
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def proc_status(field):
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def child(args):
+    from werkzeug.test import EnvironBuilder
+    from werkzeug.wrappers import Request
+
+    os.environ["PREPROCESS_ENABLED"] = "1" if args.preprocess else "0"
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        module = standins.load_function("transaction-process-function")
+        module.storage_client.get().keep_data = False
+        module.extraction_cache = None
+        module.MAX_UPLOAD_BYTES = max(module.MAX_UPLOAD_BYTES, os.path.getsize(args.body) + 1)
+        if args.mode == "in-memory":
+            module.INLINE_MAX_BYTES = module.MAX_UPLOAD_BYTES
+        # Creates the clients and warms up imports so they are part of the baseline
+        module.storage_client.get(), module.model_router.available()
+
+        bodies = [open(args.body, "rb") for _ in range(args.concurrency)]
+        requests = [
+            Request(EnvironBuilder(
+                method="POST", input_stream=body, content_length=os.path.getsize(args.body),
+                content_type=f"multipart/form-data; boundary={BOUNDARY}",
+            ).get_environ())
+            for body in bodies
+        ]
+        baseline = reset_peak_rss()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            statuses = [response[1] for response in pool.map(module.upload_form_data, requests)]
+        peak = peak_rss()
+    if any(status != 200 for status in statuses):
+        raise RuntimeError(f"Unexpected statuses: {statuses}")
+    print(json.dumps({"baseline": baseline, "peak": peak}))
+
+
+def measure(args, body_path, mode):
+    command = [sys.executable, __file__, "--child", "--body", body_path, "--mode", mode,
+               "--concurrency", str(args.concurrency)]
+    if args.preprocess:
+        command.append("--preprocess")
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["peak"] - result["baseline"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[12, 24, 48])
+    parser.add_argument("--receipts-dir", help="use the JPEGs in this directory instead of synthetic receipts")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--preprocess", action="store_true", help="run the preprocessing stage")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--body", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.receipts_dir:
+            receipts = sorted(
+                os.path.join(args.receipts_dir, name) for name in os.listdir(args.receipts_dir)
+                if name.lower().endswith((".jpg", ".jpeg"))
+            )
+        else:
+            receipts = []
+            for megapixels in args.megapixels:
+                path = os.path.join(workdir, f"receipt-{megapixels:g}mp.jpg")
+                synthetic_receipt(path, megapixels)
+                receipts.append(path)
+
+        print(f"{'receipt':>24}{'size':>10}{'concurrent':>12}{'streaming':>12}{'in-memory':>12}")
+        for receipt in receipts:
+            body_path = os.path.join(workdir, "body")
+            write_body(receipt, body_path)
+            peaks = [measure(args, body_path, mode) for mode in ("streaming", "in-memory")]
+            print(f"{os.path.basename(receipt)[-24:]:>24}{os.path.getsize(receipt) / (1024 * 1024):>8.1f}MB"
+                  f"{args.concurrency:>12}" + "".join(f"{peak / (1024 * 1024):>10.1f}MB" for peak in peaks))
+
+    print("\nPeak RSS of the subprocess above its RSS right before the uploads started")
+
+
+if __name__ == "__main__":
+    main()
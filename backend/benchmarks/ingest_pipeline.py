@@ -0,0 +1,74 @@
+"""
+Stage-by-stage timing comparison of the receipt ingest path:
+serial (upload -> download -> Gemini) vs pipelined (Gemini on the in-memory
+bytes while the GCS upload runs in the background).
+
+Runs against the stand-ins in standins.py, so the absolute numbers come from the
+latencies given on the command line (defaults are in the range we see in
+us-central1 for a ~1.5 MB phone photo).
+
+    python backend/benchmarks/ingest_pipeline.py --runs 20 --size-kb 1500
+"""
+import argparse
+import io
+import os
+import statistics
+
+import standins
+
+
+def run_mode(module, mode, runs, payload):
+    module.INGEST_MODE = mode
+    samples = {}
+    for i in range(runs):
+        _, _, _, timings = module.ingest_receipt(f"bench-{mode}-{i}.jpg", io.BytesIO(payload), "image/jpeg")
+        for stage, seconds in timings.items():
+            samples.setdefault(stage, []).append(seconds * 1000)
+    return samples
+
+
+def print_table(results):
+    stages = []
+    for samples in results.values():
+        stages.extend(stage for stage in samples if stage not in stages)
+    print(f"{'stage':<18}" + "".join(f"{mode + ' p50':>16}{mode + ' mean':>16}" for mode in results))
+    for stage in stages:
+        row = f"{stage:<18}"
+        for samples in results.values():
+            values = samples.get(stage)
+            if values:
+                row += f"{statistics.median(values):>14.1f}ms{statistics.mean(values):>14.1f}ms"
+            else:
+                row += f"{'-':>16}{'-':>16}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--size-kb", type=int, default=1500)
+    parser.add_argument("--upload-ms", type=float, default=120, help="GCS upload base latency")
+    parser.add_argument("--download-ms", type=float, default=80, help="GCS download base latency")
+    parser.add_argument("--per-mb-ms", type=float, default=60, help="GCS transfer cost per MB")
+    parser.add_argument("--model-ms", type=float, default=900, help="Gemini extraction latency")
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    module = standins.load_function("transaction-process-function")
+    jitter = args.jitter_ms / 1000
+    module.storage_client.get().upload_latency = standins.Latency(args.upload_ms / 1000, jitter, args.per_mb_ms / 1000)
+    module.storage_client.get().download_latency = standins.Latency(args.download_ms / 1000, jitter, args.per_mb_ms / 1000)
+    for tier in module.model_router.tiers:
+        tier.model.get().latency = standins.Latency(args.model_ms / 1000, jitter)
+
+    payload = os.urandom(args.size_kb * 1024)
+    results = {mode: run_mode(module, mode, args.runs, payload) for mode in ("serial", "pipelined")}
+    print_table(results)
+
+    serial = statistics.median(results["serial"]["ingest_total"])
+    pipelined = statistics.median(results["pipelined"]["ingest_total"])
+    print(f"\ningest_total p50: {serial:.1f}ms -> {pipelined:.1f}ms ({(1 - pipelined / serial) * 100:.0f}% lower)")
+
+
+if __name__ == "__main__":
+    main()
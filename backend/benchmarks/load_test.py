@@ -0,0 +1,310 @@
+"""
+Offline load test of upload_form_data, get_user_data and query_gemini.
+
+Seeds the in-memory Firestore stand-in with `--users` synthetic users of
+`--receipts` receipts each, then runs every scenario for `--requests`
+requests, `--concurrency` at a time:
+
+- upload: upload_form_data with a freshly generated receipt image
+- list: get_user_data, last_30_days pages for a random user
+- summary: get_user_data totals_by_category, daily_spend or top_merchants
+- chat: query_gemini with a user's recent transactions as context
+
+The three functions share one Firestore stand-in, so uploads show up in the
+later scenarios and invalidate get_user_data's cache as they do in
+production. The functions' caches run in their default configuration.
+
+For each scenario it reports throughput, p50/p95/p99 latency, errors, the
+peak of Python allocations (tracemalloc), and Firestore reads and model calls
+per request. The stand-ins' latencies come from --model-ms, --firestore-ms,
+--gcs-ms and --jitter-ms. Nothing needs credentials or network, so it runs in
+CI (needs `werkzeug` and `pillow`, both in the functions' requirements):
+
+    python backend/benchmarks/load_test.py --json load.json
+    python backend/benchmarks/load_test.py --baseline load.json --tolerance 0.25
+
+It exits with status 1 if a request failed. With --baseline, it also exits
+with 1 if a scenario's p95 latency, peak memory or reads per request grew by
+more than the tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import standins
+from query_context import MERCHANTS, QUESTIONS, USER_DATA, build_request
+
+SCENARIOS = ("upload", "list", "summary", "chat")
+SUMMARY_TYPES = ("totals_by_category", "daily_spend", "top_merchants")
+COLLECTION = "sample_transactions"
+# (metric, absolute slack) compared against the baseline; the slack keeps tiny values from flapping
+REGRESSION_METRICS = (("p95_ms", 5.0), ("peak_mb", 1.0), ("reads_per_request", 0.5))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def seed_transactions(firestore, users, receipts, now):
+    """Writes `receipts` transactions for each of `users` users, over the last 180 days."""
+    docs = firestore.collections.setdefault(COLLECTION, {})
+    for user in users:
+        for _ in range(receipts):
+            category = random.choice(list(MERCHANTS))
+            merchant = random.choice(MERCHANTS[category])
+            amount = round(random.uniform(40, 6000), 2)
+            docs[uuid.uuid4().hex[:20]] = {
+                "user": user,
+                "transaction_time": now - timedelta(minutes=random.randint(0, 180 * 24 * 60)),
+                "gcs_uri": f"gs://wallet-images1/{uuid.uuid4().hex[:12]}.jpg",
+                "details": json.dumps({"details": {
+                    "transaction_type": category, "trasaction_amount": amount, "transaction_merchant": merchant,
+                }}),
+                "transaction_type": category,
+                "transaction_amount": amount,
+                "transaction_merchant": merchant,
+                "transaction_location": "Bengaluru",
+                "transaction_items": f"{random.randint(1, 12)} items",
+                "parse_status": "ok",
+                "status": "done",
+            }
+
+
+def chat_contexts(firestore, users, size):
+    """The `size` latest transactions of every user, as get_user_data returns them to the app."""
+    by_user = {user: [] for user in users}
+    for doc_id, data in firestore.collections[COLLECTION].items():
+        if data["user"] in by_user:
+            by_user[data["user"]].append({
+                "id": doc_id,
+                **data,
+                "transaction_time": data["transaction_time"].strftime("%a, %d %b %Y %H:%M:%S GMT"),
+                "_sort": data["transaction_time"],
+            })
+    contexts = {}
+    for user, transactions in by_user.items():
+        transactions.sort(key=lambda transaction: transaction.pop("_sort"), reverse=True)
+        contexts[user] = {"data": transactions[:size], "next_cursor": None}
+    return contexts
+
+
+def receipt_image():
+    """A small JPEG that differs from every other one, so uploads miss the extraction cache."""
+    from PIL import Image
+
+    image = Image.new("RGB", (400, 600), "white")
+    for _ in range(40):
+        image.putpixel((random.randrange(400), random.randrange(600)), tuple(random.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def upload_request(user):
+    from werkzeug.test import EnvironBuilder
+    from werkzeug.wrappers import Request
+
+    builder = EnvironBuilder(method="POST", data={
+        "file": (io.BytesIO(receipt_image()), f"receipt-{uuid.uuid4().hex[:12]}.jpg", "image/jpeg"),
+        "transaction_time": str(int(time.time() * 1000)),
+        "user": user,
+    })
+    return Request(builder.get_environ())
+
+
+def build_scenarios(modules, users, contexts):
+    """Scenario name -> (handler, function building the index-th request)."""
+    upload, user_data, chat = (
+        modules["transaction-process-function"], modules["get-user-data-function"], modules["query-gemini-function"]
+    )
+    return {
+        "upload": (upload.upload_form_data, lambda index: upload_request(random.choice(users))),
+        "list": (user_data.get_user_data, lambda index: build_request({
+            "collection": COLLECTION, "query_type": "last_30_days", "user": random.choice(users), "page_size": 50,
+        })),
+        "summary": (user_data.get_user_data, lambda index: build_request({
+            "collection": COLLECTION, "query_type": random.choice(SUMMARY_TYPES), "range": "last_30_days",
+            "user": random.choice(users),
+        })),
+        "chat": (chat.query_gemini, lambda index: build_request({
+            "user_data": USER_DATA, "user_query": random.choice(QUESTIONS), "context": contexts[random.choice(users)],
+        })),
+    }
+
+
+def run_scenario(handler, make_request, requests, concurrency, firestore, trace_memory):
+    latencies, errors = [], []
+    # Chat replies that came from the model carry `usage`; cache and intent answers don't
+    model_replies = []
+    lock = threading.Lock()
+
+    def send(index):
+        request = make_request(index)
+        started = time.perf_counter()
+        response = handler(request)
+        elapsed = (time.perf_counter() - started) * 1000
+        status = response[1] if isinstance(response, tuple) else response.status_code
+        body = response[0] if isinstance(response, tuple) else None
+        with lock:
+            latencies.append(elapsed)
+            if isinstance(body, dict) and "usage" in body:
+                model_replies.append(index)
+            if status >= 400:
+                errors.append(status)
+
+    reads_before = firestore.reads
+    # Every stand-in model, including the cached-content ones created during the run
+    calls_before = standins.StubGenerativeModel.total_calls()
+    if trace_memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, range(requests)))
+    elapsed = time.perf_counter() - started
+    peak_mb = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_mb = round((peak - baseline) / (1024 * 1024), 2)
+
+    model_calls = standins.StubGenerativeModel.total_calls() - calls_before
+    return {
+        "requests": requests,
+        "model_calls": model_calls,
+        "model_replies": len(model_replies),
+        "errors": len(errors),
+        "error_statuses": sorted(set(errors)),
+        "throughput": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        "peak_mb": peak_mb,
+        "reads_per_request": round((firestore.reads - reads_before) / requests, 2),
+        "model_calls_per_request": round(model_calls / requests, 2),
+    }
+
+
+def coalesced(module):
+    """Requests that shared a model call through single_flight so far."""
+    return module.single_flight.stats()["coalesced"] if module.single_flight else 0
+
+
+def regressions(results, baseline, tolerance):
+    """(scenario, metric, baseline value, current value) for every metric that got worse than allowed."""
+    found = []
+    for scenario, current in results.items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        for metric, slack in REGRESSION_METRICS:
+            if current.get(metric) is None or previous.get(metric) is None:
+                continue
+            if current[metric] > previous[metric] * (1 + tolerance) + slack:
+                found.append((scenario, metric, previous[metric], current[metric]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--receipts", type=int, default=2000, help="receipts per user")
+    parser.add_argument("--context", type=int, default=300, help="transactions sent with each chat question")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--model-ms", type=float, default=300)
+    parser.add_argument("--firestore-ms", type=float, default=10)
+    parser.add_argument("--gcs-ms", type=float, default=30)
+    parser.add_argument("--jitter-ms", type=float, default=0, help="uniform jitter added to every stand-in latency")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, which slows Python code down")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run (--json) to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative growth over the baseline")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    standins.install()
+    modules = {
+        directory: standins.load_function(directory)
+        for directory in ("transaction-process-function", "get-user-data-function", "query-gemini-function")
+    }
+
+    def latency(ms):
+        return standins.Latency(ms / 1000, args.jitter_ms / 1000)
+
+    firestore = standins.FakeFirestoreClient()
+    firestore.read_latency = firestore.write_latency = latency(args.firestore_ms)
+    for module in modules.values():
+        module.db.factory = lambda: firestore
+    storage = modules["transaction-process-function"].storage_client.get()
+    storage.upload_latency = storage.download_latency = latency(args.gcs_ms)
+    extraction_models = [tier.model.get() for tier in modules["transaction-process-function"].model_router.tiers]
+    chat_model = modules["query-gemini-function"].model.get().plain()
+    chat_model.output = "You spent 4,230 at Starbucks in July across 11 visits."
+    models = (*extraction_models, chat_model)
+    for model in models:
+        model.latency = latency(args.model_ms)
+
+    users = [f"load-user-{index:03d}" for index in range(args.users)]
+    seeding_started = time.perf_counter()
+    seed_transactions(firestore, users, args.receipts, datetime.now(timezone.utc))
+    contexts = chat_contexts(firestore, users, args.context)
+    print(f"seeded {args.users} users x {args.receipts} receipts in {time.perf_counter() - seeding_started:.1f}s")
+
+    scenarios = build_scenarios(modules, users, contexts)
+    chat = modules["query-gemini-function"]
+    results = {}
+    print(f"{'scenario':>10}{'req/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'peak':>10}{'reads/req':>11}"
+          f"{'model/req':>11}  errors")
+    for name in args.scenarios:
+        handler, make_request = scenarios[name]
+        coalesced_before = coalesced(chat)
+        result = run_scenario(
+            handler, make_request, args.requests, args.concurrency, firestore, trace_memory=not args.no_memory,
+        )
+        results[name] = result
+        # Each chat reply from the model is one generate_content call, unless it joined one in flight
+        expected_calls = result["model_replies"] - (coalesced(chat) - coalesced_before)
+        if name == "chat" and result["model_calls"] != expected_calls:
+            raise RuntimeError(f"Counted {result['model_calls']} model calls for {expected_calls} model replies")
+        peak = f"{result['peak_mb']:.1f}MB" if result["peak_mb"] is not None else "-"
+        print(f"{name:>10}{result['throughput']:>9.1f}{result['p50_ms']:>8.1f}ms{result['p95_ms']:>8.1f}ms"
+              f"{result['p99_ms']:>8.1f}ms{peak:>10}{result['reads_per_request']:>11.2f}"
+              f"{result['model_calls_per_request']:>11.2f}  {result['errors']} {result['error_statuses'] or ''}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "scenarios": results}, f, indent=2)
+
+    failed = False
+    if any(result["errors"] for result in results.values()):
+        print("\nSome requests failed.")
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for scenario, metric, previous, current in found:
+            print(f"REGRESSION {scenario} {metric}: {previous} -> {current}")
+        if not found:
+            print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
+        failed = failed or bool(found)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Before/after benchmark for the receipt preprocessing stage.
+
+For every image in a directory it reports the original and preprocessed size
+and the preprocessing time. With --extract it also runs the Gemini extraction
+on both versions (real Vertex AI, needs GCP credentials plus GCP_PROJECT and
+GCP_REGION) and reports model latency and whether category and amount agree.
+
+    python backend/benchmarks/preprocess_receipts.py ./sample-receipts
+    python backend/benchmarks/preprocess_receipts.py ./sample-receipts --extract
+    python backend/benchmarks/preprocess_receipts.py ./sample-receipts --extract --crop
+"""
+import argparse
+import importlib.util
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+FUNCTION_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cloud-functions", "transaction-process-function"
+)
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".heic"}
+
+
+def load_transaction_function():
+    sys.path.insert(0, FUNCTION_DIR)
+    spec = importlib.util.spec_from_file_location("transaction_process", os.path.join(FUNCTION_DIR, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def summarize(details):
+    """(category, amount) from the model output, or None if it isn't parseable JSON."""
+    match = re.search(r"\{.*\}", details or "", re.DOTALL)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return None
+    data = data.get("details", data)
+    amount = re.sub(r"[^0-9.]", "", str(data.get("trasaction_amount", data.get("transaction_amount", ""))))
+    return str(data.get("transaction_type", "")).strip().lower(), amount
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("receipts_dir")
+    parser.add_argument("--max-edge", type=int, default=1600)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--no-grayscale", action="store_true")
+    parser.add_argument("--crop", action="store_true", help="also crop to the paper")
+    parser.add_argument("--extract", action="store_true", help="also compare Gemini extraction (live Vertex AI)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, FUNCTION_DIR)
+    from preprocess import preprocess_receipt
+
+    options = {
+        "max_edge": args.max_edge,
+        "grayscale": not args.no_grayscale,
+        "crop": args.crop,
+        "quality": args.quality,
+    }
+    module = load_transaction_function() if args.extract else None
+
+    paths = sorted(
+        os.path.join(args.receipts_dir, name)
+        for name in os.listdir(args.receipts_dir)
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    )
+    if not paths:
+        parser.error(f"No images found in {args.receipts_dir}")
+
+    rows = []
+    for path in paths:
+        with open(path, "rb") as f:
+            original = f.read()
+        (processed, content_type, info), prep_ms = timed(preprocess_receipt, original, **options)
+        row = {"name": os.path.basename(path), "before": len(original), "after": len(processed), "prep_ms": prep_ms}
+        if module:
+            (before_details, _), row["model_before_ms"] = timed(module.extract_receipt_details, original)
+            (after_details, _), row["model_after_ms"] = timed(module.extract_receipt_details, processed)
+            row["equivalent"] = summarize(before_details) == summarize(after_details)
+        rows.append(row)
+
+        line = f"{row['name']:<32}{row['before'] / 1024:>10.1f}KB{row['after'] / 1024:>10.1f}KB{prep_ms:>10.1f}ms"
+        if module:
+            line += f"{row['model_before_ms']:>10.0f}ms{row['model_after_ms']:>10.0f}ms  {'same' if row['equivalent'] else 'DIFFERENT'}"
+        print(line)
+
+    before = sum(row["before"] for row in rows)
+    after = sum(row["after"] for row in rows)
+    print(f"\n{len(rows)} receipts: {before / 1024:.0f}KB -> {after / 1024:.0f}KB ({(1 - after / before) * 100:.0f}% smaller), "
+          f"preprocess p50 {statistics.median(row['prep_ms'] for row in rows):.1f}ms")
+    if module:
+        print(f"model p50 {statistics.median(row['model_before_ms'] for row in rows):.0f}ms -> "
+              f"{statistics.median(row['model_after_ms'] for row in rows):.0f}ms, "
+              f"{sum(row['equivalent'] for row in rows)}/{len(rows)} extractions equivalent")
+
+
+if __name__ == "__main__":
+    main()
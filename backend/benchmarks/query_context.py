@@ -0,0 +1,169 @@
+"""
+Input tokens and latency of query_gemini per request, before and after the
+prompt changes.
+
+Generates synthetic transaction histories of increasing size, in the shape
+get_user_data returns them, and sends a fixed set of questions against the
+stand-in model:
+
+- "legacy": the original prompt. Instructions and examples are inline, and the
+  whole history is rendered with str().
+- "compact": the static part is a system instruction and the whole history
+  is serialized as a table.
+- "retrieval": as compact, but only the relevant transactions and a summary
+  are sent, within CONTEXT_TOKEN_BUDGET.
+
+In both of these the questions form one chat session, so from the second
+question on the system instruction and the table are served from a context
+cache when they fit between CONTEXT_CACHE_MIN_TOKENS and
+CONTEXT_CACHE_MAX_TOKENS.
+
+"input" counts every prompt token. "uncached" leaves out the tokens served
+from the context cache, which are billed at a discount and don't need to be
+re-sent. Model latency is modelled as a base cost plus a cost per 1k uncached
+prompt tokens.
+
+    python backend/benchmarks/query_context.py --sizes 100 1000 5000 --budget 2000
+    python backend/benchmarks/query_context.py --no-context-cache
+"""
+import argparse
+import contextlib
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+import standins
+
+QUESTIONS = [
+    "How much did I spend on groceries?",
+    "What was my biggest expense?",
+    "What did I buy last week?",
+    "How much did I spend at Starbucks in July?",
+    "Show my medicine purchases this month",
+    "What was my last transaction?",
+]
+MERCHANTS = {
+    "groceries": ["DMart", "Reliance Fresh", "More Supermarket", "Nature's Basket"],
+    "dining": ["Starbucks", "Truffles", "Meghana Foods", "Third Wave Coffee"],
+    "health": ["Apollo Pharmacy", "MedPlus", "Manipal Hospital"],
+    "utility": ["BESCOM", "Airtel", "BWSSB"],
+    "entertainment": ["PVR Cinemas", "BookMyShow", "INOX"],
+    "misc": ["Amazon", "Decathlon", "Croma"],
+}
+
+
+def build_history(size, now):
+    transactions = []
+    for index in range(size):
+        category = random.choice(list(MERCHANTS))
+        merchant = random.choice(MERCHANTS[category])
+        amount = round(random.uniform(40, 6000), 2)
+        moment = now - timedelta(minutes=random.randint(0, 180 * 24 * 60))
+        details = (
+            '```json\n{"details": {"transaction_type": "%s", "trasaction_amount": "%s", '
+            '"transaction_merchant": "%s", "transaction_location": "Bengaluru", '
+            '"transaction_details": "%d items"}}\n```' % (category, amount, merchant, random.randint(1, 12))
+        )
+        transactions.append({
+            "id": f"txn{index:06d}",
+            "user": "benchmark",
+            "transaction_time": moment.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+            "gcs_uri": f"gs://wallet-images1/receipt-{index}.jpg",
+            "details": details,
+            "transaction_type": category,
+            "transaction_amount": amount,
+            "transaction_merchant": merchant,
+            "transaction_location": "Bengaluru",
+            "transaction_items": f"{random.randint(1, 12)} items",
+            "parse_status": "ok",
+            "status": "done",
+        })
+    transactions.sort(key=lambda transaction: transaction["id"])
+    return {"data": transactions, "next_cursor": None}
+
+
+def build_request(payload):
+    from werkzeug.test import EnvironBuilder
+    from werkzeug.wrappers import Request
+
+    return Request(EnvironBuilder(method="POST", json=payload).get_environ())
+
+
+USER_DATA = {"name": "Benchmark", "email": "benchmark@example.com", "picture": "https://example.com/avatar.png"}
+
+
+def legacy_prompt(system_instruction, history, question):
+    """The shape of the prompt query_gemini used to send: everything inline, data via str()."""
+    return (
+        f"{system_instruction}\n[CONTEXT]:\n{history}\n\n[USER_DATA]:\n{USER_DATA}\n\n"
+        f"[CHAT_HISTORY]:\n\n\n[USER_QUERY]:\n\"{question}\"\n\n[YOUR RESPONSE]:\n"
+    )
+
+
+def run(module, history, mode):
+    input_tokens, uncached_tokens, latencies = [], [], []
+    legacy_model = standins.StubGenerativeModel("legacy")
+    legacy_model.latency = module.model.get().plain().latency
+    module.RETRIEVAL_ENABLED = mode == "retrieval"
+    for question in QUESTIONS:
+        started = time.perf_counter()
+        if mode == "legacy":
+            usage = legacy_model.generate_content(legacy_prompt(module.SYSTEM_INSTRUCTION, history, question)).usage_metadata
+            usage = {"prompt_tokens": usage.prompt_token_count, "cached_tokens": usage.cached_content_token_count}
+        else:
+            request = build_request({
+                "user_data": USER_DATA,
+                "user_query": question,
+                "context": history,
+                "chat_history": [],
+            })
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                response = module.query_gemini(request)
+            if response[1] != 200:
+                raise RuntimeError(f"Unexpected response: {response}")
+            usage = response[0]["usage"]
+        latencies.append((time.perf_counter() - started) * 1000)
+        input_tokens.append(usage["prompt_tokens"])
+        uncached_tokens.append(usage["prompt_tokens"] - (usage["cached_tokens"] or 0))
+    return input_tokens, uncached_tokens, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--budget", type=int, default=2000, help="CONTEXT_TOKEN_BUDGET")
+    parser.add_argument("--model-ms", type=float, default=400, help="model latency without prompt")
+    parser.add_argument("--per-1k-tokens-ms", type=float, default=15, help="model latency per 1k prompt tokens")
+    parser.add_argument("--no-context-cache", action="store_true", help="simulate a failing context cache")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    standins.install()
+    standins.StubCachedContent.fail = args.no_context_cache
+    module = standins.load_function("query-gemini-function")
+    module.single_flight = None
+    # Measure the model path; common questions would otherwise be answered without it
+    module.intent_router = None
+    module.reply_cache = None
+    module.CONTEXT_TOKEN_BUDGET = args.budget
+    model = module.model.get().plain()
+    # Latency.per_mb is per megabyte of prompt; at ~4 bytes per token 1 MB is ~262k tokens
+    model.latency = standins.Latency(args.model_ms / 1000, 0, args.per_1k_tokens_ms / 1000 * 262.144)
+    model.output = "ok"
+
+    now = datetime.now(timezone.utc)
+    print(f"{'history':>8}{'mode':>11}{'input p50':>11}{'uncached p50':>14}{'latency p50':>13}{'mean':>11}")
+    for size in args.sizes:
+        history = build_history(size, now)
+        for mode in ("legacy", "compact", "retrieval"):
+            tokens, uncached, latencies = run(module, history, mode)
+            print(f"{size:>8}{mode:>11}{statistics.median(tokens):>11.0f}{statistics.median(uncached):>14.0f}"
+                  f"{statistics.median(latencies):>11.1f}ms{statistics.mean(latencies):>9.1f}ms")
+    print(f"\ncontext caches: {module.model.get().stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Latency of query_gemini for repeated dashboard-style questions, with and
+without the reply cache.
+
+Sends `--requests` questions drawn from a small set (with the phrasing
+varied in case, punctuation and filler words) over the same transactions
+against the stand-in model. Halfway through, one transaction is added, as if
+a receipt had just been uploaded, so the following questions miss the cache
+until they are asked again. `--store` adds the Firestore tier (in-memory
+stand-in) and empties the in-process tier after three quarters of the
+requests, like a new instance.
+
+    python backend/benchmarks/query_repeat.py --requests 200 --model-ms 1500
+"""
+import argparse
+import contextlib
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timezone
+
+import standins
+from query_context import USER_DATA, build_history, build_request
+
+QUESTIONS = [
+    "How much did I spend at Starbucks in July?",
+    "Which merchants do I spend the most on?",
+    "What did I buy last week?",
+    "Show my medicine purchases this month",
+    "Am I spending more on dining than groceries?",
+]
+VARIANTS = [
+    lambda question: question,
+    lambda question: question.lower().rstrip("?"),
+    lambda question: f"Please {question[0].lower()}{question[1:]}",
+    lambda question: f"Hey, can you tell me: {question}",
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(module, history, requests, restart):
+    latencies = []
+    data = list(history["data"])
+    for index in range(requests):
+        if index == requests // 2:
+            data = data + [dict(data[0], id="txn-new", transaction_amount=123.0)]
+        if restart and index == requests * 3 // 4:
+            module.reply_cache._entries.clear()
+        question = random.choice(VARIANTS)(random.choice(QUESTIONS))
+        request = build_request({"user_data": USER_DATA, "user_query": question, "context": {"data": data}})
+        started = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            response = module.query_gemini(request)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response[1] != 200:
+            raise RuntimeError(f"Unexpected response: {response}")
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--history", type=int, default=300, help="transactions in the context")
+    parser.add_argument("--model-ms", type=float, default=1500)
+    parser.add_argument("--store", action="store_true", help="add the persistent tier")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.store:
+        os.environ["REPLY_CACHE_COLLECTION"] = "query_reply_cache"
+    standins.install()
+    module = standins.load_function("query-gemini-function")
+    module.single_flight = None
+    module.intent_router = None
+    model = module.model.get().plain()
+    model.latency = standins.Latency(args.model_ms / 1000, args.model_ms / 10000)
+    model.output = "You spent 4,230 at Starbucks in July across 11 visits."
+    cache = module.reply_cache
+
+    print(f"{'cache':>6}{'p50':>10}{'p95':>10}{'mean':>10}  stats")
+    for enabled in (False, True):
+        random.seed(args.seed)
+        history = build_history(args.history, datetime.now(timezone.utc))
+        module.reply_cache = cache if enabled else None
+        latencies = run(module, history, args.requests, restart=enabled and args.store)
+        stats = cache.stats() if enabled else {}
+        fields = ("memory_hits", "store_hits", "misses", "hit_rate", "persistent")
+        summary = {name: stats[name] for name in fields} if stats else ""
+        print(f"{'on' if enabled else 'off':>6}{percentile(latencies, 0.5):>8.1f}ms{percentile(latencies, 0.95):>8.1f}ms"
+              f"{statistics.mean(latencies):>8.1f}ms  {summary}")
+
+
+if __name__ == "__main__":
+    main()
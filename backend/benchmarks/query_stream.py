@@ -0,0 +1,79 @@
+"""
+Time to first byte and total time of query_gemini replies as one JSON
+response vs streamed as Server-Sent Events or NDJSON.
+
+The stand-in model takes `--model-ms` before the first output and then
+`--per-chunk-ms` for each `--chunk-bytes` of the reply, so a JSON response
+can only start once the whole reply is generated while a stream starts after
+the first chunk.
+
+    python backend/benchmarks/query_stream.py --reply-chars 200 1500 4000 --runs 5
+"""
+import argparse
+import contextlib
+import os
+import statistics
+import time
+from datetime import datetime, timezone
+
+import standins
+from query_context import USER_DATA, build_history, build_request
+
+QUESTION = "Summarize what I spent on groceries and dining this month"
+
+
+def run_once(module, history, fmt):
+    payload = {"user_data": USER_DATA, "user_query": QUESTION, "context": history, "chat_history": []}
+    if fmt != "json":
+        payload["stream"] = fmt
+    request = build_request(payload)
+    started = time.perf_counter()
+    first = None
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        response = module.query_gemini(request)
+        if isinstance(response, tuple):
+            if response[1] != 200:
+                raise RuntimeError(f"Unexpected response: {response}")
+            first = time.perf_counter()
+        else:
+            for piece in response.response:
+                if first is None and piece:
+                    first = time.perf_counter()
+    finished = time.perf_counter()
+    return (first - started) * 1000, (finished - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reply-chars", type=int, nargs="+", default=[200, 1500, 4000])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--model-ms", type=float, default=400, help="latency before the first output")
+    parser.add_argument("--per-chunk-ms", type=float, default=40, help="generation time per chunk")
+    parser.add_argument("--chunk-bytes", type=int, default=64)
+    args = parser.parse_args()
+
+    standins.install()
+    module = standins.load_function("query-gemini-function")
+    module.single_flight = None
+    # Measure the model path; common questions would otherwise be answered without it
+    module.intent_router = None
+    module.reply_cache = None
+    model = module.model.get().plain()
+    model.latency = standins.Latency(args.model_ms / 1000)
+    model.stream_chunk_bytes = args.chunk_bytes
+    # Latency.per_mb is per megabyte, so scale the per-chunk cost up to one
+    model.output_latency = standins.Latency(per_mb=args.per_chunk_ms / 1000 * (1024 * 1024) / args.chunk_bytes)
+    history = build_history(50, datetime.now(timezone.utc))
+
+    print(f"{'reply':>7}{'mode':>8}{'first byte p50':>16}{'total p50':>12}")
+    for chars in args.reply_chars:
+        model.output = ("You spent 4,230 on groceries and 1,870 on dining. " * (chars // 50 + 1))[:chars]
+        for fmt in ("json", "sse", "ndjson"):
+            results = [run_once(module, history, fmt) for _ in range(args.runs)]
+            first = statistics.median(result[0] for result in results)
+            total = statistics.median(result[1] for result in results)
+            print(f"{chars:>7}{fmt:>8}{first:>14.1f}ms{total:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
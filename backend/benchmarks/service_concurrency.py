@@ -0,0 +1,92 @@
+"""
+Throughput of query_gemini one request at a time, like a Cloud Function
+instance, vs in the service mode (backend/service) with its default limit.
+
+Sends `--requests` chat questions, `--concurrency` at a time, through the
+threaded ASGI wrapper over httpx's ASGI transport (no network) against the
+stand-in model. Intents, the reply cache and single-flight are off so that
+every request reaches the model. Needs the service's starlette plus httpx and werkzeug.
+
+    python backend/benchmarks/service_concurrency.py --requests 100 --concurrency 100 --model-ms 1000
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import standins
+from query_context import USER_DATA, build_history
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "service")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(service, limit, payloads, concurrency):
+    import httpx
+
+    app = service.create_app(limits={"query_gemini": (limit, len(payloads))})
+    gate = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], []
+
+    async def send(client, payload):
+        async with gate:
+            started = time.perf_counter()
+            response = await client.post("/query-gemini", json=payload)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses.append(response.status_code)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://service", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(send(client, payload) for payload in payloads))
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies, statuses, app.state.endpoints["/query-gemini"].stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=100, help="requests sent at once")
+    parser.add_argument("--limit", type=int, default=None, help="service limit (default: QUERY_GEMINI_CONCURRENCY or 128)")
+    parser.add_argument("--history", type=int, default=300, help="transactions in the context")
+    parser.add_argument("--model-ms", type=float, default=1000)
+    args = parser.parse_args()
+
+    os.environ["INTENTS_ENABLED"] = "0"
+    os.environ["REPLY_CACHE_ENABLED"] = "0"
+    os.environ["SINGLE_FLIGHT_ENABLED"] = "0"
+    standins.install()
+    sys.path.insert(0, SERVICE_DIR)
+    import threaded_app as service
+
+    module = service.load_function("query-gemini-function")
+    model = module.model.get().plain()
+    model.latency = standins.Latency(args.model_ms / 1000, args.model_ms / 10000)
+    model.output = "You spent 4,230 at Starbucks in July across 11 visits."
+    limit = args.limit or int(os.environ.get("QUERY_GEMINI_CONCURRENCY", service.ENDPOINTS["/query-gemini"][2]))
+
+    history = build_history(args.history, datetime.now(timezone.utc))
+    payloads = [
+        {"user_data": USER_DATA, "user_query": f"What did I spend on day {index}?", "context": {"data": history["data"]}}
+        for index in range(args.requests)
+    ]
+
+    print(f"{'mode':>10}{'limit':>7}{'wall':>10}{'req/s':>9}{'p50':>10}{'p95':>10}{'peak':>6}  statuses")
+    for mode, mode_limit in (("function", 1), ("service", limit)):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            elapsed, latencies, statuses, stats = asyncio.run(run(service, mode_limit, payloads, args.concurrency))
+        counts = {status: statuses.count(status) for status in sorted(set(statuses))}
+        print(f"{mode:>10}{mode_limit:>7}{elapsed:>9.2f}s{len(payloads) / elapsed:>9.1f}"
+              f"{percentile(latencies, 0.5):>8.0f}ms{percentile(latencies, 0.95):>8.0f}ms"
+              f"{stats['peak_in_flight']:>6}  {counts}")
+
+
+if __name__ == "__main__":
+    main()
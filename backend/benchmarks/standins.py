@@ -0,0 +1,647 @@
+"""
+Local stand-ins for the Google Cloud clients used by the cloud functions.
+
+The benchmarks import each function's main.py unchanged; `install()` registers
+lightweight replacements for the GCP / Vertex AI modules in sys.modules first,
+so the functions run on a plain machine with no credentials or network.
+Latencies are simulated with time.sleep so thread overlap behaves like real I/O.
+"""
+import importlib.util
+import math
+import operator
+import os
+import random
+import sys
+import threading
+import time
+import types
+import uuid
+import weakref
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "service")
+
+
+class Latency:
+    """A fixed latency plus uniform jitter and an optional per-megabyte cost, in seconds."""
+
+    def __init__(self, base=0.0, jitter=0.0, per_mb=0.0):
+        self.base = base
+        self.jitter = jitter
+        self.per_mb = per_mb
+
+    def sleep(self, size_bytes=0):
+        delay = self.base + random.uniform(0, self.jitter) + self.per_mb * size_bytes / (1024 * 1024)
+        if delay > 0:
+            time.sleep(delay)
+
+
+# --- Cloud Storage ---
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = None
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.client.upload_latency.sleep(len(data))
+        self._store(bytes(data), content_type)
+
+    def upload_from_file(self, file_obj, content_type=None, rewind=False):
+        if rewind:
+            file_obj.seek(0)
+        chunk_size = self.chunk_size or 256 * 1024
+        chunks = []
+        size = 0
+        for chunk in iter(lambda: file_obj.read(chunk_size), b""):
+            size += len(chunk)
+            if self.bucket.client.keep_data:
+                chunks.append(chunk)
+        self.bucket.client.upload_latency.sleep(size)
+        self._store(b"".join(chunks), content_type)
+
+    def _store(self, data, content_type):
+        with self.bucket.client.lock:
+            self.bucket.objects[self.name] = (data if self.bucket.client.keep_data else b"", content_type)
+
+    def download_as_bytes(self):
+        data, _ = self.bucket.objects[self.name]
+        self.bucket.client.download_latency.sleep(len(data))
+        return data
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.objects = client.objects.setdefault(name, {})
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+class FakeSession:
+    def __init__(self):
+        self.adapters = {}
+
+    def mount(self, prefix, adapter):
+        self.adapters[prefix] = adapter
+
+
+class FakeStorageClient:
+    def __init__(self, *args, **kwargs):
+        self.objects = {}
+        # Set to False to drop object contents (memory benchmarks)
+        self.keep_data = True
+        self.lock = threading.Lock()
+        self.upload_latency = Latency()
+        self.download_latency = Latency()
+        # The real client's authorized requests session; the service mode resizes its pool
+        self._http = FakeSession()
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+
+# --- Firestore ---
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+SERVER_TIMESTAMP = object()
+
+
+class FieldFilter:
+    def __init__(self, field_path, op_string, value):
+        self.field_path = field_path
+        self.op_string = op_string
+        self.value = value
+
+
+class Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+
+def _write(docs, doc_id, data, merge):
+    """Applies a set() to the in-memory documents, resolving Increment and SERVER_TIMESTAMP."""
+    current = docs.get(doc_id, {}) if merge else {}
+    resolved = {}
+    for field, value in data.items():
+        if isinstance(value, Increment):
+            value = (current.get(field) or 0) + value.value
+        elif value is SERVER_TIMESTAMP:
+            value = time.time()
+        resolved[field] = value
+    docs[doc_id] = {**current, **resolved}
+
+
+class Conflict(Exception):
+    """Like google.api_core.exceptions.Conflict, raised by create() on an existing document."""
+    code = 409
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return self._data[field_path]
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self.client = client
+        self.collection_path = collection
+        self.id = doc_id
+
+    def get(self):
+        self.client.read_latency.sleep()
+        with self.client.lock:
+            self.client.reads += 1
+            data = self.client.collections.get(self.collection_path, {}).get(self.id)
+            return FakeDocumentSnapshot(self, dict(data) if data is not None else None)
+
+    def set(self, data, merge=False):
+        self.client.write_latency.sleep()
+        with self.client.lock:
+            _write(self.client.collections.setdefault(self.collection_path, {}), self.id, data, merge)
+            self.client.versions[self.collection_path] = self.client.versions.get(self.collection_path, 0) + 1
+            self.client.writes += 1
+
+    def create(self, data):
+        self.client.write_latency.sleep()
+        with self.client.lock:
+            docs = self.client.collections.setdefault(self.collection_path, {})
+            if self.id in docs:
+                raise Conflict(f"Document {self.collection_path}/{self.id} already exists")
+            _write(docs, self.id, data, merge=False)
+            self.client.versions[self.collection_path] = self.client.versions.get(self.collection_path, 0) + 1
+            self.client.writes += 1
+
+    def delete(self):
+        self.client.write_latency.sleep()
+        with self.client.lock:
+            self.client.collections.get(self.collection_path, {}).pop(self.id, None)
+            self.client.versions[self.collection_path] = self.client.versions.get(self.collection_path, 0) + 1
+            self.client.writes += 1
+
+    def collection(self, name):
+        return FakeCollectionReference(self.client, f"{self.collection_path}/{self.id}/{name}")
+
+
+_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda value, options: value in options,
+    "not-in": lambda value, options: value not in options,
+    "array_contains": lambda value, item: isinstance(value, list) and item in value,
+}
+
+
+def _field(doc_id, data, field_path):
+    """(present, value) of a field; "__name__" is the document id."""
+    if field_path == "__name__":
+        return True, doc_id
+    return field_path in data, data.get(field_path)
+
+
+def _matches(doc_id, data, field_filter):
+    present, value = _field(doc_id, data, field_filter.field_path)
+    if not present:
+        return False
+    try:
+        return _OPERATORS[field_filter.op_string](value, field_filter.value)
+    except TypeError:
+        # Firestore only compares values of the same type
+        return False
+
+
+class AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class FakeAggregationQuery:
+    def __init__(self, query):
+        self.query = query
+        self.aggregations = []
+
+    def count(self, alias=None):
+        self.aggregations.append(("count", None, alias or "count"))
+        return self
+
+    def sum(self, field_path, alias=None):
+        self.aggregations.append(("sum", field_path, alias or "sum"))
+        return self
+
+    def avg(self, field_path, alias=None):
+        self.aggregations.append(("avg", field_path, alias or "avg"))
+        return self
+
+    def get(self):
+        client = self.query.client
+        client.read_latency.sleep()
+        docs = self.query._run(ordered=False)
+        with client.lock:
+            # Billed as one read per batch of up to 1000 index entries
+            client.reads += max(1, math.ceil(len(docs) / 1000))
+        results = []
+        for kind, field_path, alias in self.aggregations:
+            if kind == "count":
+                results.append(AggregationResult(alias, len(docs)))
+                continue
+            values = [
+                data[field_path] for _, data in docs
+                if isinstance(data.get(field_path), (int, float)) and not isinstance(data.get(field_path), bool)
+            ]
+            if kind == "sum":
+                results.append(AggregationResult(alias, sum(values)))
+            else:
+                results.append(AggregationResult(alias, sum(values) / len(values) if values else None))
+        return [results]
+
+
+class FakeQuery:
+    """
+    where / order_by / select / start_after / limit / stream and count / sum /
+    avg over one in-memory collection. Reads are counted the way Firestore
+    bills them: one per document returned, and at least one per query.
+    """
+
+    def __init__(self, client, collection, filters=(), orders=(), fields=None, cursor=None, limit_to=None):
+        self.client = client
+        self.collection_path = collection
+        self.filters = filters
+        self.orders = orders
+        self.fields = fields
+        self.cursor = cursor
+        self.limit_to = limit_to
+
+    def _copy(self, **changes):
+        state = {
+            "filters": self.filters, "orders": self.orders, "fields": self.fields,
+            "cursor": self.cursor, "limit_to": self.limit_to,
+        }
+        return FakeQuery(self.client, self.collection_path, **{**state, **changes})
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        return self._copy(filters=self.filters + (filter or FieldFilter(field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=Query.ASCENDING):
+        return self._copy(orders=self.orders + ((field_path, direction),))
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def limit(self, count):
+        return self._copy(limit_to=count)
+
+    def count(self, alias=None):
+        return FakeAggregationQuery(self).count(alias)
+
+    def sum(self, field_path, alias=None):
+        return FakeAggregationQuery(self).sum(field_path, alias)
+
+    def avg(self, field_path, alias=None):
+        return FakeAggregationQuery(self).avg(field_path, alias)
+
+    def _order(self):
+        # Like Firestore: ordered by the document id last, in the direction of the last order
+        orders = list(self.orders)
+        if not any(field_path == "__name__" for field_path, _ in orders):
+            orders.append(("__name__", orders[-1][1] if orders else Query.ASCENDING))
+        return orders
+
+    def _run(self, ordered=True):
+        """Matching (doc_id, data) pairs, in query order if `ordered`."""
+        # Writes replace a document's dict rather than changing it, so a copy of the
+        # candidates is enough to filter them without holding up other requests.
+        # An equality filter narrows them down through an index, as in Firestore.
+        equality = next((
+            field_filter for field_filter in self.filters
+            if field_filter.op_string == "==" and field_filter.field_path != "__name__"
+        ), None)
+        with self.client.lock:
+            items = None
+            if equality is not None:
+                try:
+                    items = list(self.client._index(self.collection_path, equality.field_path).get(equality.value, ()))
+                except TypeError:
+                    # Unhashable value
+                    pass
+            if items is None:
+                items = list(self.client.collections.get(self.collection_path, {}).items())
+        orders = self._order()
+        docs = [
+            (doc_id, data) for doc_id, data in items
+            if all(_matches(doc_id, data, field_filter) for field_filter in self.filters)
+            and all(_field(doc_id, data, field_path)[0] for field_path, _ in orders)
+        ]
+
+        def compare(left, right):
+            for index, (_, direction) in enumerate(orders):
+                if left[index] == right[index]:
+                    continue
+                result = -1 if left[index] < right[index] else 1
+                return -result if direction == Query.DESCENDING else result
+            return 0
+
+        def sort_key(doc_id, data):
+            return [_field(doc_id, data, field_path)[1] for field_path, _ in orders]
+
+        if not ordered:
+            return docs
+        # Stable sorts from the last order to the first
+        for field_path, direction in reversed(orders):
+            docs.sort(key=lambda doc: _field(doc[0], doc[1], field_path)[1], reverse=direction == Query.DESCENDING)
+        if self.cursor is not None:
+            if isinstance(self.cursor, FakeDocumentSnapshot):
+                cursor = sort_key(self.cursor.id, self.cursor._data or {})
+            else:
+                cursor = [self.cursor.get(field_path) for field_path, _ in orders]
+            docs = [(doc_id, data) for doc_id, data in docs if compare(sort_key(doc_id, data), cursor) > 0]
+        if self.limit_to is not None:
+            docs = docs[:self.limit_to]
+        return docs
+
+    def stream(self):
+        self.client.read_latency.sleep()
+        docs = self._run()
+        with self.client.lock:
+            self.client.reads += max(1, len(docs))
+        for doc_id, data in docs:
+            if self.fields is not None:
+                data = {field: data[field] for field in self.fields if field in data}
+            yield FakeDocumentSnapshot(FakeDocumentReference(self.client, self.collection_path, doc_id), dict(data))
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.name = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self.client, self.name, doc_id or uuid.uuid4().hex[:20])
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self.client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference, data, merge))
+
+    def commit(self):
+        self.client.write_latency.sleep()
+        with self.client.lock:
+            for reference, data, merge in self._writes:
+                _write(self.client.collections.setdefault(reference.collection_path, {}), reference.id, data, merge)
+                self.client.versions[reference.collection_path] = self.client.versions.get(reference.collection_path, 0) + 1
+                self.client.writes += 1
+        self._writes = []
+
+
+class FakeFirestoreClient:
+    def __init__(self, *args, **kwargs):
+        self.collections = {}
+        self.lock = threading.Lock()
+        self.read_latency = Latency()
+        self.write_latency = Latency()
+        self.reads = 0
+        self.writes = 0
+        # Writes per collection, so equality indexes know when to rebuild
+        self.versions = {}
+        self._indexes = {}
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def _index(self, collection_path, field_path):
+        """
+        {value: [(doc_id, data)]} over one field, rebuilt after writes (or when
+        documents were added to `collections` directly). The caller holds the lock.
+        """
+        docs = self.collections.get(collection_path, {})
+        state = (self.versions.get(collection_path, 0), len(docs))
+        cached = self._indexes.get((collection_path, field_path))
+        if cached and cached[0] == state:
+            return cached[1]
+        index = {}
+        for doc_id, data in docs.items():
+            try:
+                index.setdefault(data[field_path], []).append((doc_id, data))
+            except (KeyError, TypeError):
+                continue
+        self._indexes[(collection_path, field_path)] = (state, index)
+        return index
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+
+# --- Vertex AI ---
+class StubUsage:
+    def __init__(self, prompt_token_count, cached_content_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.cached_content_token_count = cached_content_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class StubResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class StubCachedContent:
+    """
+    vertexai.preview.caching.CachedContent; set `fail` to simulate a create that
+    fails. `created` counts the caches that were created.
+    """
+
+    fail = False
+    created = 0
+
+    def __init__(self, model_name, system_instruction, contents=None):
+        self.name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.contents = contents
+
+    @classmethod
+    def create(cls, model_name=None, system_instruction=None, contents=None, ttl=None, display_name=None, **kwargs):
+        if cls.fail:
+            raise RuntimeError("Cached content is too small")
+        cls.created += 1
+        return cls(model_name, system_instruction, contents)
+
+    def text(self):
+        return (self.system_instruction or "") + "".join(self.contents or [])
+
+
+class StubGenerativeModel:
+    """
+    Returns `output` after `latency`; `output` may be a callable taking the contents.
+    Text prompts and an uncached system instruction cost time per byte
+    (Latency.per_mb); image contents only the base latency. Generating the reply
+    costs `output_latency` per byte of output on top; with stream=True the reply
+    comes back in `stream_chunk_bytes` pieces as they are generated.
+
+    A model created from cached content takes these settings from the plain
+    model with the same name and system instruction, so a benchmark configures
+    the plain one only. `total_calls()` counts the calls of every instance,
+    including the cached-content ones created while a benchmark runs.
+    """
+
+    latency = Latency()
+    output_latency = Latency()
+    stream_chunk_bytes = 64
+    output = '{"details": {"transaction_type": "groceries", "trasaction_amount": 250, "confidence": 0.9}}'
+
+    def __init__(self, model_name=None, *args, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.cached_content = None
+        self.calls = 0
+        self._plain_models[(model_name, system_instruction)] = self
+        with self._instances_lock:
+            self._instances.append(self)
+
+    _plain_models = weakref.WeakValueDictionary()
+    _instances = []
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def total_calls(cls):
+        with cls._instances_lock:
+            return sum(model.calls for model in cls._instances)
+
+    @classmethod
+    def from_cached_content(cls, cached_content):
+        plain = cls._plain_models.get((cached_content.model_name, cached_content.system_instruction))
+        unrelated = cls._plain_models.get((cached_content.model_name, None))
+        model = cls(cached_content.model_name)
+        # Only plain models are looked up
+        if unrelated is not None:
+            cls._plain_models[(cached_content.model_name, None)] = unrelated
+        else:
+            del cls._plain_models[(cached_content.model_name, None)]
+        for name in ("latency", "output_latency", "stream_chunk_bytes", "output"):
+            if plain is not None and name in plain.__dict__:
+                setattr(model, name, plain.__dict__[name])
+        model.cached_content = cached_content
+        return model
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        with self._instances_lock:
+            self.calls += 1
+        prompt_bytes = len(contents.encode("utf-8")) if isinstance(contents, str) else 0
+        system_bytes = len(self.system_instruction.encode("utf-8")) if self.system_instruction else 0
+        cached_bytes = len(self.cached_content.text().encode("utf-8")) if self.cached_content else 0
+        self.latency.sleep(prompt_bytes + system_bytes)
+        text = self.output(contents) if callable(self.output) else self.output
+        # About four bytes per token
+        usage = StubUsage((prompt_bytes + system_bytes + cached_bytes) // 4, cached_bytes // 4, len(text) // 4)
+        if stream:
+            return self._stream(text, usage)
+        self.output_latency.sleep(len(text.encode("utf-8")))
+        return StubResponse(text, usage)
+
+    def _stream(self, text, usage):
+        step = self.stream_chunk_bytes
+        for start in range(0, len(text), step):
+            piece = text[start:start + step]
+            self.output_latency.sleep(len(piece.encode("utf-8")))
+            yield StubResponse(piece)
+        yield StubResponse("", usage)
+
+
+class StubImage:
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data)
+
+
+class StubPart:
+    def __init__(self, uri=None, mime_type=None):
+        self.uri = uri
+        self.mime_type = mime_type
+
+    @classmethod
+    def from_uri(cls, uri, mime_type=None):
+        return cls(uri, mime_type)
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """Registers the stand-in modules. Safe to call more than once."""
+    os.environ.setdefault("GCP_PROJECT", "local-benchmark")
+    os.environ.setdefault("GCP_REGION", "us-central1")
+
+    _module("functions_framework", http=lambda fn: fn, cloud_event=lambda fn: fn)
+    if importlib.util.find_spec("flask") is None:
+        _module("flask", Request=object, Response=object)
+    if importlib.util.find_spec("werkzeug") is None:
+        _module("werkzeug")
+        _module("werkzeug.utils", secure_filename=lambda name: os.path.basename(name))
+
+    google = sys.modules.get("google") or _module("google")
+    google.api_core = _module("google.api_core")
+    google.api_core.exceptions = _module("google.api_core.exceptions", Conflict=Conflict)
+    cloud = _module("google.cloud")
+    google.cloud = cloud
+    cloud.storage = _module("google.cloud.storage", Client=FakeStorageClient)
+    cloud.firestore = _module(
+        "google.cloud.firestore", Client=FakeFirestoreClient, Increment=Increment, SERVER_TIMESTAMP=SERVER_TIMESTAMP
+    )
+    cloud.firestore_v1 = _module("google.cloud.firestore_v1", Query=Query)
+    cloud.firestore_v1.base_query = _module("google.cloud.firestore_v1.base_query", FieldFilter=FieldFilter)
+
+    vertexai = _module("vertexai", init=lambda **kwargs: None)
+    vertexai.generative_models = _module(
+        "vertexai.generative_models", GenerativeModel=StubGenerativeModel, Image=StubImage, Part=StubPart
+    )
+    vertexai.preview = _module("vertexai.preview")
+    vertexai.preview.caching = _module("vertexai.preview.caching", CachedContent=StubCachedContent)
+
+
+def load_function(directory, module_name=None):
+    """
+    Imports <cloud-functions>/<directory>/main.py, with its helper modules, under a
+    package of its own (see backend/service/function_loader.py), so the functions
+    loaded into one benchmark don't share clients.py or tracing.py.
+    """
+    install()
+    if SERVICE_DIR not in sys.path:
+        sys.path.insert(0, SERVICE_DIR)
+    from function_loader import load_function as load_isolated
+
+    return load_isolated(directory, module_name or directory.replace("-", "_"))
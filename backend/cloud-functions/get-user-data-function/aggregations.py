@@ -0,0 +1,236 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+CATEGORIES = ("entertainment", "health", "utility", "groceries", "dining", "misc")
+
+AGGREGATION_QUERY_TYPES = ("totals_by_category", "daily_spend", "weekly_spend", "top_merchants")
+
+DEFAULT_MERCHANTS = 5
+MAX_MERCHANTS = 50
+
+# Aggregation queries per category are independent round trips; run them side by side
+aggregation_executor = ThreadPoolExecutor(max_workers=len(CATEGORIES) + 1)
+
+
+def _round(amount):
+    return round(amount, 2)
+
+
+def totals_by_category(query):
+    """
+    Count and total spend per category for the (already time-filtered) query,
+    computed by Firestore aggregation queries so no documents are transferred.
+    """
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    def aggregate(category):
+        scoped = query.where(filter=FieldFilter("transaction_type", "==", category)) if category else query
+        aggregation = scoped.count(alias="count").sum("transaction_amount", alias="total")
+        values = {result.alias: result.value for result in aggregation.get()[0]}
+        return category, int(values.get("count") or 0), float(values.get("total") or 0)
+
+    results = list(aggregation_executor.map(aggregate, (None,) + CATEGORIES))
+    _, count, total = results[0]
+    categories = {category: {"count": c, "total": _round(t)} for category, c, t in results[1:]}
+    return {
+        "count": count,
+        "total": _round(total),
+        "by_category": categories,
+        # Documents the backfill hasn't given a transaction_type yet
+        "uncategorized_count": count - sum(entry["count"] for entry in categories.values()),
+    }
+
+
+def totals_by_category_streamed(query):
+    """
+    Single-pass fallback for totals_by_category when aggregation queries are
+    unavailable. Counts like the aggregation queries do: a transaction counts
+    towards its category even without an amount.
+    """
+    count, total, uncategorized = 0, 0.0, 0
+    categories = {category: {"count": 0, "total": 0.0} for category in CATEGORIES}
+    for doc in query.select(["transaction_type", "transaction_amount"]).stream():
+        data = doc.to_dict()
+        count += 1
+        amount = data.get("transaction_amount") or 0.0
+        total += amount
+        category = data.get("transaction_type")
+        if category not in categories:
+            uncategorized += 1
+            continue
+        categories[category]["count"] += 1
+        categories[category]["total"] += amount
+    for entry in categories.values():
+        entry["total"] = _round(entry["total"])
+    return {"count": count, "total": _round(total), "by_category": categories, "uncategorized_count": uncategorized}
+
+
+def spend_series(query, start, end, period):
+    """
+    Spend per day (period="day") or per ISO week starting Monday (period="week")
+    over [start, end), in one streaming pass over a projection of the documents.
+    """
+    def bucket_of(moment):
+        day = moment.date()
+        return day - timedelta(days=day.weekday()) if period == "week" else day
+
+    buckets = {}
+    day = bucket_of(start)
+    while day < end.date():
+        buckets[day] = {"count": 0, "total": 0.0}
+        day += timedelta(days=7 if period == "week" else 1)
+
+    unparsed = 0
+    fields = ["transaction_time", "transaction_amount"]
+    for doc in query.select(fields).stream():
+        data = doc.to_dict()
+        amount = data.get("transaction_amount")
+        if amount is None:
+            unparsed += 1
+            continue
+        entry = buckets.setdefault(bucket_of(data["transaction_time"]), {"count": 0, "total": 0.0})
+        entry["count"] += 1
+        entry["total"] += amount
+
+    series = [
+        {"period_start": day.isoformat(), "count": entry["count"], "total": _round(entry["total"])}
+        for day, entry in sorted(buckets.items())
+    ]
+    return {
+        "period": period,
+        "series": series,
+        "total": _round(sum(entry["total"] for entry in buckets.values())),
+        "unparsed_count": unparsed,
+    }
+
+
+def resolve_limit(request_json):
+    """
+    Number of merchants for top_merchants. Raises ValueError with a message for the
+    client unless it is a whole number from 1 to MAX_MERCHANTS.
+    """
+    limit = request_json.get("limit", DEFAULT_MERCHANTS)
+    # int() would quietly turn true into 1 and 5.5 into 5
+    if isinstance(limit, (bool, float)):
+        raise ValueError("'limit' must be an integer.")
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("'limit' must be an integer.")
+    if not 1 <= limit <= MAX_MERCHANTS:
+        raise ValueError(f"'limit' must be between 1 and {MAX_MERCHANTS}.")
+    return limit
+
+
+def top_merchants(query, limit=DEFAULT_MERCHANTS):
+    """Merchants ranked by total spend, in one streaming pass."""
+    merchants = defaultdict(lambda: {"count": 0, "total": 0.0})
+    for doc in query.select(["transaction_merchant", "transaction_amount"]).stream():
+        data = doc.to_dict()
+        merchant = data.get("transaction_merchant")
+        amount = data.get("transaction_amount")
+        if not merchant or amount is None:
+            continue
+        # Group spelling variants of the same store ("DMart", "DMART ")
+        key = " ".join(merchant.lower().split())
+        entry = merchants[key]
+        entry.setdefault("merchant", merchant.strip())
+        entry["count"] += 1
+        entry["total"] += amount
+
+    ranked = sorted(merchants.values(), key=lambda entry: entry["total"], reverse=True)[:limit]
+    return {
+        "merchants": [
+            {"merchant": entry["merchant"], "count": entry["count"], "total": _round(entry["total"])}
+            for entry in ranked
+        ]
+    }
+
+
+ROLLUPS_COLLECTION = "spend_rollups"
+ROLLUP_QUERY_TYPES = ("totals_by_category", "daily_spend", "weekly_spend")
+
+
+def rollup_summary(db, user, query_type, start, end):
+    """
+    Same summaries as run_aggregation, computed from the per-user daily rollups
+    maintained by the maintain_spend_rollups trigger: one document read per day
+    shard in the range instead of one per transaction. Ranges are widened to
+    whole (UTC) days.
+    """
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    first_day = start.date()
+    last_day = (end - timedelta(microseconds=1)).date()
+    days = (
+        db.collection(ROLLUPS_COLLECTION).document(str(user).replace("/", "_")).collection("days")
+        .where(filter=FieldFilter("date", ">=", first_day.isoformat()))
+        .where(filter=FieldFilter("date", "<=", last_day.isoformat()))
+        .select(["date", "count", "total", "unparsed_count", "by_category"])
+        .stream()
+    )
+    rollups = [doc.to_dict() for doc in days]
+
+    if query_type == "totals_by_category":
+        categories = {category: {"count": 0, "total": 0.0} for category in CATEGORIES}
+        for rollup in rollups:
+            for category, entry in (rollup.get("by_category") or {}).items():
+                # Like the aggregation path, other categories count as uncategorized
+                if category in categories:
+                    categories[category]["count"] += entry["count"]
+                    categories[category]["total"] += entry["total"]
+        for entry in categories.values():
+            entry["total"] = _round(entry["total"])
+        count = sum(rollup["count"] for rollup in rollups)
+        return {
+            "count": count,
+            "total": _round(sum(rollup["total"] for rollup in rollups)),
+            "by_category": categories,
+            "uncategorized_count": count - sum(entry["count"] for entry in categories.values()),
+        }
+
+    period = "week" if query_type == "weekly_spend" else "day"
+
+    def bucket_of(day):
+        return day - timedelta(days=day.weekday()) if period == "week" else day
+
+    buckets = {}
+    day = bucket_of(first_day)
+    while day <= last_day:
+        buckets[day] = {"count": 0, "total": 0.0}
+        day += timedelta(days=7 if period == "week" else 1)
+    unparsed = 0
+    for rollup in rollups:
+        entry = buckets.setdefault(bucket_of(date.fromisoformat(rollup["date"])), {"count": 0, "total": 0.0})
+        # spend_series only counts transactions with an amount
+        entry["count"] += rollup["count"] - rollup.get("unparsed_count", 0)
+        entry["total"] += rollup["total"]
+        unparsed += rollup.get("unparsed_count", 0)
+
+    return {
+        "period": period,
+        "series": [
+            {"period_start": day.isoformat(), "count": entry["count"], "total": _round(entry["total"])}
+            for day, entry in sorted(buckets.items())
+        ],
+        "total": _round(sum(entry["total"] for entry in buckets.values())),
+        "unparsed_count": unparsed,
+    }
+
+
+def run_aggregation(query_type, query, start, end, request_json):
+    if query_type == "totals_by_category":
+        try:
+            return totals_by_category(query)
+        except Exception as e:
+            # e.g. the composite index is still building
+            print(f"Aggregation query failed, falling back to streaming: {e}")
+            return totals_by_category_streamed(query)
+    if query_type == "daily_spend":
+        return spend_series(query, start, end, "day")
+    if query_type == "weekly_spend":
+        return spend_series(query, start, end, "week")
+    if query_type == "top_merchants":
+        return top_merchants(query, limit=resolve_limit(request_json))
+    raise ValueError(f"Unknown aggregation '{query_type}'")
@@ -1,20 +1,273 @@
+import base64
+import json
 import os
 import functions_framework
-from google.cloud import firestore
-from google.cloud.firestore_v1.base_query import FieldFilter
-from google.cloud.firestore_v1 import Query
 from datetime import datetime, timedelta, timezone
+from aggregations import AGGREGATION_QUERY_TYPES, ROLLUP_QUERY_TYPES, resolve_limit, rollup_summary, run_aggregation
+from clients import LazyClient
+from response_cache import ResponseCache, etag_matches, make_etag
+from singleflight import SingleFlight
+import tracing
 
-# Initialize Firestore Client in the global scope
-# This allows the client to be reused across function invocations
-try:
-    db = firestore.Client(project="graceful-byway-467117-r0", database="receipt-management")
-except Exception as e:
-    print(f"Error initializing Firestore client: {e}")
-    db = None
+
+def create_firestore_client():
+    from google.cloud import firestore
+
+    return firestore.Client(project="graceful-byway-467117-r0", database="receipt-management")
+
+
+# The Firestore client is created on first use and reused across invocations (see
+# clients.py), so preflights and rejected requests don't load the client library
+db = LazyClient("Firestore client", create_firestore_client)
+
+# Serve per-user summaries from the daily rollups kept by the maintain_spend_rollups
+# trigger (backend/gcp_cloudfunc). Enable once the trigger is deployed and reconciled.
+USE_SPEND_ROLLUPS = os.environ.get("USE_SPEND_ROLLUPS", "0") == "1"
+
+# Storage layout written by transaction-process: "flat" reads the requested collection,
+# "per_user" reads users/{user}/transactions and requires `user`
+TRANSACTIONS_LAYOUT = os.environ.get("TRANSACTIONS_LAYOUT", "flat")
+USERS_COLLECTION = "users"
+USER_TRANSACTIONS_SUBCOLLECTION = "transactions"
+
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", "500"))
+
+# Per-instance response cache for requests that name a `user`. transaction-process
+# bumps cache_versions/{user} on every write, which invalidates that user's entries.
+CACHE_VERSIONS_COLLECTION = "cache_versions"
+if os.environ.get("RESPONSE_CACHE_ENABLED", "1") == "1":
+    response_cache = ResponseCache(
+        max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", "512")),
+        ttl_seconds=float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "60")),
+    )
+else:
+    response_cache = None
+
+# Identical requests that arrive while the same query is already running share its result
+single_flight = SingleFlight() if os.environ.get("SINGLE_FLIGHT_ENABLED", "1") == "1" else None
+
+
+def resolve_time_range(range_type, request_json):
+    """
+    Returns the (start, end) datetimes of a time range query type.
+    Raises ValueError with a message for the client if the range is invalid.
+    """
+    now = datetime.now(timezone.utc)
+    if range_type == "last_7_days":
+        return now - timedelta(days=7), now
+    if range_type == "last_30_days":
+        return now - timedelta(days=30), now
+    if range_type == "custom_time_range":
+        start_date_str = request_json.get("start_date")
+        end_date_str = request_json.get("end_date")
+        if not start_date_str or not end_date_str:
+            raise ValueError("For 'custom' time_range, 'start_date' and 'end_date' are required.")
+        try:
+            # Add timezone information to make them offset-aware
+            start_date_dt = datetime.strptime(start_date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+            # Add one day to the end date to include the entire day
+            end_date_dt = (datetime.strptime(end_date_str, "%Y-%m-%d") + timedelta(days=1)).replace(tzinfo=timezone.utc)
+        except ValueError:
+            raise ValueError("'start_date' and 'end_date' must be in YYYY-MM-DD format.")
+        return start_date_dt, end_date_dt
+    raise ValueError("Invalid time_range. Use 'last_7_days', 'last_30_days', or 'custom_time_range'.")
+
+
+def user_key(user):
+    """Document id for a user ("/" is not allowed in document ids)."""
+    return str(user).replace("/", "_")
+
+
+def transactions_query(collection_name, user):
+    """
+    Query over the transactions visible to a request: the user's partition with the
+    per_user layout, otherwise the flat collection filtered on `user` when given.
+    """
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    if TRANSACTIONS_LAYOUT == "per_user":
+        if not user:
+            raise ValueError("'user' is required.")
+        return (
+            db.get().collection(USERS_COLLECTION)
+            .document(user_key(user))
+            .collection(USER_TRANSACTIONS_SUBCOLLECTION)
+        )
+    collection_ref = db.get().collection(collection_name)
+    return collection_ref.where(filter=FieldFilter("user", "==", user)) if user else collection_ref
+
+
+def encode_cursor(doc):
+    """Opaque cursor pointing just past the given document in transaction_time order."""
+    transaction_time = doc.get("transaction_time")
+    payload = {"t": transaction_time.isoformat(), "id": doc.id}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Cursor values for Query.start_after. Raises ValueError if the cursor is malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        transaction_time = datetime.fromisoformat(payload["t"])
+        doc_id = payload["id"]
+    except Exception:
+        raise ValueError("Invalid 'start_after' cursor.")
+    if not valid_document_id(doc_id):
+        raise ValueError("Invalid 'start_after' cursor.")
+    return {"transaction_time": transaction_time, "__name__": doc_id}
+
+
+def valid_document_id(doc_id):
+    """Whether Firestore accepts `doc_id` as a document id."""
+    return (
+        isinstance(doc_id, str)
+        and 0 < len(doc_id.encode("utf-8")) <= 1500
+        and "/" not in doc_id
+        and doc_id not in (".", "..")
+        and not (doc_id.startswith("__") and doc_id.endswith("__"))
+    )
+
+
+def resolve_page_size(request_json, default):
+    try:
+        page_size = int(request_json.get("page_size", default))
+    except (TypeError, ValueError):
+        raise ValueError("'page_size' must be an integer.")
+    if page_size < 1:
+        raise ValueError("'page_size' must be at least 1.")
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def resolve_fields(request_json):
+    """Field projection for list queries; transaction_time is always kept for the cursor."""
+    fields = request_json.get("fields")
+    if fields is None:
+        return None
+    if not isinstance(fields, list) or not all(isinstance(field, str) and field for field in fields):
+        raise ValueError("'fields' must be a list of field names.")
+    return list(dict.fromkeys(fields + ["transaction_time"]))
+
+
+def read_cache_version(user):
+    """Current cache version of a user, or None if it can't be read (the cache is skipped)."""
+    try:
+        snapshot = db.get().collection(CACHE_VERSIONS_COLLECTION).document(user_key(user)).get()
+    except Exception as e:
+        print(f"Error reading cache version for {user}: {e}")
+        return None
+    return (snapshot.to_dict() or {}).get("version", 0) if snapshot.exists else 0
+
+
+def conditional_response(request, body, etag, headers, cache_status):
+    """The body with its ETag, or an empty 304 if the client already holds it."""
+    headers = {
+        **headers,
+        "ETag": etag,
+        # Clients may keep the response but must revalidate it before reuse
+        "Cache-Control": "private, no-cache",
+        "Access-Control-Expose-Headers": "ETag, X-Cache",
+        "X-Cache": cache_status,
+    }
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return ("", 304, headers)
+    return (body, 200, headers)
+
+
+def query_user_data(request_json, collection_name, query_type):
+    """Runs a get_user_data request against Firestore. Returns (body, status)."""
+    from google.cloud.firestore_v1 import Query
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    user = request_json.get("user")
+    try:
+        scoped_ref = transactions_query(collection_name, user)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # <<<<----------------------------------------------------------------------------------->>>>
+    # **feat: Server-side summaries (aggregation queries / single-pass reducers)**
+    if query_type in AGGREGATION_QUERY_TYPES:
+        try:
+            start_date_dt, end_date_dt = resolve_time_range(request_json.get("range", "last_30_days"), request_json)
+            if query_type == "top_merchants":
+                resolve_limit(request_json)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        if USE_SPEND_ROLLUPS and user and query_type in ROLLUP_QUERY_TYPES:
+            summary = rollup_summary(db.get(), user, query_type, start_date_dt, end_date_dt)
+            source = "rollups"
+        else:
+            query = (
+                scoped_ref
+                .where(filter=FieldFilter("transaction_time", ">=", start_date_dt))
+                .where(filter=FieldFilter("transaction_time", "<", end_date_dt))
+            )
+            summary = run_aggregation(query_type, query, start_date_dt, end_date_dt, request_json)
+            source = "transactions"
+        return {
+            "data": summary,
+            "query_type": query_type,
+            "source": source,
+            "range": {"start": start_date_dt.isoformat(), "end": end_date_dt.isoformat()}
+        }, 200
+
+    # <<<<----------------------------------------------------------------------------------->>>>
+    # **feat: Handle last_10_transactions and time based filter queries, paged when asked**
+    # Without `page_size` or `start_after` the whole range comes back in one response
+    paged = "page_size" in request_json or bool(request_json.get("start_after"))
+    try:
+        if query_type == "last_10_transactions":
+            query = scoped_ref
+            page_size = resolve_page_size(request_json, 10)
+            covered_start = covered_end = None
+        else:
+            start_date_dt, end_date_dt = resolve_time_range(query_type, request_json)
+            query = (
+                scoped_ref
+                .where(filter=FieldFilter("transaction_time", ">=", start_date_dt))
+                .where(filter=FieldFilter("transaction_time", "<", end_date_dt))  # Use '<' for end_date for consistency
+            )
+            page_size = resolve_page_size(request_json, DEFAULT_PAGE_SIZE) if paged else None
+            covered_start = start_date_dt.isoformat()
+            # The rolling ranges end now, so nothing after them exists yet
+            covered_end = end_date_dt.isoformat() if query_type == "custom_time_range" else None
+        fields = resolve_fields(request_json)
+        cursor = decode_cursor(request_json["start_after"]) if request_json.get("start_after") else None
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # Document id breaks ties between transactions with the same timestamp so cursors are stable
+    query = (
+        query
+        .order_by("transaction_time", direction=Query.DESCENDING)
+        .order_by("__name__", direction=Query.DESCENDING)
+    )
+    if fields:
+        query = query.select(fields)
+    if cursor:
+        query = query.start_after(cursor)
+    if page_size:
+        query = query.limit(page_size)
+
+    docs = list(query.stream())
+    results = [{"id": doc.id, **doc.to_dict()} for doc in docs]
+    full = page_size is not None and len(docs) == page_size
+    next_cursor = encode_cursor(docs[-1]) if full and paged else None
+    # Ten transactions cover the time from the oldest of them; fewer are all there are
+    if query_type == "last_10_transactions" and full:
+        covered_start = docs[-1].get("transaction_time").isoformat()
+
+    return {
+        "data": results,
+        "next_cursor": next_cursor,
+        "range": {"start": covered_start, "end": covered_end},
+    }, 200
 
 
 @functions_framework.http
+@tracing.traced("get_user_data")
 def get_user_data(request):
     """
     HTTP Cloud Function to fetch user data from Firestore based on a time range.
@@ -25,20 +278,38 @@ def get_user_data(request):
             "collection": "Transaction",
             "query_type": "last_10_transactions | last_7_days" | "last_30_days" | "custom_time_range",
             "start_date": "YYYY-MM-DD" (required for "custom"),
-            "end_date": "YYYY-MM-DD" (required for "custom")
+            "end_date": "YYYY-MM-DD" (required for "custom"),
+            "user": optional; only that user's transactions (required with the per_user layout),
+            "page_size": optional; page through the results this many documents at a time
+                         (default 100, 10 for last_10_transactions). Without it, and without
+                         "start_after", every matching document is returned at once,
+            "start_after": optional; the "next_cursor" of the previous page,
+            "fields": optional; list of fields to return instead of whole documents
+        }
+        List queries return {"data": [...], "next_cursor": "..." | null, "range": {...}}, newest
+        first. "next_cursor" is only set on paged requests with more documents; "range" is the
+        time the query covers, with null for an open start or an end of now.
+        Summaries computed server-side instead of returning documents:
+        {
+            "collection": "Transaction",
+            "query_type": "totals_by_category" | "daily_spend" | "weekly_spend" | "top_merchants",
+            "range": "last_7_days" | "last_30_days" (default) | "custom_time_range",
+            "start_date" / "end_date": as above, for "custom_time_range",
+            "limit": number of merchants for "top_merchants", 1 to 50 (default 5),
+            "user": optional; only that user's transactions. With USE_SPEND_ROLLUPS the
+                    summary is read from that user's daily rollups
         }
     Returns:
-        A JSON response with the user data or an error message.
+        A JSON response with the user data or an error message. Successful responses
+        carry a strong ETag; sending it back in If-None-Match yields an empty 304
+        while the data is unchanged.
     """
-    if not db:
-        return {"error": "Firestore client is not available."}, 500
-
     # Set CORS headers for preflight requests
     if request.method == "OPTIONS":
         headers = {
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "POST",
-            "Access-Control-Allow-Headers": "Content-Type",
+            "Access-Control-Allow-Headers": "Content-Type, If-None-Match",
             "Access-Control-Max-Age": "3600",
         }
         return ("", 204, headers)
@@ -60,66 +331,67 @@ def get_user_data(request):
     if not all([collection_name, query_type]):
         return ({"error": "Missing 'collection' or 'query_type' in request body"}, 400, headers)
 
-    try:
-        # <<<<----------------------------------------------------------------------------------->>>>
-        # **feat: Check if the collection exists or is empty**
-        # We try to get just one document. If we get nothing, the collection either doesn't exist or is empty, so we can stop here.
-        collection_ref = db.collection(collection_name)
-        docs_check = collection_ref.limit(1).get()
-        if not docs_check:
-            return ({"error": f"Collection '{collection_name}' does not exist or is empty."}, 404, headers)
-
+    if not db.get():
+        return ({"error": "Firestore client is not available."}, 500, headers)
 
-        # <<<<----------------------------------------------------------------------------------->>>>
-        # **feat: Handle last_10_transactions separately**
-        if query_type == "last_10_transactions":
-            docs = (
-                collection_ref
-                .order_by("transaction_time", direction=Query.DESCENDING)
-                .limit(10)
-                .stream()
-            )
-            results = [doc.to_dict() for doc in docs]
-            return ({"data": results}, 200, headers)
+    tracing.annotate(query_type=query_type)
+    try:
+        user = request_json.get("user")
+        cache_key = cache_version = None
+        # Responses are cached per user, so they can be invalidated when that user writes
+        if response_cache and user:
+            with tracing.stage("firestore_read"):
+                cache_version = read_cache_version(user)
+            if cache_version is not None:
+                cache_key = ResponseCache.make_key(request_json)
+                cached = response_cache.get(cache_key, cache_version)
+                if cached:
+                    body, etag = cached
+                    tracing.annotate(cache="hit")
+                    return conditional_response(request, body, etag, headers, "hit")
 
+        # Includes waiting on an identical query another request already started
+        with tracing.stage("firestore_query"):
+            if single_flight:
+                # The cache version is part of the key so a request made after a write never
+                # joins a query that started before it
+                flight_key = SingleFlight.make_key({"request": request_json, "cache_version": cache_version})
+                body, status = single_flight.do(
+                    flight_key, lambda: query_user_data(request_json, collection_name, query_type)
+                )
+            else:
+                body, status = query_user_data(request_json, collection_name, query_type)
+        if status != 200:
+            return (body, status, headers)
+        if isinstance(body.get("data"), list):
+            tracing.annotate(documents=len(body["data"]))
+        tracing.annotate(cache="miss" if cache_key else "bypass")
 
-        now = datetime.now(timezone.utc)
-        start_date_dt = None
-        end_date_dt = now
+        # The ETag is a digest of the JSON-encoded body
+        with tracing.stage("serialize"):
+            etag = make_etag(body)
+        if cache_key:
+            response_cache.put(cache_key, cache_version, body, etag)
+        return conditional_response(request, body, etag, headers, "miss" if cache_key else "bypass")
 
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return ({"error": "An internal error occurred while fetching data."}, 500, headers)
 
-        # <<<<----------------------------------------------------------------------------------->>>>
-        # **feat: Handle time based filter queries**
-        if query_type == "last_7_days":
-            start_date_dt = now - timedelta(days=7)
-        elif query_type == "last_30_days":
-            start_date_dt = now - timedelta(days=30)
-        elif query_type == "custom_time_range":
-            start_date_str = request_json.get("start_date")
-            end_date_str = request_json.get("end_date")
-            if not start_date_str or not end_date_str:
-                return ({"error": "For 'custom' time_range, 'start_date' and 'end_date' are required."}, 400, headers)
 
-            # Add timezone information to make them offset-aware
-            start_date_dt = datetime.strptime(start_date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-            # Add one day to the end date to include the entire day
-            end_date_dt = (datetime.strptime(end_date_str, "%Y-%m-%d") + timedelta(days=1)).replace(tzinfo=timezone.utc)
-        else:
-            return ({"error": "Invalid time_range. Use 'last_7_days', 'last_30_days', or 'custom_time_range'."}, 400, headers)
-
-        # Query the database
-        # Assumes documents have a 'created_at' timestamp field
-        docs = (
-            db.collection(collection_name)
-            .where(filter=FieldFilter("transaction_time", ">=", start_date_dt))
-            .where(filter=FieldFilter("transaction_time", "<", end_date_dt))  # Use '<' for end_date for consistency
-            .stream()
-        )
-
-        results = [doc.to_dict() for doc in docs]
+@functions_framework.http
+def response_cache_stats(request):
+    """Returns the response cache hit/miss counters for this instance."""
+    headers = {"Access-Control-Allow-Origin": "*"}
+    if not response_cache:
+        return ({"enabled": False}, 200, headers)
+    return ({"enabled": True, **response_cache.stats()}, 200, headers)
 
-        return ({"data": results}, 200, headers)
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return ({"error": "An internal error occurred while fetching data."}, 500, headers)
+@functions_framework.http
+def single_flight_stats(request):
+    """Returns how many queries this instance executed and how many requests joined one in flight."""
+    headers = {"Access-Control-Allow-Origin": "*"}
+    if not single_flight:
+        return ({"enabled": False}, 200, headers)
+    return ({"enabled": True, **single_flight.stats()}, 200, headers)
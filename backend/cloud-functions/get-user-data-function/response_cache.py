@@ -0,0 +1,104 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from aggregations import AGGREGATION_QUERY_TYPES
+
+
+def make_etag(body):
+    """Strong ETag over the canonical JSON encoding of a response body."""
+    encoded = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return '"' + hashlib.sha256(encoded).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value lists the given ETag (or is "*")."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCache:
+    """
+    In-process cache of get_user_data responses.
+
+    Entries expire after `ttl_seconds` and the least recently used ones are
+    evicted beyond `max_entries`. Every entry records the cache version of its
+    user (see cache_versions in the readme); a lookup with a newer version is a
+    miss, which is how writes by the transaction function invalidate it.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=60, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "invalidated": 0}
+
+    @staticmethod
+    def make_key(request_json):
+        """
+        Key on the parameters that shape the response: user, collection, query
+        type and the normalized range, plus paging and projection.
+        """
+        query_type = request_json.get("query_type")
+        if query_type in AGGREGATION_QUERY_TYPES:
+            range_type = request_json.get("range", "last_30_days")
+        else:
+            range_type = query_type
+        key = {
+            "user": request_json.get("user"),
+            "collection": request_json.get("collection"),
+            "query_type": query_type,
+            "range": range_type,
+        }
+        if range_type == "custom_time_range":
+            key["start_date"] = request_json.get("start_date")
+            key["end_date"] = request_json.get("end_date")
+        for name in ("page_size", "start_after", "fields", "limit"):
+            if request_json.get(name) is not None:
+                key[name] = request_json[name]
+        return json.dumps(key, sort_keys=True, default=str)
+
+    def get(self, key, version):
+        """(body, etag) for a fresh entry written at `version`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            expires_at, entry_version, body, etag = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.counters["expired"] += 1
+                return None
+            if entry_version != version:
+                del self._entries[key]
+                self.counters["invalidated"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return body, etag
+
+    def put(self, key, version, body, etag):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl_seconds, version, body, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.counters.values())
+            return {
+                **self.counters,
+                "lookups": lookups,
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "capacity": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls within an instance.
+
+    The first caller for a key runs the function; callers arriving with the
+    same key while it is in flight wait for it and receive the same result
+    (or exception). Nothing is kept once the call finishes, so this only
+    protects the backend from bursts and is not a cache.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {"executed": 0, "coalesced": 0, "errors": 0}
+
+    @staticmethod
+    def make_key(payload):
+        """SHA-256 of the canonical JSON encoding of a payload."""
+        encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.counters["executed"] += 1
+            else:
+                self.counters["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self.counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            calls = self.counters["executed"] + self.counters["coalesced"]
+            return {
+                **self.counters,
+                "calls": calls,
+                "coalesced_rate": round(self.counters["coalesced"] / calls, 4) if calls else 0.0,
+                "in_flight": len(self._calls),
+            }
@@ -0,0 +1,120 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from aggregations import (
+    MAX_MERCHANTS,
+    resolve_limit,
+    run_aggregation,
+    spend_series,
+    top_merchants,
+    totals_by_category_streamed,
+)
+
+
+class Doc:
+    def __init__(self, data):
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeQuery:
+    """The select().stream() part of a Firestore query over in-memory documents."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.selected = None
+
+    def select(self, fields):
+        self.selected = fields
+        return self
+
+    def stream(self):
+        for data in self.docs:
+            yield Doc({field: data[field] for field in self.selected if field in data})
+
+
+def at(day, hour=12):
+    return datetime(2025, 7, day, hour, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("value, expected", [(None, 5), (1, 1), ("7", 7), (MAX_MERCHANTS, MAX_MERCHANTS)])
+def test_resolve_limit_accepts_whole_numbers_in_range(value, expected):
+    request_json = {} if value is None else {"limit": value}
+    assert resolve_limit(request_json) == expected
+
+
+@pytest.mark.parametrize("value", ["five", "", None, [], {}, 2.5, True, 0, -3, MAX_MERCHANTS + 1])
+def test_resolve_limit_rejects_everything_else(value):
+    with pytest.raises(ValueError, match="'limit'"):
+        resolve_limit({"limit": value})
+
+
+def test_top_merchants_groups_spelling_variants_and_ranks_by_total():
+    query = FakeQuery([
+        {"transaction_merchant": "DMart", "transaction_amount": 100.0},
+        {"transaction_merchant": "DMART ", "transaction_amount": 50.0},
+        {"transaction_merchant": "Apollo", "transaction_amount": 120.0},
+        {"transaction_merchant": "PVR", "transaction_amount": 20.0},
+        {"transaction_merchant": "PVR", "transaction_amount": None},
+        {"transaction_merchant": None, "transaction_amount": 999.0},
+    ])
+    assert top_merchants(query, limit=2) == {"merchants": [
+        {"merchant": "DMart", "count": 2, "total": 150.0},
+        {"merchant": "Apollo", "count": 1, "total": 120.0},
+    ]}
+
+
+def test_run_aggregation_validates_the_limit_before_querying():
+    query = FakeQuery([])
+    with pytest.raises(ValueError):
+        run_aggregation("top_merchants", query, at(1), at(2), {"limit": "ten"})
+    assert query.selected is None
+
+
+def test_streamed_totals_count_like_the_aggregation_queries():
+    query = FakeQuery([
+        {"transaction_type": "groceries", "transaction_amount": 10.0},
+        {"transaction_type": "groceries", "transaction_amount": 5.0},
+        {"transaction_type": "dining", "transaction_amount": 7.5},
+        {"transaction_type": "groceries", "transaction_amount": None},
+        {"transaction_type": None, "transaction_amount": 3.0},
+        {"transaction_type": "travel", "transaction_amount": 1.0},
+    ])
+    summary = totals_by_category_streamed(query)
+    assert summary["count"] == 6
+    assert summary["total"] == 26.5
+    # Counted in its category without an amount, as count() over the category would
+    assert summary["by_category"]["groceries"] == {"count": 3, "total": 15.0}
+    assert summary["by_category"]["dining"] == {"count": 1, "total": 7.5}
+    assert summary["by_category"]["health"] == {"count": 0, "total": 0.0}
+    assert summary["uncategorized_count"] == 2
+
+
+def test_daily_series_has_a_bucket_for_every_day_in_the_range():
+    query = FakeQuery([
+        {"transaction_time": at(2, 9), "transaction_amount": 10.0},
+        {"transaction_time": at(2, 20), "transaction_amount": 5.0},
+        {"transaction_time": at(4), "transaction_amount": 1.0},
+        {"transaction_time": at(3), "transaction_amount": None},
+    ])
+    summary = spend_series(query, at(1, 0), at(5, 0), "day")
+    assert [(entry["period_start"], entry["count"], entry["total"]) for entry in summary["series"]] == [
+        ("2025-07-01", 0, 0.0), ("2025-07-02", 2, 15.0), ("2025-07-03", 0, 0.0), ("2025-07-04", 1, 1.0),
+    ]
+    assert summary["total"] == 16.0
+    assert summary["unparsed_count"] == 1
+
+
+def test_weekly_series_buckets_start_on_monday():
+    # 2025-07-06 is a Sunday and 2025-07-07 a Monday
+    query = FakeQuery([
+        {"transaction_time": at(6), "transaction_amount": 4.0},
+        {"transaction_time": at(7), "transaction_amount": 6.0},
+    ])
+    summary = spend_series(query, at(1, 0), at(10, 0), "week")
+    assert [(entry["period_start"], entry["total"]) for entry in summary["series"]] == [
+        ("2025-06-30", 4.0), ("2025-07-07", 6.0),
+    ]
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from clients import LazyClient
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Factory:
+    def __init__(self, failures=0, delay=0.0):
+        self.calls = 0
+        self.failures = failures
+        self.delay = delay
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.calls <= self.failures:
+            raise RuntimeError("credentials not found")
+        return object()
+
+
+def test_the_client_is_built_on_first_use_and_then_shared():
+    factory = Factory()
+    client = LazyClient("Firestore client", factory)
+    assert factory.calls == 0 and not client.initialized
+    first = client.get()
+    assert first is not None and client.get() is first
+    assert factory.calls == 1 and client.initialized
+
+
+def test_concurrent_first_callers_wait_for_one_build():
+    factory = Factory(delay=0.05)
+    client = LazyClient("Firestore client", factory)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert factory.calls == 1 and len({id(result) for result in results}) == 1
+
+
+def test_a_failed_build_is_retried_only_after_the_delay(capsys):
+    clock, factory = Clock(), Factory(failures=2)
+    client = LazyClient("Vertex AI", factory, retry_seconds=30, clock=clock)
+    assert client.get() is None
+    assert "Error initializing Vertex AI: credentials not found" in capsys.readouterr().out
+
+    clock.now = 29.9
+    assert client.get() is None and factory.calls == 1
+    clock.now = 30
+    assert client.get() is None and factory.calls == 2
+    # The delay counts from the latest failure
+    clock.now = 59.9
+    assert client.get() is None and factory.calls == 2
+    clock.now = 60
+    assert client.get() is not None and factory.calls == 3
+    clock.now = 1000
+    client.get()
+    assert factory.calls == 3
@@ -0,0 +1,41 @@
+import base64
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("functions_framework")
+pytest.importorskip("google.cloud.firestore")
+
+import main
+
+
+class Snapshot:
+    id = "abc123"
+
+    def get(self, field):
+        return {"transaction_time": datetime(2025, 7, 2, 12, tzinfo=timezone.utc)}[field]
+
+
+def cursor_of(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trip():
+    values = main.decode_cursor(main.encode_cursor(Snapshot()))
+    assert values == {"transaction_time": datetime(2025, 7, 2, 12, tzinfo=timezone.utc), "__name__": "abc123"}
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 !",
+    cursor_of([1, 2]),
+    cursor_of({"t": "yesterday", "id": "abc"}),
+    cursor_of({"t": "2025-07-02T12:00:00+00:00"}),
+    cursor_of({"t": "2025-07-02T12:00:00+00:00", "id": ""}),
+    cursor_of({"t": "2025-07-02T12:00:00+00:00", "id": "a/b"}),
+    cursor_of({"t": "2025-07-02T12:00:00+00:00", "id": 42}),
+    cursor_of({"t": "2025-07-02T12:00:00+00:00", "id": "__name__"}),
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError, match="start_after"):
+        main.decode_cursor(cursor)
@@ -0,0 +1,92 @@
+import pytest
+
+from response_cache import ResponseCache, etag_matches, make_etag
+
+REQUEST = {"user": "asha", "collection": "receipts", "query_type": "last_7_days"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key_ignores_fields_that_do_not_shape_the_response():
+    key = ResponseCache.make_key(REQUEST)
+    assert key == ResponseCache.make_key({**REQUEST, "start_date": "2025-01-01", "stream": True})
+    assert key == ResponseCache.make_key(dict(reversed(list(REQUEST.items()))))
+
+
+@pytest.mark.parametrize("change", [
+    {"user": "ravi"},
+    {"collection": "archive"},
+    {"query_type": "last_30_days"},
+    {"page_size": 50},
+    {"start_after": "doc-1"},
+    {"fields": ["transaction_amount"]},
+])
+def test_key_covers_the_parameters_that_shape_the_response(change):
+    assert ResponseCache.make_key(REQUEST) != ResponseCache.make_key({**REQUEST, **change})
+
+
+def test_key_of_a_custom_range_covers_its_dates():
+    custom = {**REQUEST, "query_type": "custom_time_range", "start_date": "2025-07-01", "end_date": "2025-07-31"}
+    assert ResponseCache.make_key(custom) != ResponseCache.make_key({**custom, "end_date": "2025-08-31"})
+
+
+def test_key_of_an_aggregation_uses_its_range_and_defaults_to_30_days():
+    summary = {"user": "asha", "query_type": "totals_by_category"}
+    assert ResponseCache.make_key(summary) == ResponseCache.make_key({**summary, "range": "last_30_days"})
+    assert ResponseCache.make_key(summary) != ResponseCache.make_key({**summary, "range": "last_7_days"})
+    assert ResponseCache.make_key({**summary, "limit": 5}) != ResponseCache.make_key({**summary, "limit": 10})
+
+
+def test_etag_is_strong_and_depends_only_on_the_body():
+    etag = make_etag({"data": [{"id": "a", "amount": 1}], "next_cursor": None})
+    assert etag.startswith('"') and etag.endswith('"') and not etag.startswith('W/')
+    assert etag == make_etag({"next_cursor": None, "data": [{"amount": 1, "id": "a"}]})
+    assert etag != make_etag({"data": [{"id": "a", "amount": 2}], "next_cursor": None})
+
+
+@pytest.mark.parametrize("header, expected", [
+    ('"abc"', True),
+    ('"old", "abc"', True),
+    ("*", True),
+    ('"old"', False),
+    ("abc", False),
+    ("", False),
+    (None, False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, '"abc"') is expected
+
+
+def test_entries_expire_after_the_ttl():
+    clock = Clock()
+    cache = ResponseCache(ttl_seconds=60, clock=clock)
+    cache.put("k", 1, {"data": []}, '"e"')
+    clock.now += 59
+    assert cache.get("k", 1) == ({"data": []}, '"e"')
+    clock.now += 1
+    assert cache.get("k", 1) is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_a_newer_cache_version_invalidates_the_entry():
+    cache = ResponseCache(clock=Clock())
+    cache.put("k", 1, {"data": []}, '"e"')
+    assert cache.get("k", 2) is None
+    assert cache.get("k", 1) is None
+    assert cache.stats()["invalidated"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2, clock=Clock())
+    cache.put("a", 1, "A", '"a"')
+    cache.put("b", 1, "B", '"b"')
+    cache.get("a", 1)
+    cache.put("c", 1, "C", '"c"')
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) == ("A", '"a"') and cache.get("c", 1) == ("C", '"c"')
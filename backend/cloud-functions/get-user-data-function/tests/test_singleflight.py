@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_key_is_canonical():
+    assert SingleFlight.make_key({"a": 1, "b": [1, 2]}) == SingleFlight.make_key({"b": [1, 2], "a": 1})
+    assert SingleFlight.make_key({"a": 1}) != SingleFlight.make_key({"a": 2})
+
+
+def run_concurrently(flight, key, fn, callers):
+    """Starts `callers` threads calling flight.do(key, fn); returns (threads, results, errors)."""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def wait_for_followers(flight, count):
+    # Followers count themselves before they block on the leader
+    while flight.stats()["coalesced"] < count:
+        threading.Event().wait(0.001)
+
+
+def test_concurrent_identical_calls_run_once_and_share_the_result():
+    flight, release, calls = SingleFlight(), threading.Event(), []
+
+    def fetch():
+        calls.append(1)
+        release.wait()
+        return {"data": [1, 2]}
+
+    threads, results, errors = run_concurrently(flight, "k", fetch, 5)
+    wait_for_followers(flight, 4)
+    assert flight.stats()["in_flight"] == 1
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and errors == []
+    assert results == [{"data": [1, 2]}] * 5 and all(result is results[0] for result in results)
+    stats = flight.stats()
+    assert (stats["executed"], stats["coalesced"], stats["coalesced_rate"], stats["in_flight"]) == (1, 4, 0.8, 0)
+
+
+def test_waiting_callers_get_the_leaders_exception():
+    flight, release = SingleFlight(), threading.Event()
+
+    def fetch():
+        release.wait()
+        raise RuntimeError("503 Service unavailable")
+
+    threads, results, errors = run_concurrently(flight, "k", fetch, 3)
+    wait_for_followers(flight, 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [] and len(errors) == 3 and all(error is errors[0] for error in errors)
+    assert flight.stats()["errors"] == 1
+
+
+def test_nothing_is_kept_after_the_call():
+    flight, calls = SingleFlight(), []
+    flight.do("k", lambda: calls.append(1))
+    flight.do("k", lambda: calls.append(1))
+    with pytest.raises(ValueError):
+        flight.do("k", lambda: int("x"))
+    assert len(calls) == 2 and flight.stats()["executed"] == 3 and flight.stats()["in_flight"] == 0
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight, release = SingleFlight(), threading.Event()
+    threads, _, _ = run_concurrently(flight, "slow", release.wait, 1)
+    assert flight.do("fast", lambda: "done") == "done"
+    release.set()
+    threads[0].join()
@@ -0,0 +1,129 @@
+import json
+import time
+
+import pytest
+from flask import Request, Response
+from werkzeug.test import EnvironBuilder
+
+import tracing
+
+
+def request(method="POST", headers=None):
+    return Request(EnvironBuilder(method=method, headers=headers or {}).get_environ())
+
+
+def timings(header):
+    """{stage: milliseconds} from a Server-Timing header."""
+    entries = (entry.split(";dur=") for entry in header.split(", "))
+    return {name: float(duration) for name, duration in entries}
+
+
+def log_lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+
+
+@tracing.traced("handler")
+def handler(request):
+    with tracing.stage("firestore_query"):
+        time.sleep(0.01)
+    with tracing.stage("serialize"):
+        pass
+    with tracing.stage("firestore_query"):
+        pass
+    tracing.record("model", 0.25)
+    tracing.annotate(documents=3)
+    return {"data": []}, 200, {"Access-Control-Expose-Headers": "ETag"}
+
+
+def test_stages_go_to_the_server_timing_header_and_the_log_line(capsys):
+    body, status, headers = handler(request(headers={"X-Request-Id": "req-1"}))
+    stages = timings(headers["Server-Timing"])
+    assert list(stages) == ["firestore_query", "serialize", "model", "total"]
+    assert stages["firestore_query"] >= 10 and stages["model"] == 250.0 and stages["total"] >= 10
+    assert headers["X-Request-Id"] == "req-1" and headers["Timing-Allow-Origin"] == "*"
+    assert headers["Access-Control-Expose-Headers"] == "ETag, Server-Timing, X-Request-Id"
+
+    [line] = log_lines(capsys)
+    assert (line["function"], line["request_id"], line["status"], line["severity"]) == ("handler", "req-1", 200, "INFO")
+    assert line["documents"] == 3 and set(line["stages_ms"]) == {"firestore_query", "serialize", "model"}
+
+
+def test_the_cloud_trace_id_names_and_links_the_request(capsys, monkeypatch):
+    monkeypatch.setenv("GCP_PROJECT", "receipts")
+    _, _, headers = handler(request(headers={"X-Cloud-Trace-Context": "abc123/1;o=1"}))
+    assert headers["X-Request-Id"] == "abc123"
+    assert log_lines(capsys)[0]["logging.googleapis.com/trace"] == "projects/receipts/traces/abc123"
+
+
+def test_a_failing_handler_is_logged_as_500(capsys):
+    @tracing.traced("failing")
+    def failing(request):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        failing(request())
+    [line] = log_lines(capsys)
+    assert (line["status"], line["severity"]) == (500, "ERROR")
+    assert tracing.current() is None
+
+
+def test_preflights_and_calls_outside_a_request_are_not_traced(capsys):
+    @tracing.traced("preflight")
+    def preflight(request):
+        assert tracing.current() is None
+        return "", 204, {}
+
+    assert preflight(request("OPTIONS")) == ("", 204, {})
+    with tracing.stage("anything"):
+        tracing.record("anything", 1.0)
+        tracing.annotate(anything=True)
+    assert log_lines(capsys) == []
+
+
+def test_a_streamed_body_is_traced_until_the_stream_ends(capsys):
+    closed = []
+
+    def chunks():
+        try:
+            for index in range(3):
+                with tracing.stage("model"):
+                    time.sleep(0.005)
+                yield f"chunk {index}\n"
+        finally:
+            closed.append(True)
+
+    @tracing.traced("streaming")
+    def streaming(request):
+        with tracing.stage("prompt"):
+            pass
+        return Response(chunks(), mimetype="application/x-ndjson")
+
+    response = streaming(request())
+    # Only the stages before the stream started are in the header
+    assert list(timings(response.headers["Server-Timing"])) == ["prompt", "total"]
+    assert log_lines(capsys) == []
+
+    assert "".join(response.response) == "chunk 0\nchunk 1\nchunk 2\n"
+    assert closed == [True] and tracing.current() is None
+    [line] = log_lines(capsys)
+    assert line["status"] == 200 and line["stages_ms"]["model"] >= 15
+
+
+def test_a_stream_closed_early_still_logs(capsys):
+    @tracing.traced("streaming")
+    def streaming(request):
+        return Response(iter(["a", "b", "c"]))
+
+    body = streaming(request()).response
+    next(body)
+    body.close()
+    assert len(log_lines(capsys)) == 1
+
+
+def test_tracing_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(tracing, "ENABLED", False)
+
+    def plain(request):
+        return "ok"
+
+    assert tracing.traced("plain")(plain) is plain
@@ -0,0 +1,164 @@
+"""
+Keeps the chat history part of the prompt at a bounded size.
+
+Recent turns are kept verbatim up to a token budget. Older turns are folded
+into a rolling summary written by a cheap model. Summaries are cached on the
+turns they cover, so the model is only called again when the window shifts and
+more turns fall out of it. When an earlier summary covers a prefix of those
+turns, only the newly dropped turns are folded into it.
+
+Clients that send only the last N messages also send a conversation id and the
+offset of the first message they sent. Summaries are then keyed on
+(conversation, number of turns covered), so a summary still applies once its
+first turns are no longer sent, and the turns it has not seen are folded in.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from retrieval import estimate_tokens
+
+ROLES = {"user": "User", "human": "User", "ai": "Assistant", "assistant": "Assistant", "model": "Assistant"}
+
+
+def normalize_turns(history):
+    """
+    [(speaker, text)] from either history shape:
+    [{"User": "...", "AI": "..."}] or [{"role": "user" | "ai", "content": "..."}].
+    """
+    turns = []
+    for entry in history or []:
+        if not isinstance(entry, dict):
+            continue
+        role = entry.get("role")
+        if role is not None:
+            text = entry.get("content", entry.get("text"))
+            speaker = ROLES.get(str(role).lower())
+            if speaker and text:
+                turns.append((speaker, str(text)))
+            continue
+        # Check for both possible key casings ('User'/'user' and 'AI'/'ai')
+        user_msg = entry.get("User", entry.get("user"))
+        ai_msg = entry.get("AI", entry.get("ai"))
+        if user_msg:
+            turns.append(("User", str(user_msg)))
+        if ai_msg:
+            turns.append(("Assistant", str(ai_msg)))
+    return turns
+
+
+def format_turns(turns):
+    return "\n".join(f"{speaker}: {text}" for speaker, text in turns)
+
+
+class HistoryManager:
+    """
+    `summarize(previous_summary, turns)` returns the new summary text; it is
+    called with previous_summary=None when there is nothing to build on.
+    """
+
+    def __init__(self, summarize, token_budget=600, max_entries=256):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.max_entries = max_entries
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"summaries_cached": 0, "summaries_extended": 0, "summaries_created": 0, "errors": 0}
+
+    @staticmethod
+    def _prefix_keys(turns):
+        """Hash of every prefix of `turns`, so a summary of a shorter prefix can be found."""
+        digest = hashlib.sha256()
+        keys = []
+        for speaker, text in turns:
+            digest.update(speaker.encode("utf-8") + b"\0" + text.encode("utf-8") + b"\0")
+            keys.append(digest.hexdigest())
+        return keys
+
+    @staticmethod
+    def _turn_key(turn):
+        speaker, text = turn
+        return hashlib.sha256(speaker.encode("utf-8") + b"\0" + text.encode("utf-8")).hexdigest()
+
+    def _keys(self, older, conversation, offset):
+        """
+        (keys, base): keys[i] names a summary of the conversation up to and including
+        older[i]; base names one of everything before `older`, when there is such a
+        thing (a window that starts at `offset` > 0 of a conversation).
+        """
+        if conversation is None:
+            return self._prefix_keys(older), None
+        keys = [(conversation, offset + index + 1) for index in range(len(older))]
+        return keys, (conversation, offset) if offset > 0 else None
+
+    def split(self, turns):
+        """(older, recent): the newest turns that fit in the budget (at least one) and the rest."""
+        used = 0
+        index = len(turns)
+        while index > 0:
+            cost = estimate_tokens(f"{turns[index - 1][0]}: {turns[index - 1][1]}\n")
+            if used + cost > self.token_budget and index < len(turns):
+                break
+            used += cost
+            index -= 1
+        return turns[:index], turns[index:]
+
+    def _lookup(self, key, turn=None):
+        """Cached summary under `key`, if its last covered turn is `turn` (when given)."""
+        entry = self._summaries.get(key)
+        if entry is None or (turn is not None and entry[1] != self._turn_key(turn)):
+            return None
+        return entry[0]
+
+    def summary_for(self, older, conversation=None, offset=0):
+        """
+        Summary of `older`. With a conversation id, `offset` is the position of
+        older[0] in the whole conversation and the summary covers the turns before it too.
+        """
+        if not older:
+            return None
+        keys, base = self._keys(older, conversation, offset)
+        with self._lock:
+            cached = self._lookup(keys[-1], older[-1])
+            if cached is not None:
+                self._summaries.move_to_end(keys[-1])
+                self.counters["summaries_cached"] += 1
+                return cached
+            previous, covered = None, 0
+            for index in range(len(keys) - 2, -1, -1):
+                previous = self._lookup(keys[index], older[index])
+                if previous is not None:
+                    covered = index + 1
+                    break
+            if previous is None and base is not None:
+                previous = self._lookup(base)
+
+        try:
+            summary = self.summarize(previous, older[covered:])
+        except Exception as e:
+            print(f"Error summarizing chat history: {e}")
+            with self._lock:
+                self.counters["errors"] += 1
+            return previous
+
+        with self._lock:
+            self.counters["summaries_extended" if previous else "summaries_created"] += 1
+            self._summaries[keys[-1]] = (summary, self._turn_key(older[-1]))
+            while len(self._summaries) > self.max_entries:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def render(self, history, conversation=None, offset=0):
+        """The chat history section of the prompt."""
+        older, recent = self.split(normalize_turns(history))
+        summary = self.summary_for(older, conversation, offset)
+        lines = []
+        if summary:
+            lines.append(f"(Summary of the earlier conversation: {summary})")
+        if recent:
+            lines.append(format_turns(recent))
+        return "\n".join(lines)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "cached": len(self._summaries), "capacity": self.max_entries}
@@ -0,0 +1,313 @@
+"""
+Answers common spend questions directly from the transactions, without the model.
+
+The router recognizes a small grammar of lookup and aggregate questions:
+
+- latest / earliest transaction ("what was my last transaction")
+- biggest / smallest expense ("what was my most expensive purchase last month")
+- count ("how many transactions did I make on Friday")
+- total ("how much did I spend on groceries this week")
+- average ("what's my average dining expense in July")
+
+Each one can be narrowed by the time and category hints retrieval understands
+(see retrieval.time_window and retrieval.category_hints). The answer is computed
+exactly over the transactions sent as `context`.
+
+A question is only answered here when every word in it is accounted for by
+that grammar. Numbers and time words only count when time_window read the
+range from them, so "in 2024" or "last 3 months" go to the model instead of
+being answered over all the transactions. Anything else (merchants,
+comparisons, follow-ups that refer back to the conversation, a context
+without typed amounts) falls through to Gemini as well, and so does every
+question whose time range the context may not hold completely: a context with
+a `next_cursor` has more pages, and a get_user_data "range" (or, without one,
+the earliest transaction) bounds what it covers.
+"""
+import json
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+
+from history import normalize_turns
+from retrieval import (
+    MONTHS, WEEKDAYS, Record, category_hints, load_transactions, match_time_window, parse_time, tokenize,
+)
+
+# Nouns the questions use for a transaction
+_ITEM = r"(?:transaction|purchase|expense|payment|receipt|spend|buy|order|bill|action|activit(?:y|ie))s?"
+
+# (intent, pattern); a question has to match exactly one of them
+PATTERNS = (
+    ("latest", re.compile(rf"\b(?:last|latest|most recent|newest|recent)\s+(?:\w+\s+)?{_ITEM}\b")),
+    ("earliest", re.compile(rf"\b(?:first|earliest|oldest)\s+(?:\w+\s+)?{_ITEM}\b")),
+    ("largest", re.compile(
+        rf"\b(?:biggest|largest|highest|most expensive|costliest|maximum|max)\s+(?:\w+\s+)?{_ITEM}\b"
+    )),
+    ("smallest", re.compile(
+        rf"\b(?:smallest|cheapest|lowest|least expensive|minimum|min)\s+(?:\w+\s+)?{_ITEM}\b"
+    )),
+    ("count", re.compile(rf"\bhow many\s+(?:\w+\s+)?(?:{_ITEM}|times)\b|\bnumber of\s+(?:\w+\s+)?{_ITEM}\b")),
+    ("total", re.compile(
+        r"\bhow much\s+(?:money\s+)?(?:did|have|do)\s+i\s+(?:spend|spent|pay|paid)\b"
+        r"|\btotal\s+(?:spend|spending|spent|expenses?|amount)\b"
+        r"|\bwhat\s+did\s+i\s+spend\b"
+    )),
+    ("average", re.compile(rf"\b(?:average|avg|mean)\s+(?:\w+\s+)?(?:{_ITEM}|spend|spending)\b")),
+)
+
+# Words that refer back to the conversation; those questions need the model
+_REFERENCE_RE = re.compile(r"\b(?:it|that|those|these|them|then|there|same|again|else|instead)\b")
+
+# Words that name a whole category. Narrower hints ("movie", "coffee") would be
+# answered for the whole category, so those questions go to the model.
+CATEGORY_WORDS = {
+    "grocery", "groceries", "dining", "food", "restaurant", "restaurants", "utility", "utilities", "bill",
+    "bills", "health", "medical", "entertainment", "misc", "miscellaneous",
+}
+
+# Words the grammar accounts for, besides retrieval's stopwords. Time words are
+# not among them; they are only accounted for as part of the range time_window read.
+KNOWN_WORDS = (
+    CATEGORY_WORDS
+    | {
+        "recent", "latest", "most", "newest", "first", "earliest", "oldest", "biggest", "largest", "highest", "expensive",
+        "costliest", "maximum", "max", "smallest", "cheapest", "lowest", "least", "minimum", "min", "number",
+        "times", "average", "avg", "mean", "spending", "expense", "expenses", "purchase", "purchases",
+        "payment", "payments", "receipt", "receipts", "order", "orders", "amount", "pay", "paid", "so", "far",
+        "overall", "single", "ever", "please", "whats", "s", "st", "nd", "rd", "th", "make", "made",
+        "action", "actions", "activity", "based", "data", "according", "records", "took",
+    }
+)
+
+# Numbers and words that name or bound a time range. Left over outside the range
+# time_window read, they mean the question asks about a range it didn't understand.
+_TIME_WORD_RE = re.compile(
+    r"\b(?:\d+(?:st|nd|rd|th)?|today|tonight|yesterday|tomorrow|days?|daily|weeks?|weekly|weekends?|fortnight"
+    r"|months?|monthly|quarters?|quarterly|years?|yearly|annual|annually|current|previous|past|ago|since|until"
+    r"|till|before|after|between|from|"
+    + "|".join(sorted(MONTHS, key=len, reverse=True)) + "|" + "|".join(WEEKDAYS) + r")\b"
+)
+
+_EARLIEST = datetime.min.replace(tzinfo=timezone.utc)
+_LATEST = datetime.max.replace(tzinfo=timezone.utc)
+
+
+def _normalize(query):
+    return " ".join(str(query).lower().replace("’", "'").split())
+
+
+def _unknown_words(query):
+    return [token for token in tokenize(query) if token not in KNOWN_WORDS]
+
+
+def covered_range(context, records):
+    """
+    (start, end) of the time the transactions in `context` are known to cover
+    completely, or None if the context has more pages. get_user_data list
+    responses carry their "range" (an open end is null); without one, anything
+    before the earliest transaction may be missing.
+    """
+    if isinstance(context, str):
+        try:
+            context = json.loads(context)
+        except ValueError:
+            return None
+    if isinstance(context, dict):
+        if context.get("next_cursor"):
+            return None
+        covered = context.get("range")
+        if isinstance(covered, dict):
+            start, end = covered.get("start"), covered.get("end")
+            start = parse_time(start) if start else _EARLIEST
+            end = parse_time(end) if end else _LATEST
+            return (start, end) if start and end else None
+    times = [record.time for record in records if record.time]
+    return (min(times), _LATEST) if times else None
+
+
+def _ordinal(day):
+    suffix = "th" if 11 <= day % 100 <= 13 else {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th")
+    return f"{day}{suffix}"
+
+
+def format_date(moment):
+    return f"{moment.strftime('%A, %B')} {_ordinal(moment.day)}, {moment.year}"
+
+
+def format_amount(amount):
+    text = f"{amount:,.2f}"
+    return text[:-3] if text.endswith(".00") else text
+
+
+def _scope(window):
+    """How the answer refers to the time range: "last week", "on Friday, July 25th, 2025", ..."""
+    if not window:
+        return ""
+    start, end, label = window
+    if label in ("today", "yesterday", "this week", "last week", "this month", "last month"):
+        return f" {label}"
+    if label.startswith("since "):
+        return f" {label}"
+    if label.startswith("last "):
+        return f" in the {label}"
+    if end - start == timedelta(days=1):
+        return f" on {format_date(start)}"
+    return f" in {label}"
+
+
+def _categories(categories):
+    return " and ".join(categories) if categories else ""
+
+
+def _describe(record, with_category=True):
+    """
+    "a groceries transaction of 740.50 at DMart on Friday, July 25th, 2025, at 23:38 GMT",
+    or "740.50 at DMart on ..." when the question already named the category.
+    """
+    amount = format_amount(record.amount) if record.amount is not None else None
+    merchant = f" at {record.merchant.strip()}" if record.merchant else ""
+    when = f" on {format_date(record.time)}, at {record.time.strftime('%H:%M')} GMT" if record.time else ""
+    if with_category or amount is None:
+        category = f"{record.category} " if record.category else ""
+        article = "an" if category[:1] in ("a", "e", "i", "o", "u") else "a"
+        amount = f" of {amount}" if amount is not None else ""
+        return f"{article} {category}transaction{amount}{merchant}{when}"
+    return f"{amount}{merchant}{when}"
+
+
+class IntentRouter:
+    """Answers the questions the grammar covers and counts how many it answered or passed on."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"answered": 0, "fell_through": 0}
+        self.by_intent = {}
+
+    def _count(self, outcome, intent=None):
+        with self._lock:
+            self.counters[outcome] += 1
+            if intent:
+                self.by_intent[intent] = self.by_intent.get(intent, 0) + 1
+
+    @staticmethod
+    def classify(user_query, now=None):
+        """The intent of a question, or None if it isn't safe to answer without the model."""
+        text = _normalize(user_query)
+        intents = {intent for intent, pattern in PATTERNS if pattern.search(text)}
+        if len(intents) != 1 or _REFERENCE_RE.search(text):
+            return None
+        window = match_time_window(text, now or datetime.now(timezone.utc))
+        if window:
+            begin, end = window[3]
+            text = f"{text[:begin]} {text[end:]}"
+        rest = text.replace("'", " ")
+        if _TIME_WORD_RE.search(rest) or _unknown_words(rest):
+            return None
+        return intents.pop()
+
+    def answer(self, context, user_query, chat_history=None, user_data=None, now=None):
+        """
+        (reply, details) for a question the grammar covers, computed from the
+        transactions in `context`; None to ask the model instead.
+        """
+        now = now or datetime.now(timezone.utc)
+        intent = self.classify(user_query, now)
+        transactions = load_transactions(context) if intent else None
+        if transactions is None:
+            self._count("fell_through")
+            return None
+
+        records = [Record(transaction) for transaction in transactions]
+        window = match_time_window(_normalize(user_query), now)
+        window = window[:3] if window else None
+        categories = category_hints(user_query)
+        matching = records
+        if window:
+            start, end, _ = window
+            matching = [record for record in matching if record.time and start <= record.time < end]
+        if categories:
+            matching = [record for record in matching if record.category in categories]
+
+        # The answer has to cover the whole range asked about, not just the part in the context
+        covered = covered_range(context, records)
+        times = [record.time for record in matching if record.time]
+        if window:
+            needed = window[:2]
+        elif intent == "latest" and times:
+            needed = (max(times), _LATEST)
+        elif intent == "earliest" and times:
+            needed = (_EARLIEST, min(times))
+        else:
+            needed = (_EARLIEST, _LATEST)
+        if not covered or covered[0] > needed[0] or covered[1] < needed[1]:
+            self._count("fell_through")
+            return None
+
+        # Answers are only exact if every matching transaction has the fields they need
+        if intent in ("latest", "earliest") and any(record.time is None for record in matching):
+            self._count("fell_through")
+            return None
+        if intent in ("largest", "smallest", "total", "average") and any(
+            record.amount is None for record in matching
+        ):
+            self._count("fell_through")
+            return None
+
+        reply = self._reply(intent, matching, window, categories)
+        name = (user_data or {}).get("name") if isinstance(user_data, dict) else None
+        # Same greeting rule as the model: the user's name on the first turn only
+        if name and not normalize_turns(chat_history):
+            reply = f"Hi {name}! {reply}"
+        self._count("answered", intent)
+        details = {"name": intent, "matching": len(matching), "transactions": len(records)}
+        if window:
+            details["time_range"] = window[2]
+        if categories:
+            details["categories"] = categories
+        return reply, details
+
+    @staticmethod
+    def _reply(intent, matching, window, categories):
+        scope = _scope(window)
+        kind = _categories(categories)
+        kind_prefix = f"{kind} " if kind else ""
+        if not matching:
+            if intent == "count":
+                return f"You made no {kind_prefix}transactions{scope}."
+            return f"I couldn't find any {kind_prefix}transactions{scope}."
+
+        if intent == "count":
+            noun = "transaction" if len(matching) == 1 else "transactions"
+            return f"You made {len(matching)} {kind_prefix}{noun}{scope}."
+        if intent == "total":
+            total = sum(record.amount for record in matching)
+            on = f" on {kind}" if kind else ""
+            noun = "transaction" if len(matching) == 1 else "transactions"
+            return f"You spent {format_amount(total)}{on}{scope}, across {len(matching)} {noun}."
+        if intent == "average":
+            average = sum(record.amount for record in matching) / len(matching)
+            noun = "transaction" if len(matching) == 1 else "transactions"
+            return (f"Your average {kind_prefix}transaction{scope} was {format_amount(round(average, 2))}, "
+                    f"across {len(matching)} {noun}.")
+
+        oldest = datetime.min.replace(tzinfo=timezone.utc)
+        if intent == "latest":
+            record, label = max(matching, key=lambda record: record.time or oldest), "last"
+        elif intent == "earliest":
+            record, label = min(matching, key=lambda record: record.time or oldest), "first"
+        elif intent == "largest":
+            record, label = max(matching, key=lambda record: record.amount), "biggest"
+        else:
+            record, label = min(matching, key=lambda record: record.amount), "smallest"
+        noun = "transaction" if intent in ("latest", "earliest") else "expense"
+        return f"Your {label} {kind_prefix}{noun}{scope} was {_describe(record, with_category=not kind)}."
+
+    def stats(self):
+        with self._lock:
+            questions = self.counters["answered"] + self.counters["fell_through"]
+            return {
+                **self.counters,
+                "questions": questions,
+                "answered_rate": round(self.counters["answered"] / questions, 4) if questions else 0.0,
+                "by_intent": dict(self.by_intent),
+            }
@@ -1,35 +1,49 @@
 import os
+import time
+from datetime import datetime, timezone
 import functions_framework
-import vertexai
-from vertexai.generative_models import GenerativeModel
+from clients import LazyClient
+from history import HistoryManager, format_turns, normalize_turns
+from intents import IntentRouter
+from model_cache import CachedSystemModel
+from prompt import SYSTEM_INSTRUCTION, all_transactions, build_prompt, transaction_row
+from reply_cache import FirestoreReplyStore, ReplyCache, make_key
+from retrieval import estimate_tokens, select_context
+from singleflight import SingleFlight
+from streaming import chunk_text, stream_format, stream_response
+import tracing
 
 
 # --- Helper Function to Format Chat History ---
 def format_chat_history(history_array):
     """
     Formats an array of chat objects into a simple string for the prompt.
-    Input: [{"User": "...", "AI": "..."}, ...]
+    Input: [{"User": "...", "AI": "..."}, ...] or [{"role": "user" | "ai", "content": "..."}, ...]
     Output: "User: ...\nAssistant: ..."
     """
-    if not history_array:
-        return ""
-
-    formatted_lines = []
-    for turn in history_array:
-        # Check for both possible key casings ('User'/'user' and 'AI'/'ai')
-        user_msg = turn.get("User", turn.get("user"))
-        ai_msg = turn.get("AI", turn.get("ai"))
-
-        if user_msg:
-            formatted_lines.append(f"User: {user_msg}")
-        if ai_msg:
-            formatted_lines.append(f"Assistant: {ai_msg}")
-
-    return "\n".join(formatted_lines)
+    return format_turns(normalize_turns(history_array))
 
 
 # --- Vertex AI Initialization ---
-try:
+MODEL_NAME = "gemini-2.5-flash-lite"
+# Cheap model that folds older chat turns into a rolling summary
+SUMMARY_MODEL_NAME = os.environ.get("SUMMARY_MODEL_NAME", "gemini-2.5-flash-lite")
+# The static instructions are sent as a system instruction. With CONTEXT_CACHE_ENABLED
+# they go into a Vertex AI context cache together with a chat session's transactions
+# table, when that is between the model's minimum cacheable size and
+# CONTEXT_CACHE_MAX_TOKENS (estimated tokens; see model_cache.py)
+CONTEXT_CACHE_ENABLED = os.environ.get("CONTEXT_CACHE_ENABLED", "1") == "1"
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "2048"))
+CONTEXT_CACHE_MAX_TOKENS = int(os.environ.get("CONTEXT_CACHE_MAX_TOKENS", "8000"))
+CONTEXT_CACHE_SESSION_TTL_SECONDS = int(os.environ.get("CONTEXT_CACHE_SESSION_TTL_SECONDS", "600"))
+# After a failed create, nothing is cached on the instance for this long
+CONTEXT_CACHE_RETRY_SECONDS = int(os.environ.get("CONTEXT_CACHE_RETRY_SECONDS", "21600"))
+
+
+def init_vertexai():
+    import vertexai
+
     PROJECT_ID = os.environ.get("GCP_PROJECT")
     LOCATION = os.environ.get("GCP_REGION")
 
@@ -37,14 +51,178 @@ try:
         raise ValueError("GCP_PROJECT and GCP_REGION environment variables are not set.")
 
     vertexai.init(project=PROJECT_ID, location=LOCATION)
-    # Corrected model name to a valid Gemini Pro model
-    model = GenerativeModel("gemini-2.5-flash-lite")
-except Exception as e:
-    print(f"Error initializing Vertex AI: {e}")
-    model = None
+    return vertexai
+
+
+def create_model():
+    if not vertex.get():
+        raise RuntimeError("Vertex AI is not initialized.")
+    return CachedSystemModel(
+        MODEL_NAME,
+        SYSTEM_INSTRUCTION,
+        use_context_cache=CONTEXT_CACHE_ENABLED,
+        ttl_seconds=CONTEXT_CACHE_TTL_SECONDS,
+        min_tokens=CONTEXT_CACHE_MIN_TOKENS,
+        max_tokens=CONTEXT_CACHE_MAX_TOKENS,
+        session_ttl_seconds=CONTEXT_CACHE_SESSION_TTL_SECONDS,
+        retry_after_seconds=CONTEXT_CACHE_RETRY_SECONDS,
+    )
+
+
+def create_summary_model():
+    from vertexai.generative_models import GenerativeModel
+
+    if not vertex.get():
+        raise RuntimeError("Vertex AI is not initialized.")
+    return GenerativeModel(SUMMARY_MODEL_NAME)
+
+
+def create_firestore_client():
+    from google.cloud import firestore
+
+    return firestore.Client(project="graceful-byway-467117-r0", database="receipt-management")
+
+
+# Clients are created on first use and reused across invocations (see clients.py), so
+# preflights, rejected requests and answers that need no model don't load Vertex AI
+vertex = LazyClient("Vertex AI", init_vertexai)
+model = LazyClient("Gemini model", create_model)
+summary_model = LazyClient("summary model", create_summary_model)
+db = LazyClient("Firestore client", create_firestore_client)
+
+HISTORY_SUMMARY_WORDS = int(os.environ.get("HISTORY_SUMMARY_WORDS", "120"))
+
+
+def summarize_history(previous_summary, turns):
+    """Rolling summary of the chat turns that no longer fit in the prompt verbatim."""
+    if not summary_model.get():
+        raise RuntimeError("Summary model is not available.")
+    earlier = f"Summary so far:\n{previous_summary}\n\n" if previous_summary else ""
+    prompt = (
+        f"You maintain a running summary of a chat between a user and their personal finance assistant. "
+        f"Update the summary with the new messages in at most {HISTORY_SUMMARY_WORDS} words. Keep names, "
+        f"amounts, dates, merchants, categories and anything the user asked to remember or follow up on. "
+        f"Reply with the summary only.\n\n{earlier}New messages:\n{format_turns(turns)}"
+    )
+    return summary_model.get().generate_content(prompt).text.strip()
+
+
+def usage_of(response):
+    """Token counts Vertex AI reports for a response, if any."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": getattr(usage, "prompt_token_count", None),
+        "cached_tokens": getattr(usage, "cached_content_token_count", None),
+        "output_tokens": getattr(usage, "candidates_token_count", None),
+    }
+
+
+def generate(generative_model, prompt):
+    response = generative_model.generate_content(prompt)
+    return response.text, usage_of(response)
+
+
+def generate_events(generative_model, prompt, on_done=None):
+    """
+    ("chunk", {"text"}) for each piece of the reply as the model streams it, then
+    ("done", {"reply", "usage"}) or ("error", {"error"}). `on_done` is called with
+    the reply once it is complete.
+    """
+    parts, usage = [], None
+    started = time.perf_counter()
+    try:
+        for chunk in generative_model.generate_content(prompt, stream=True):
+            # Usage is reported on the last chunk
+            usage = usage_of(chunk) or usage
+            text = chunk_text(chunk)
+            if text:
+                if not parts:
+                    tracing.record("model_first_chunk", time.perf_counter() - started)
+                parts.append(text)
+                yield "chunk", {"text": text}
+    except Exception as e:
+        print(f"An error occurred while streaming from Gemini API: {e}")
+        yield "error", {"error": "An internal error occurred while processing the request."}
+        return
+    # Includes the time the client took to read the chunks
+    tracing.record("model", time.perf_counter() - started)
+    tracing.annotate(**(usage or {}))
+    print(f"Prompt tokens: reported {usage} (streamed)")
+    body = {"reply": "".join(parts)}
+    if on_done:
+        on_done(body["reply"])
+    if usage:
+        body["usage"] = usage
+    yield "done", body
+
+
+# Recent turns stay verbatim within HISTORY_TOKEN_BUDGET; older ones are summarized
+history_manager = HistoryManager(
+    summarize_history,
+    token_budget=int(os.environ.get("HISTORY_TOKEN_BUDGET", "600")),
+    max_entries=int(os.environ.get("HISTORY_CACHE_SIZE", "256")),
+)
+
+# Send only the transactions relevant to the question (plus a summary) instead of the
+# whole history, within this many estimated tokens
+RETRIEVAL_ENABLED = os.environ.get("RETRIEVAL_ENABLED", "1") == "1"
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "2000"))
+
+# Answer common lookup/aggregate questions ("how much did I spend on groceries this
+# week") exactly from the context, without calling the model
+intent_router = IntentRouter() if os.environ.get("INTENTS_ENABLED", "1") == "1" else None
+
+# Replies to repeated questions over the same transactions and conversation window.
+# REPLY_CACHE_COLLECTION adds a Firestore tier shared by all instances.
+REPLY_CACHE_COLLECTION = os.environ.get("REPLY_CACHE_COLLECTION", "")
+# Part of every key, so changing the model or the instructions starts a fresh cache
+PROMPT_VERSION = SingleFlight.make_key({"model": MODEL_NAME, "system_instruction": SYSTEM_INSTRUCTION})[:16]
+if os.environ.get("REPLY_CACHE_ENABLED", "1") == "1":
+    reply_store = None
+    reply_cache_ttl = float(os.environ.get("REPLY_CACHE_TTL_SECONDS", "600"))
+    if REPLY_CACHE_COLLECTION:
+        reply_store = FirestoreReplyStore(db, REPLY_CACHE_COLLECTION, reply_cache_ttl)
+    reply_cache = ReplyCache(
+        max_entries=int(os.environ.get("REPLY_CACHE_SIZE", "256")), ttl_seconds=reply_cache_ttl, store=reply_store
+    )
+else:
+    reply_cache = None
+
+# Clients can ask for the reply as a stream ("stream": true | "sse" | "ndjson" or the
+# Accept header); otherwise it is one JSON response
+STREAMING_ENABLED = os.environ.get("STREAMING_ENABLED", "1") == "1"
+
+# Identical prompts that arrive while the same generation is running share its reply
+single_flight = SingleFlight() if os.environ.get("SINGLE_FLIGHT_ENABLED", "1") == "1" else None
+
+
+def reply_response(body, fmt, headers):
+    """A reply that is already complete, as JSON or as a one-chunk stream."""
+    if fmt:
+        return stream_response(iter([("chunk", {"text": body["reply"]}), ("done", body)]), fmt, headers)
+    return (body, 200, headers)
+
+
+def history_window(request_json, user_data):
+    """
+    (conversation, offset) for history_manager.render: the client's conversation id,
+    scoped to the user, and the position of the first turn it sent. (None, 0) when
+    the request has no usable conversation id.
+    """
+    conversation_id = request_json.get("conversation_id")
+    offset = request_json.get("history_offset", 0)
+    if not isinstance(conversation_id, str) or not conversation_id:
+        return None, 0
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        offset = 0
+    user_name = user_data.get("name") if isinstance(user_data, dict) else None
+    return f"{user_name}\0{conversation_id}", offset
 
 
 @functions_framework.http
+@tracing.traced("query_gemini")
 def query_gemini(request):
     """
     HTTP Cloud Function to interact with the Gemini API.
@@ -55,20 +233,22 @@ def query_gemini(request):
             "user_data": {},
             "user_query": "Your question here",
             "context": "Initial prompt or context",
-            "chat_history": [{"User": "...", "AI": "..."}]
+            "chat_history": [{"role": "user" | "ai", "content": "..."}] or [{"User": "...", "AI": "..."}],
+            "conversation_id": "..." (optional, with "history_offset": the number of
+                turns before the first one in chat_history, when only the latest are sent),
+            "stream": false | true | "sse" | "ndjson" (optional)
         }
     Returns:
-        A JSON response with Gemini's reply or an error message.
+        A JSON response with Gemini's reply or an error message. With "stream" (or
+        an Accept header of text/event-stream or application/x-ndjson), the reply
+        is streamed as Server-Sent Events or NDJSON instead; see streaming.py.
     """
-    if not model:
-        return {"error": "Vertex AI model is not available."}, 500
-
     # Set CORS headers for preflight requests
     if request.method == "OPTIONS":
         headers = {
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "POST",
-            "Access-Control-Allow-Headers": "Content-Type",
+            "Access-Control-Allow-Headers": "Content-Type, Accept",
             "Access-Control-Max-Age": "3600",
         }
         return ("", 204, headers)
@@ -92,110 +272,133 @@ def query_gemini(request):
     if not user_query:
         return ({"error": "Missing 'user_query' in request body"}, 400, headers)
 
-    try:
-
-        # Note: You would need to inject the current date and time into the prompt
-        # For example:
-        from datetime import datetime
-        current_date_time = datetime.now().strftime("%A, %d %B %Y")
-        chat_history_string = format_chat_history(chat_history_array)
+    fmt = stream_format(request, request_json) if STREAMING_ENABLED else None
+    if fmt:
+        tracing.annotate(stream=fmt)
 
-        # Construct the prompt for Gemini
-        prompt = f"""
-        # IDENTITY AND PERSONA
-        You are Gemini, a world-class personal assistant. Your personality is charming, helpful, and highly efficient. You are warm and friendly but always concise. You address the user by their name when appropriate, but you adapt your greeting based on the conversation history.
-
-        # CONTEXT & DATA ANALYSIS
-        You will be given four pieces of information:
-        1.  `context`: A JSON object containing a list of the user's recent transactional data. This is your single source of truth for user activity. Each transaction object has a `tid`, `transaction_time`, `details`, and `transaction_type`.
-        2.  `user_data`: A JSON object containing personal details about the user, such as their `name`.
-        3.  `chat_history`: A transcript of the recent conversation. Use this to understand the flow of the conversation, maintain context for follow-up questions, and avoid repetitive greetings. If this is empty, it is the first turn of the conversation.
-        4.  `user_query`: The most recent question the user has asked. You must answer this query.
-
-        # CORE INSTRUCTIONS
-        Your task is to act as the user's personal assistant and answer their `user_query` by analyzing the `context` data and `chat_history`. Follow these steps:
-        1.  **Analyze `chat_history` for conversational context.**
-        2.  **Greeting Logic:**
-            - If `chat_history` is empty, this is the **first message**. Start with a brief, friendly salutation using the user's name (e.g., "Hi Aadhar!").
-            - If `chat_history` is **not empty**, this is a **follow-up message**. OMIT the full salutation. You may use a very brief acknowledgment (e.g., "Certainly," "Got it.") or proceed directly to the answer.
-        3.  Carefully analyze the `user_query`, using the `chat_history` to understand its context.
-        4.  Systematically scan the list of transactions in the `context` data to find the required information.
-        5.  Formulate a clear, concise, and accurate answer.
-        6.  Present the answer directly to the user.
-
-        # RULES & CONSTRAINTS
-        - **Salutation is key:** Greet the user by name ONLY on the first turn. In subsequent turns, be more direct. The goal is to feel like a continuous conversation, not a series of new ones.
-        - **Maintain Context:** Use the `chat_history` to understand pronouns (e.g., "How much was *it*?") and follow-up requests.
-        - **Never make up information.** If the answer cannot be found in the `context` data, state that clearly.
-        - **Be Brief:** Avoid long, unnecessary pleasantries. Efficiency is paramount.
-        - **Timestamps** are in GMT. The current date is Sunday, July 27, 2025. The current location is Bengaluru, India. Use this for any relevant spatial or temporal context.
-
-        # FEW-SHOT EXAMPLES (Demonstrating conversational flow)
-
-        ---
-        **EXAMPLE 1 (First Turn)**
-
-        [CONTEXT]: {{"data":[...same data as below...]}}
-        [USER_DATA]: {{"name": "Aadhar"}}
-        [CHAT_HISTORY]: 
-        [USER_QUERY]: "Based on my data, what was the last action I took?"
-
-        [YOUR RESPONSE]:
-        Hi Aadhar! Your last action was a 'groceries' transaction on Friday, July 25th, 2025, at 23:38 GMT.
-
-        ---
-        **EXAMPLE 2 (Follow-up Turn)**
-
-        [CONTEXT]: {{"data":[...same data as below...]}}
-        [USER_DATA]: {{"name": "Aadhar"}}
-        [CHAT_HISTORY]: User: Based on my data, what was the last action I took?
-        Assistant: Hi Aadhar! Your last action was a 'groceries' transaction on Friday, July 25th, 2025, at 23:38 GMT.
-        [USER_QUERY]: "How many transactions did I make on that day?"
-
-        [YOUR RESPONSE]:
-        So, you made 3 transactions on Friday, July 25th, 2025.
-
-        ---
-        **EXAMPLE 3 (Unrelated Follow-up)**
-
-        [CONTEXT]: {{"data":[...same data as below...]}}
-        [USER_DATA]: {{"name": "Aadhar"}}
-        [CHAT_HISTORY]: User: Based on my data, what was the last action I took?
-        Assistant: Hi Aadhar! Your last action was a 'groceries' transaction on Friday, July 25th, 2025, at 23:38 GMT.
-        User: How many transactions did I make on that day?
-        Assistant: You made 3 transactions on Friday, July 25th, 2025.
-        [USER_QUERY]: "Okay, thanks. Now show me my first movie purchase."
-
-        [YOUR RESPONSE]:
-        Certainly. Your first recorded movie-related purchase was on Thursday, July 24th, 2025.
+    try:
+        with tracing.stage("intents"):
+            answer = intent_router.answer(context, user_query, chat_history_array, user_data) if intent_router else None
+        if answer:
+            reply, intent = answer
+            print(f"Answered without the model: {intent}")
+            tracing.annotate(intent=intent["name"])
+            return reply_response({"reply": reply, "intent": intent}, fmt, headers)
+
+        reply_key = None
+        if reply_cache:
+            with tracing.stage("cache_lookup"):
+                older, recent = history_manager.split(normalize_turns(chat_history_array))
+                user_name = user_data.get("name") if isinstance(user_data, dict) else None
+                reply_key = make_key(
+                    user_query, context, recent, bool(older), user_name, datetime.now(timezone.utc), PROMPT_VERSION
+                )
+                cached = reply_cache.get(reply_key)
+            tracing.annotate(cache="hit" if cached else "miss")
+            headers = {**headers, "Access-Control-Expose-Headers": "X-Cache", "X-Cache": "hit" if cached else "miss"}
+            if cached:
+                reply, tier = cached
+                print(f"Reply cache hit ({tier})")
+                return reply_response({"reply": reply}, fmt, headers)
+
+        def remember(reply):
+            if reply_key and reply:
+                reply_cache.put(reply_key, reply)
+
+        if not model.get():
+            return ({"error": "Vertex AI model is not available."}, 500, headers)
+
+        # Older turns may need the summary model
+        conversation, offset = history_window(request_json, user_data)
+        with tracing.stage("history"):
+            chat_history_string = history_manager.render(chat_history_array, conversation, offset)
+
+        # The session's transactions table, cached along with the system instruction if it qualifies
+        stable_context = all_transactions(context) if CONTEXT_CACHE_ENABLED else None
+        with tracing.stage("context_cache"):
+            generative_model, cached = model.get().get(stable_context)
+        transactions_cached = cached == "context"
+
+        if RETRIEVAL_ENABLED:
+            with tracing.stage("retrieval"):
+                context, retrieval_stats = select_context(
+                    context, user_query, token_budget=CONTEXT_TOKEN_BUDGET, serialize=transaction_row
+                )
+            print(f"Context retrieval: {retrieval_stats}")
+
+        # Persona, rules and examples are in the system instruction; this is only the request
+        with tracing.stage("prompt"):
+            prompt = build_prompt(
+                context, user_data, chat_history_string, user_query, datetime.now(timezone.utc),
+                transactions_cached=transactions_cached,
+            )
+
+        # Streams aren't shared through single_flight: each client gets its own
+        if fmt:
+            return stream_response(generate_events(generative_model, prompt, on_done=remember), fmt, headers)
 
-        ---
+        # Generate content
+        with tracing.stage("model"):
+            if single_flight:
+                # The cached table is part of the prompt the model sees
+                flight_key = SingleFlight.make_key({
+                    "model": MODEL_NAME, "prompt": prompt, "cached": stable_context if transactions_cached else None,
+                })
+                reply, usage = single_flight.do(flight_key, lambda: generate(generative_model, prompt))
+            else:
+                reply, usage = generate(generative_model, prompt)
+        tracing.annotate(**(usage or {}))
+        print(f"Prompt tokens: estimated {estimate_tokens(prompt)} request + "
+              f"{estimate_tokens(SYSTEM_INSTRUCTION)} system "
+              f"+ {estimate_tokens(stable_context) if transactions_cached else 0} transactions "
+              f"({cached + ' cached' if cached else 'not cached'}), "
+              f"reported {usage}")
+        remember(reply)
 
-        **END OF EXAMPLES**
+        # Return the generated text
+        body = {"reply": reply}
+        if usage:
+            body["usage"] = usage
+        return (body, 200, headers)
 
-        Now, process the real request below.
+    except Exception as e:
+        print(f"An error occurred while calling Gemini API: {e}")
+        return ({"error": "An internal error occurred while processing the request."}, 500, headers)
 
-        [CONTEXT]:
-        {context}
 
-        [USER_DATA]:
-        {user_data}
+@functions_framework.http
+def single_flight_stats(request):
+    """Returns how many generations this instance ran and how many requests joined one in flight."""
+    headers = {"Access-Control-Allow-Origin": "*"}
+    if not single_flight:
+        return ({"enabled": False}, 200, headers)
+    return ({"enabled": True, **single_flight.stats()}, 200, headers)
 
-        [CHAT_HISTORY]:
-        {chat_history_string}
 
-        [USER_QUERY]:
-        "{user_query}"
+@functions_framework.http
+def intent_stats(request):
+    """Returns how many questions this instance answered without the model, per intent."""
+    headers = {"Access-Control-Allow-Origin": "*"}
+    if not intent_router:
+        return ({"enabled": False}, 200, headers)
+    return ({"enabled": True, **intent_router.stats()}, 200, headers)
 
-        [YOUR RESPONSE]:
-        """
 
-        # Generate content
-        response = model.generate_content(prompt)
+@functions_framework.http
+def reply_cache_stats(request):
+    """Returns hit/miss counts of this instance's reply cache, per tier."""
+    headers = {"Access-Control-Allow-Origin": "*"}
+    if not reply_cache:
+        return ({"enabled": False}, 200, headers)
+    return ({"enabled": True, **reply_cache.stats()}, 200, headers)
 
-        # Return the generated text
-        return ({"reply": response.text}, 200, headers)
 
-    except Exception as e:
-        print(f"An error occurred while calling Gemini API: {e}")
-        return ({"error": "An internal error occurred while processing the request."}, 500, headers)
+@functions_framework.http
+def context_cache_stats(request):
+    """Returns how many context caches this instance created, and why it skipped or failed others."""
+    headers = {"Access-Control-Allow-Origin": "*"}
+    if not CONTEXT_CACHE_ENABLED:
+        return ({"enabled": False}, 200, headers)
+    if not model.get():
+        return ({"error": "Vertex AI model is not available."}, 500, headers)
+    return ({"enabled": True, **model.get().stats()}, 200, headers)
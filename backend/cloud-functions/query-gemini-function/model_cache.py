@@ -0,0 +1,145 @@
+"""
+Serves GenerativeModels whose static content is stored in Vertex AI context
+caches, so it is billed as cached input instead of being resent with every
+request.
+
+Vertex AI only caches content of at least `min_tokens` (2048 for the Gemini 2.5
+models), and the system instruction alone is smaller than that. The size is
+checked before anything is created. What gets cached for a chat session is the
+system instruction plus the stable part of its requests, the user's whole
+transactions table, once the same table comes back within
+`session_ttl_seconds`. Tables above `max_tokens` aren't cached: retrieval sends
+less at the full rate than the cache would bill at the cached rate.
+
+Content that can't be cached is sent with each request instead, which still
+benefits from Gemini's implicit prefix caching. A failed create is remembered:
+nothing is created on this instance for `retry_after_seconds` after one.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from retrieval import estimate_tokens
+
+# Refresh a cache this long before it expires so no request hits an expired one
+REFRESH_MARGIN_SECONDS = 60
+
+
+class CachedSystemModel:
+    def __init__(self, model_name, system_instruction, use_context_cache=True, ttl_seconds=3600, min_tokens=2048,
+                 max_tokens=8000, session_ttl_seconds=600, retry_after_seconds=21600, max_sessions=128):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.use_context_cache = use_context_cache
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.session_ttl_seconds = session_ttl_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.max_sessions = max_sessions
+        self._plain = None
+        # Hash of the cached context ("" for the system instruction alone) -> {"seen_at", "model", "refresh_at"}
+        self._entries = OrderedDict()
+        self._failed_until = None
+        self._lock = threading.Lock()
+        self.counters = {"created": 0, "failures": 0, "too_small": 0, "too_large": 0}
+
+    def get(self, stable_context=None):
+        """
+        (model, cached) for a request. `cached` is "context" when the model's
+        cached content holds the system instruction and `stable_context`,
+        "system" when it holds the instruction alone, and None for the plain
+        model. The caller sends `stable_context` itself unless it is cached.
+        """
+        if not self.use_context_cache:
+            return self.plain(), None
+        system_tokens = estimate_tokens(self.system_instruction)
+        if stable_context:
+            tokens = system_tokens + estimate_tokens(stable_context)
+            if tokens > self.max_tokens:
+                self._count("too_large")
+                stable_context = None
+            elif tokens < self.min_tokens:
+                self._count("too_small")
+                stable_context = None
+        if not stable_context and system_tokens < self.min_tokens:
+            return self.plain(), None
+
+        key = hashlib.sha256(stable_context.encode("utf-8")).hexdigest() if stable_context else ""
+        now = time.monotonic()
+        with self._lock:
+            if self._failed_until is not None and now < self._failed_until:
+                return self._plain_locked(), None
+            entry = self._entries.get(key)
+            # A session's table is cached the second time it is seen; the instruction right away
+            first_sighting = entry is None or now - entry["seen_at"] > self.session_ttl_seconds
+            if key:
+                self._entries[key] = entry = {**(entry or {}), "seen_at": now}
+                self._entries.move_to_end(key)
+                self._evict()
+            if entry and entry.get("model") and now < entry["refresh_at"]:
+                return entry["model"], "context" if key else "system"
+            if (key and first_sighting) or (entry and entry.get("creating")):
+                return self._plain_locked(), None
+            entry = self._entries[key] = {**(entry or {}), "seen_at": now, "creating": True}
+
+        ttl_seconds = self.session_ttl_seconds if key else self.ttl_seconds
+        model = self._create(stable_context, ttl_seconds)
+        with self._lock:
+            entry["creating"] = False
+            if model is None:
+                self._failed_until = time.monotonic() + self.retry_after_seconds
+                self._entries.pop(key, None)
+                return self._plain_locked(), None
+            entry["model"] = model
+            entry["refresh_at"] = time.monotonic() + max(ttl_seconds - REFRESH_MARGIN_SECONDS, 1)
+            return model, "context" if key else "system"
+
+    def plain(self):
+        """The model with the system instruction sent along with each request."""
+        with self._lock:
+            return self._plain_locked()
+
+    def _plain_locked(self):
+        if self._plain is None:
+            from vertexai.generative_models import GenerativeModel
+
+            self._plain = GenerativeModel(self.model_name, system_instruction=self.system_instruction)
+        return self._plain
+
+    def _evict(self):
+        while len(self._entries) > self.max_sessions:
+            oldest = next(key for key in self._entries if key)
+            del self._entries[oldest]
+
+    def _create(self, stable_context, ttl_seconds):
+        from vertexai.generative_models import GenerativeModel
+
+        try:
+            from vertexai.preview import caching
+
+            cached_content = caching.CachedContent.create(
+                model_name=self.model_name,
+                system_instruction=self.system_instruction,
+                contents=[stable_context] if stable_context else None,
+                ttl=timedelta(seconds=ttl_seconds),
+                display_name="query-gemini-session" if stable_context else "query-gemini-system-instruction",
+            )
+        except Exception as e:
+            self._count("failures")
+            print(f"Context cache unavailable for {self.retry_after_seconds}s, "
+                  f"sending the content with each request: {e}")
+            return None
+        self._count("created")
+        print(f"Created context cache {cached_content.name} for {self.model_name}")
+        return GenerativeModel.from_cached_content(cached_content=cached_content)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "sessions": sum(1 for key in self._entries if key)}
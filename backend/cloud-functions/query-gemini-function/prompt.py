@@ -0,0 +1,199 @@
+"""
+Prompt for query_gemini: a static system instruction (persona, rules and
+examples) that is identical for every request, so it can be cached, and a
+compact per-request part with the data.
+
+Transactions are serialized as a table with one header row instead of JSON
+objects that repeat every key. Timestamps are rounded to the minute, and
+fields the model doesn't need (gcs_uri, user, status, ...) are dropped.
+"""
+import json
+import re
+
+from retrieval import Record
+
+SYSTEM_INSTRUCTION = """\
+# IDENTITY AND PERSONA
+You are Gemini, a world-class personal assistant. Your personality is charming, helpful, and highly efficient. You are warm and friendly but always concise. You address the user by their name when appropriate, but you adapt your greeting based on the conversation history.
+
+# CONTEXT & DATA ANALYSIS
+Every request gives you five pieces of information:
+1.  `current_date`: Today's date and time in GMT.
+2.  `context`: The user's transactional data. This is your single source of truth for user activity. `summary` is a JSON object that aggregates every transaction matching the question (count, total, per category, top merchants, time range). `transactions` is a table with one row per transaction under a header row; columns are separated by `|`, times are GMT and rounded to the minute, and `notes` holds the raw receipt text when the other columns are empty. Use `summary` for totals and counts, since the table may not include every match. When the conversation starts with `all_transactions`, the same kind of table with every transaction the user has, `transactions` refers to that table instead of being repeated.
+3.  `user_data`: Personal details about the user, such as their `name`.
+4.  `chat_history`: A transcript of the recent conversation, possibly starting with a summary of earlier turns. Use this to understand the flow of the conversation, maintain context for follow-up questions, and avoid repetitive greetings. If this is empty, it is the first turn of the conversation.
+5.  `user_query`: The most recent question the user has asked. You must answer this query.
+
+# CORE INSTRUCTIONS
+Your task is to act as the user's personal assistant and answer their `user_query` by analyzing the `context` data and `chat_history`. Follow these steps:
+1.  **Analyze `chat_history` for conversational context.**
+2.  **Greeting Logic:**
+    - If `chat_history` is empty, this is the **first message**. Start with a brief, friendly salutation using the user's name (e.g., "Hi Aadhar!").
+    - If `chat_history` is **not empty**, this is a **follow-up message**. OMIT the full salutation. You may use a very brief acknowledgment (e.g., "Certainly," "Got it.") or proceed directly to the answer.
+3.  Carefully analyze the `user_query`, using the `chat_history` to understand its context.
+4.  Use the `summary` and scan the `transactions` in the `context` data to find the required information.
+5.  Formulate a clear, concise, and accurate answer.
+6.  Present the answer directly to the user.
+
+# RULES & CONSTRAINTS
+- **Salutation is key:** Greet the user by name ONLY on the first turn. In subsequent turns, be more direct. The goal is to feel like a continuous conversation, not a series of new ones.
+- **Maintain Context:** Use the `chat_history` to understand pronouns (e.g., "How much was *it*?") and follow-up requests.
+- **Never make up information.** If the answer cannot be found in the `context` data, state that clearly.
+- **Be Brief:** Avoid long, unnecessary pleasantries. Efficiency is paramount.
+- **Timestamps** are in GMT. Use `current_date` for "today", "last week" and similar. The current location is Bengaluru, India. Use this for any relevant spatial or temporal context.
+
+# FEW-SHOT EXAMPLES (Demonstrating conversational flow)
+
+---
+**EXAMPLE 1 (First Turn)**
+
+[CURRENT_DATE]: Sunday, July 27, 2025, 10:15 GMT
+[CONTEXT]:
+summary: {"count":3,"total_amount":1840.5,"by_category":{"groceries":{"count":2,"total":1240.5},"dining":{"count":1,"total":600.0}}}
+transactions:
+time|category|amount|merchant|location|items|notes
+2025-07-25 23:38|groceries|740.5|DMart|Bengaluru|Rice, Dal|
+2025-07-25 13:02|dining|600|Truffles|Bengaluru|Burger, Coke|
+2025-07-25 09:10|groceries|500|Reliance Fresh|Bengaluru|Milk, Eggs|
+[USER_DATA]: {"name":"Aadhar"}
+[CHAT_HISTORY]:
+[USER_QUERY]: "Based on my data, what was the last action I took?"
+
+[YOUR RESPONSE]:
+Hi Aadhar! Your last action was a 'groceries' transaction on Friday, July 25th, 2025, at 23:38 GMT.
+
+---
+**EXAMPLE 2 (Follow-up Turn)**
+
+[CONTEXT]: (same as above)
+[USER_DATA]: {"name":"Aadhar"}
+[CHAT_HISTORY]: User: Based on my data, what was the last action I took?
+Assistant: Hi Aadhar! Your last action was a 'groceries' transaction on Friday, July 25th, 2025, at 23:38 GMT.
+[USER_QUERY]: "How many transactions did I make on that day?"
+
+[YOUR RESPONSE]:
+So, you made 3 transactions on Friday, July 25th, 2025.
+
+---
+**EXAMPLE 3 (Unrelated Follow-up)**
+
+[CONTEXT]: (same as above)
+[USER_DATA]: {"name":"Aadhar"}
+[CHAT_HISTORY]: User: Based on my data, what was the last action I took?
+Assistant: Hi Aadhar! Your last action was a 'groceries' transaction on Friday, July 25th, 2025, at 23:38 GMT.
+User: How many transactions did I make on that day?
+Assistant: You made 3 transactions on Friday, July 25th, 2025.
+[USER_QUERY]: "Okay, thanks. Now show me my first movie purchase."
+
+[YOUR RESPONSE]:
+Certainly. I couldn't find a movie purchase in your transactions for this period.
+
+---
+
+**END OF EXAMPLES**
+
+Answer the request that follows in the same way.
+"""
+
+COLUMNS = ("time", "category", "amount", "merchant", "location", "items", "notes")
+# Personal details the model has no use for (e.g. the profile picture URL)
+USER_DATA_FIELDS = ("name", "email")
+
+_FENCE_RE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _compact_json(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        value = f"{value:.2f}".rstrip("0").rstrip(".")
+    return _SPACE_RE.sub(" ", str(value)).replace("|", "/").strip()
+
+
+def transaction_row(transaction):
+    record = Record(transaction)
+    has_typed_fields = transaction.get("transaction_type") and transaction.get("transaction_amount") is not None
+    # Receipts without typed fields keep the model text, minus fences and whitespace
+    notes = "" if has_typed_fields else _FENCE_RE.sub("", transaction.get("details") or "")
+    return "|".join(_cell(value) for value in (
+        record.time.strftime("%Y-%m-%d %H:%M") if record.time else transaction.get("transaction_time"),
+        record.category,
+        record.amount,
+        record.merchant,
+        transaction.get("transaction_location"),
+        transaction.get("transaction_items"),
+        notes,
+    ))
+
+
+def serialize_context(context):
+    """
+    Compact text for the transactions context: a get_user_data response
+    ({"data": [...]}), a retrieval selection ({"summary", "transactions"}) or a bare
+    list. Anything else is passed through as compact JSON (or as-is if a string).
+    """
+    if isinstance(context, str):
+        return context
+    summary, transactions = None, None
+    if isinstance(context, list):
+        transactions = context
+    elif isinstance(context, dict) and isinstance(context.get("transactions"), list):
+        summary, transactions = context.get("summary"), context["transactions"]
+    elif isinstance(context, dict) and isinstance(context.get("data"), list):
+        transactions = context["data"]
+    if transactions is None or not all(isinstance(item, dict) for item in transactions):
+        return _compact_json(context)
+
+    lines = []
+    if summary is not None:
+        lines.append(f"summary: {_compact_json(summary)}")
+    lines.append("transactions:")
+    lines.append("|".join(COLUMNS))
+    lines.extend(transaction_row(transaction) for transaction in transactions)
+    return "\n".join(lines)
+
+
+def serialize_user_data(user_data):
+    if isinstance(user_data, dict):
+        user_data = {key: value for key, value in user_data.items() if key in USER_DATA_FIELDS and value}
+    return _compact_json(user_data or {})
+
+
+def all_transactions(context):
+    """
+    Every transaction of a get_user_data response (or a bare list) as an
+    [ALL_TRANSACTIONS] table, the part of a chat session's requests that stays
+    the same from one question to the next. None for any other context.
+    """
+    if isinstance(context, dict) and isinstance(context.get("data"), list):
+        context = context["data"]
+    if not isinstance(context, list) or not context or not all(isinstance(item, dict) for item in context):
+        return None
+    return f"[ALL_TRANSACTIONS]:\n{serialize_context(context)}\n"
+
+
+def build_prompt(context, user_data, chat_history, user_query, now, transactions_cached=False):
+    """
+    The per-request part of the prompt; SYSTEM_INSTRUCTION carries the rest. With
+    `transactions_cached` the table is in the cached all_transactions(), and only
+    the context's summary is sent.
+    """
+    if transactions_cached:
+        summary = context.get("summary") if isinstance(context, dict) else None
+        context_text = f"summary: {_compact_json(summary)}\n" if summary is not None else ""
+        context_text += "transactions: (in [ALL_TRANSACTIONS])"
+    else:
+        context_text = serialize_context(context)
+    return (
+        f"[CURRENT_DATE]: {now.strftime('%A, %B %d, %Y, %H:%M')} GMT\n"
+        f"[CONTEXT]:\n{context_text}\n"
+        f"[USER_DATA]: {serialize_user_data(user_data)}\n"
+        f"[CHAT_HISTORY]:\n{chat_history}\n"
+        f"[USER_QUERY]: {json.dumps(user_query, ensure_ascii=False)}\n\n"
+        f"[YOUR RESPONSE]:\n"
+    )
@@ -0,0 +1,182 @@
+"""
+Cache of query_gemini replies for questions that are asked again over the same data.
+
+The key is made of what determines the reply:
+
+- the question, normalized (case, punctuation, filler words such as "please")
+- a fingerprint of the transactions sent as `context`, independent of their order
+- a digest of the chat turns that go into the prompt verbatim
+- the user's name (for the greeting), the day and the model/prompt version
+
+Because the transactions are part of the key, a new or changed transaction
+gives a different key. Replies over stale data are never served; they just
+age out.
+
+There are two tiers. The in-process tier is LRU with a TTL. The optional
+persistent tier is a Firestore collection shared by all instances, which
+also survives cold starts.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from retrieval import load_transactions
+
+# Words that don't change what is being asked
+FILLER_WORDS = {
+    "please", "pls", "hey", "hi", "hello", "ok", "okay", "so", "now", "just", "kindly", "can", "could",
+    "would", "you", "tell", "me", "show", "give", "let", "know", "the", "a", "an", "um", "thanks", "thank",
+}
+CONTRACTIONS = {"what's": "what is", "whats": "what is", "how's": "how is", "i've": "i have", "didn't": "did not"}
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def normalize_query(query):
+    words = []
+    for word in _WORD_RE.findall(str(query).lower().replace("’", "'")):
+        word = CONTRACTIONS.get(word, word).replace("'", "")
+        words.extend(part for part in word.split() if part not in FILLER_WORDS)
+    return " ".join(words)
+
+
+def _digest(value):
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def context_fingerprint(context):
+    """Digest of the transaction set (order doesn't matter), or of the raw context otherwise."""
+    transactions = load_transactions(context)
+    if transactions is None:
+        return _digest(context)
+    return _digest(sorted(_digest(transaction) for transaction in transactions))
+
+
+def history_digest(recent_turns, has_older):
+    """Digest of the verbatim history window; older turns only count as "there were some"."""
+    return _digest({"recent": recent_turns, "older": bool(has_older)})
+
+
+def make_key(query, context, recent_turns, has_older, user_name, now, version):
+    return _digest({
+        "query": normalize_query(query),
+        "context": context_fingerprint(context),
+        "history": history_digest(recent_turns, has_older),
+        "user": user_name,
+        "day": now.date().isoformat(),
+        "version": version,
+    })
+
+
+class FirestoreReplyStore:
+    """
+    Persistent tier: one document per key with the reply and an `expires_at`.
+    Configure a Firestore TTL policy on `expires_at` to delete expired documents;
+    until then they are ignored on read. `db` is a LazyClient for Firestore.
+    """
+
+    def __init__(self, db, collection, ttl_seconds):
+        self.db = db
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    def _collection(self):
+        db = self.db.get()
+        if db is None:
+            raise RuntimeError("Firestore client is not available")
+        return db.collection(self.collection)
+
+    def get(self, key):
+        snapshot = self._collection().document(key).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict() or {}
+        expires_at = data.get("expires_at")
+        if expires_at is None or expires_at <= datetime.now(timezone.utc):
+            return None
+        return data.get("value")
+
+    def put(self, key, value):
+        self._collection().document(key).set({
+            "value": value,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds),
+        })
+
+
+class ReplyCache:
+    """In-process LRU+TTL tier in front of an optional persistent `store`."""
+
+    def __init__(self, max_entries=256, ttl_seconds=600, store=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "store_hits": 0, "misses": 0, "expired": 0, "stores": 0, "errors": 0}
+
+    def _remember(self, key, value):
+        self._entries[key] = (self.clock() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """(value, tier) where tier is "memory" or "store", or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value, "memory"
+                del self._entries[key]
+                self.counters["expired"] += 1
+
+        value = None
+        if self.store:
+            try:
+                value = self.store.get(key)
+            except Exception as e:
+                print(f"Error reading the reply cache store: {e}")
+                with self._lock:
+                    self.counters["errors"] += 1
+        with self._lock:
+            if value is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["store_hits"] += 1
+            self._remember(key, value)
+        return value, "store"
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            self.counters["stores"] += 1
+        if self.store:
+            try:
+                self.store.put(key, value)
+            except Exception as e:
+                print(f"Error writing the reply cache store: {e}")
+                with self._lock:
+                    self.counters["errors"] += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters["memory_hits"] + self.counters["store_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "lookups": lookups,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "capacity": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self.store is not None,
+            }
@@ -0,0 +1,389 @@
+"""
+Picks the part of the user's transaction history that is relevant to a question.
+
+Instead of pasting every transaction into the prompt, the transactions sent as
+`context` are indexed in memory (BM25 over merchant, category, items and
+details). Time and category hints in the question ("last week", "in July",
+"groceries") narrow them down first. The best matches are then kept until the
+token budget is used up, next to an aggregate summary of everything that matched.
+"""
+import json
+import math
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+CATEGORIES = ("entertainment", "health", "utility", "groceries", "dining", "misc")
+
+# Words in questions that point at one of the categories
+CATEGORY_HINTS = {
+    "grocery": "groceries", "groceries": "groceries", "supermarket": "groceries", "vegetables": "groceries",
+    "dining": "dining", "food": "dining", "restaurant": "dining", "restaurants": "dining", "cafe": "dining",
+    "coffee": "dining", "lunch": "dining", "dinner": "dining", "breakfast": "dining", "eating": "dining",
+    "utility": "utility", "utilities": "utility", "bill": "utility", "bills": "utility",
+    "electricity": "utility", "internet": "utility", "recharge": "utility",
+    "health": "health", "medical": "health", "medicine": "health", "medicines": "health",
+    "pharmacy": "health", "doctor": "health", "hospital": "health",
+    "entertainment": "entertainment", "movie": "entertainment", "movies": "entertainment",
+    "cinema": "entertainment", "concert": "entertainment",
+    "misc": "misc", "miscellaneous": "misc",
+}
+
+MONTHS = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4,
+    "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8,
+    "september": 9, "sep": 9, "sept": 9, "october": 10, "oct": 10, "november": 11, "nov": 11,
+    "december": 12, "dec": 12,
+}
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+STOPWORDS = {
+    "a", "about", "all", "am", "an", "and", "any", "are", "at", "be", "buy", "bought", "by", "can", "could",
+    "day", "days", "did", "do", "does", "for", "from", "get", "had", "has", "have", "how", "i", "in", "is",
+    "it", "last", "list", "many", "me", "money", "month", "much", "my", "of", "on", "or", "past", "show",
+    "spend", "spent", "tell", "that", "the", "this", "to", "total", "transaction", "transactions", "was",
+    "week", "were", "what", "when", "where", "which", "with", "year", "you",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_MONTH_NAMES = "|".join(sorted(MONTHS, key=len, reverse=True))
+_WEEKDAY_NAMES = "|".join(WEEKDAYS)
+_RAW_TYPE_RE = re.compile(r'"transaction_type"\s*:\s*"([^"]+)"')
+_RAW_AMOUNT_RE = re.compile(r'"tra?n?saction_amount"\s*:\s*"?[^\d"-]*(-?[\d,]+(?:\.\d+)?)')
+_RAW_MERCHANT_RE = re.compile(r'"transaction_merchant"\s*:\s*"([^"]+)"')
+
+
+def estimate_tokens(text):
+    """Rough token count for Gemini models (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(str(text or "").lower()) if token not in STOPWORDS]
+
+
+def parse_time(value):
+    """transaction_time as sent by get_user_data (HTTP date, ISO string, epoch ms or datetime)."""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000 if value > 1e11 else value, tz=timezone.utc)
+    if not value:
+        return None
+    text = str(value).strip()
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(text)
+        except (TypeError, ValueError):
+            return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _amount(value):
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return float(str(value).replace(",", ""))
+    except ValueError:
+        return None
+
+
+class Record:
+    """A transaction from the context with the fields retrieval needs."""
+
+    def __init__(self, source):
+        self.source = source
+        details = source.get("details") or ""
+        self.time = parse_time(source.get("transaction_time"))
+        # Documents written before the typed fields existed only have the raw model text
+        category = source.get("transaction_type")
+        if not category:
+            match = _RAW_TYPE_RE.search(details)
+            category = match.group(1) if match else None
+        self.category = str(category).strip().lower() if category else None
+        amount = source.get("transaction_amount")
+        if amount is None:
+            match = _RAW_AMOUNT_RE.search(details)
+            amount = match.group(1) if match else None
+        self.amount = _amount(amount)
+        merchant = source.get("transaction_merchant")
+        if not merchant:
+            match = _RAW_MERCHANT_RE.search(details)
+            merchant = match.group(1) if match else None
+        self.merchant = merchant
+        self.terms = tokenize(" ".join(str(part) for part in (
+            merchant, self.category, source.get("transaction_items"), source.get("transaction_location"),
+            details if not source.get("transaction_items") else "",
+        ) if part))
+
+
+class BM25:
+    def __init__(self, documents, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.frequencies = [Counter(terms) for terms in documents]
+        self.lengths = [len(terms) for terms in documents]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if documents else 0
+        document_frequency = Counter(term for terms in documents for term in set(terms))
+        count = len(documents)
+        self.idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def scores(self, query_terms):
+        results = []
+        for frequencies, length in zip(self.frequencies, self.lengths):
+            score = 0.0
+            for term in query_terms:
+                frequency = frequencies.get(term)
+                if not frequency:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * length / (self.average_length or 1))
+                score += self.idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            results.append(score)
+        return results
+
+
+def _day(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _month_window(year, month):
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + (month == 12), month % 12 + 1, 1, tzinfo=timezone.utc)
+    return start, end
+
+
+def _past_year(month, day, now, year=None):
+    """The date with the given month/day, in `year` or else the latest one not after now."""
+    if year:
+        return int(year)
+    return now.year if (month, day) <= (now.month, now.day) else now.year - 1
+
+
+def time_window(query, now):
+    """(start, end, label) for the time range a question asks about, or None."""
+    match = match_time_window(query, now)
+    return match[:3] if match else None
+
+
+def match_time_window(query, now):
+    """
+    (start, end, label, span) for the time range a question asks about, where
+    span is the (begin, end) of the words in `query.lower()` it was read from;
+    None if the question names no range this function understands.
+    """
+    text = query.lower()
+    today = _day(now)
+
+    match = re.search(r"\btoday\b", text)
+    if match:
+        return today, today + timedelta(days=1), "today", match.span()
+    match = re.search(r"\byesterday\b", text)
+    if match:
+        return today - timedelta(days=1), today, "yesterday", match.span()
+    match = re.search(r"\b(?:last|past|previous)\s+(\d+)\s+days?\b", text)
+    if match:
+        days = int(match.group(1))
+        return now - timedelta(days=days), now, f"last {days} days", match.span()
+    match = re.search(r"\b(?:last|past|previous)\s+(\d+)\s+weeks?\b", text)
+    if match:
+        weeks = int(match.group(1))
+        return now - timedelta(weeks=weeks), now, f"last {weeks} weeks", match.span()
+    week_start = today - timedelta(days=today.weekday())
+    match = re.search(r"\b(?:this|current)\s+week\b", text)
+    if match:
+        return week_start, now, "this week", match.span()
+    match = re.search(r"\b(?:last|previous)\s+week\b", text)
+    if match:
+        return week_start - timedelta(days=7), week_start, "last week", match.span()
+    match = re.search(r"\bpast\s+week\b", text)
+    if match:
+        return now - timedelta(days=7), now, "last 7 days", match.span()
+    month_start, _ = _month_window(now.year, now.month)
+    match = re.search(r"\b(?:this|current)\s+month\b", text)
+    if match:
+        return month_start, now, "this month", match.span()
+    match = re.search(r"\b(?:last|previous)\s+month\b", text)
+    if match:
+        previous = month_start - timedelta(days=1)
+        start, end = _month_window(previous.year, previous.month)
+        return start, end, "last month", match.span()
+    match = re.search(r"\bpast\s+month\b", text)
+    if match:
+        return now - timedelta(days=30), now, "last 30 days", match.span()
+
+    match = re.search(r"\b(\d{4})-(\d{2})-(\d{2})\b", text)
+    if match:
+        start = datetime(int(match.group(1)), int(match.group(2)), int(match.group(3)), tzinfo=timezone.utc)
+        return start, start + timedelta(days=1), start.date().isoformat(), match.span()
+    match = (re.search(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({_MONTH_NAMES})\b(?:,?\s+(\d{{4}}))?", text)
+             or re.search(rf"\b({_MONTH_NAMES})\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(\d{{4}}))?", text))
+    if match:
+        first, second, year = match.groups()
+        day, month = (int(first), MONTHS[second]) if first.isdigit() else (int(second), MONTHS[first])
+        try:
+            start = datetime(_past_year(month, day, now, year), month, day, tzinfo=timezone.utc)
+        except ValueError:
+            start = None
+        if start:
+            return start, start + timedelta(days=1), start.date().isoformat(), match.span()
+    match = re.search(rf"\bsince\s+({_MONTH_NAMES})\b(?:\s+(\d{{4}}))?", text)
+    if match:
+        month = MONTHS[match.group(1)]
+        start, _ = _month_window(_past_year(month, 1, now, match.group(2)), month)
+        return start, now, start.strftime("since %B %Y"), match.span()
+    # "may" is also a verb, so months only count after a preposition or before a year
+    match = (re.search(rf"\b(?:in|during|for|of)\s+({_MONTH_NAMES})\b(?:\s+(\d{{4}}))?", text)
+             or re.search(rf"\b({_MONTH_NAMES})\s+(\d{{4}})\b", text))
+    if match:
+        month = MONTHS[match.group(1)]
+        year = _past_year(month, 1, now, match.group(2))
+        start, end = _month_window(year, month)
+        return start, end, start.strftime("%B %Y"), match.span()
+
+    match = re.search(rf"\b(?:on|last|this)\s+({_WEEKDAY_NAMES})\b", text)
+    if match:
+        days_back = (today.weekday() - WEEKDAYS.index(match.group(1))) % 7
+        start = today - timedelta(days=days_back)
+        return start, start + timedelta(days=1), start.strftime("%A %Y-%m-%d"), match.span()
+    return None
+
+
+def category_hints(query):
+    return sorted({CATEGORY_HINTS[token] for token in _TOKEN_RE.findall(query.lower()) if token in CATEGORY_HINTS})
+
+
+def ranking_hint(query):
+    text = query.lower()
+    if re.search(r"\b(biggest|largest|highest|most expensive|costliest|maximum|max)\b", text):
+        return "amount_desc"
+    if re.search(r"\b(smallest|cheapest|lowest|least expensive|minimum|min)\b", text):
+        return "amount_asc"
+    if re.search(r"\b(first|earliest|oldest)\b", text):
+        return "oldest"
+    if re.search(r"\b(last|latest|recent|newest)\b", text):
+        return "recent"
+    return None
+
+
+def load_transactions(context):
+    """The list of transactions in a get_user_data response (or a bare list), or None."""
+    if isinstance(context, str):
+        try:
+            context = json.loads(context)
+        except ValueError:
+            return None
+    if isinstance(context, dict):
+        context = context.get("data")
+    if not isinstance(context, list) or not all(isinstance(item, dict) for item in context):
+        return None
+    return context
+
+
+def summarize(records):
+    """Compact aggregate over the matching transactions."""
+    by_category = {}
+    merchants = Counter()
+    total = 0.0
+    unparsed = 0
+    for record in records:
+        if record.amount is None:
+            unparsed += 1
+            continue
+        total += record.amount
+        entry = by_category.setdefault(record.category or "misc", {"count": 0, "total": 0.0})
+        entry["count"] += 1
+        entry["total"] = round(entry["total"] + record.amount, 2)
+        if record.merchant:
+            merchants[record.merchant.strip()] += record.amount
+    times = [record.time for record in records if record.time]
+    summary = {
+        "count": len(records),
+        "total_amount": round(total, 2),
+        "by_category": by_category,
+        "top_merchants": [
+            {"merchant": merchant, "total": round(amount, 2)} for merchant, amount in merchants.most_common(3)
+        ],
+    }
+    if times:
+        summary["first"] = min(times).isoformat()
+        summary["last"] = max(times).isoformat()
+    if unparsed:
+        summary["without_amount"] = unparsed
+    return summary
+
+
+def _serialized(source):
+    return json.dumps(source, default=str, ensure_ascii=False)
+
+
+def select_context(context, user_query, now=None, token_budget=2000, serialize=None):
+    """
+    Returns (context for the prompt, stats). The context holds a `summary` of all
+    transactions matching the question's hints and the most relevant
+    `transactions`, as many as fit in `token_budget` when each is rendered with
+    `serialize` (JSON by default). Contexts that aren't a list of transactions
+    are returned unchanged.
+    """
+    serialize = serialize or _serialized
+    transactions = load_transactions(context)
+    if transactions is None:
+        return context, {"retrieval": "skipped"}
+
+    now = now or datetime.now(timezone.utc)
+    records = [Record(transaction) for transaction in transactions]
+    window = time_window(user_query, now)
+    categories = category_hints(user_query)
+
+    candidates = records
+    if window:
+        start, end, _ = window
+        candidates = [record for record in candidates if record.time and start <= record.time < end]
+    if categories:
+        candidates = [record for record in candidates if record.category in categories]
+
+    ranking = ranking_hint(user_query)
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+    if ranking in ("amount_desc", "amount_asc"):
+        present = [record for record in candidates if record.amount is not None]
+        ordered = sorted(present, key=lambda record: record.amount, reverse=ranking == "amount_desc")
+        ordered += [record for record in candidates if record.amount is None]
+    elif ranking == "oldest":
+        ordered = sorted(candidates, key=lambda record: record.time or oldest)
+    else:
+        scores = BM25([record.terms for record in candidates]).scores(tokenize(user_query)) if candidates else []
+        ranked = sorted(zip(scores, candidates), key=lambda pair: (pair[0], pair[1].time or oldest), reverse=True)
+        ordered = [record for _, record in ranked]
+
+    selection = {"summary": summarize(candidates)}
+    if window:
+        selection["summary"]["time_range"] = {
+            "label": window[2], "start": window[0].isoformat(), "end": window[1].isoformat()
+        }
+    if categories:
+        selection["summary"]["categories"] = categories
+    used = estimate_tokens(_serialized(selection))
+
+    chosen = []
+    for record in ordered:
+        cost = estimate_tokens(serialize(record.source))
+        if used + cost > token_budget:
+            break
+        chosen.append(record)
+        used += cost
+    chosen.sort(key=lambda record: record.time or oldest, reverse=True)
+
+    selection["transactions"] = [record.source for record in chosen]
+    selection["summary"]["transactions_included"] = len(chosen)
+    stats = {
+        "transactions": len(records),
+        "matching": len(candidates),
+        "included": len(chosen),
+        "context_tokens": used,
+    }
+    return selection, stats
@@ -0,0 +1,67 @@
+"""
+Streams a reply to the client while the model is still generating it.
+
+Two wire formats are supported, both as one event per model chunk followed by
+a final event:
+
+- "sse" (text/event-stream): `event: chunk` / `event: done` / `event: error`
+  lines, each with a JSON `data:` line.
+- "ndjson" (application/x-ndjson): one JSON object per line with a "type" of
+  "chunk", "done" or "error".
+
+Chunks carry {"text": ...}. The done event carries the same body as the
+non-streaming response ({"reply", "usage"}), so clients can use it as the
+final answer. Errors after the stream has started can't change the status
+code, so they are sent as an error event instead.
+"""
+import json
+
+from flask import Response
+
+CONTENT_TYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+
+def stream_format(request, request_json):
+    """
+    "sse", "ndjson" or None (a plain JSON response), from the request's "stream"
+    field (true, "sse" or "ndjson") or its Accept header.
+    """
+    stream = request_json.get("stream")
+    if stream in CONTENT_TYPES:
+        return stream
+    if stream is True:
+        return "sse"
+    if stream is not None:
+        return None
+    accept = request.headers.get("Accept", "")
+    if CONTENT_TYPES["sse"] in accept:
+        return "sse"
+    if CONTENT_TYPES["ndjson"] in accept:
+        return "ndjson"
+    return None
+
+
+def chunk_text(chunk):
+    # .text raises when a chunk has no text part (e.g. the final chunk with only usage)
+    try:
+        return chunk.text
+    except (ValueError, AttributeError, IndexError):
+        return ""
+
+
+def encode(fmt, event, data):
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"type": event, **data}, ensure_ascii=False) + "\n"
+
+
+def stream_response(events, fmt, headers):
+    """A streamed flask Response for an iterator of (event, data) pairs."""
+    headers = {
+        **headers,
+        "Cache-Control": "no-cache",
+        # Ask proxies in front of the function not to buffer the stream
+        "X-Accel-Buffering": "no",
+    }
+    body = (encode(fmt, event, data) for event, data in events)
+    return Response(body, status=200, headers=headers, mimetype=CONTENT_TYPES[fmt])
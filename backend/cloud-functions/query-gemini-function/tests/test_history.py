@@ -0,0 +1,110 @@
+from history import HistoryManager, format_turns, normalize_turns
+
+
+class Summarizer:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, previous, turns):
+        self.calls.append((previous, turns))
+        if self.fail:
+            raise RuntimeError("503 Service unavailable")
+        return " + ".join(filter(None, [previous, *(text for _, text in turns)]))
+
+
+def chat(count):
+    """`count` turns of about 10 estimated tokens each, alternating speakers."""
+    return [{"role": "user" if index % 2 == 0 else "ai", "content": f"message {index:02d} " + "x" * 20}
+            for index in range(count)]
+
+
+def test_normalize_turns_reads_both_history_shapes():
+    assert normalize_turns([
+        {"User": "hi", "AI": "hello"},
+        {"user": "and you?"},
+        {"role": "assistant", "content": "fine"},
+        {"role": "model", "text": "still fine"},
+        {"role": "system", "content": "ignored"},
+        {"role": "user", "content": ""},
+        "not a turn",
+    ]) == [("User", "hi"), ("Assistant", "hello"), ("User", "and you?"), ("Assistant", "fine"),
+           ("Assistant", "still fine")]
+    assert normalize_turns(None) == []
+    assert format_turns([("User", "hi"), ("Assistant", "hello")]) == "User: hi\nAssistant: hello"
+
+
+def test_short_history_is_kept_verbatim():
+    summarizer = Summarizer()
+    manager = HistoryManager(summarizer, token_budget=600)
+    rendered = manager.render(chat(4))
+    assert rendered.count("\n") == 3 and "Summary" not in rendered
+    assert summarizer.calls == []
+
+
+def test_split_keeps_the_newest_turns_within_the_budget_and_at_least_one():
+    manager = HistoryManager(Summarizer(), token_budget=30)
+    older, recent = manager.split(normalize_turns(chat(10)))
+    assert len(older) + len(recent) == 10
+    assert recent[-1][1].startswith("message 09") and 1 <= len(recent) <= 3
+    _, recent = HistoryManager(Summarizer(), token_budget=1).split(normalize_turns(chat(3)))
+    assert len(recent) == 1
+
+
+def test_older_turns_are_summarized_once_and_then_extended():
+    summarizer = Summarizer()
+    manager = HistoryManager(summarizer, token_budget=30)
+    first = manager.render(chat(10))
+    assert first.startswith("(Summary of the earlier conversation: message 00")
+    assert summarizer.calls[0][0] is None
+
+    # Same window: the summary comes from the cache
+    assert manager.render(chat(10)) == first
+    assert len(summarizer.calls) == 1
+
+    # Two more turns push two more out of the window; only those are summarized
+    manager.render(chat(12))
+    previous, turns = summarizer.calls[1]
+    assert previous is not None and len(turns) == 2
+    assert manager.stats()["summaries_created"] == 1 and manager.stats()["summaries_extended"] == 1
+
+
+def test_a_failed_summary_falls_back_to_the_recent_turns():
+    manager = HistoryManager(Summarizer(fail=True), token_budget=30)
+    rendered = manager.render(chat(10))
+    assert "Summary" not in rendered and "message 09" in rendered
+    assert manager.stats()["errors"] == 1
+
+
+def test_summaries_are_bounded():
+    manager = HistoryManager(Summarizer(), token_budget=10, max_entries=2)
+    for count in range(3, 8):
+        manager.render(chat(count))
+    assert manager.stats()["cached"] == 2
+
+
+def test_a_sliding_window_extends_the_conversation_summary():
+    summarizer = Summarizer()
+    manager = HistoryManager(summarizer, token_budget=30)
+    conversation = chat(44)
+    manager.render(conversation[:40], "asha\0c1", 0)
+
+    # The client keeps sending its last 40 messages; two new ones push two old ones out
+    rendered = manager.render(conversation[2:42], "asha\0c1", 2)
+    previous, turns = summarizer.calls[1]
+    assert previous is not None and len(turns) == 2
+    assert "message 00" in rendered
+    manager.render(conversation[4:44], "asha\0c1", 4)
+    assert len(summarizer.calls[2][1]) == 2
+    stats = manager.stats()
+    assert stats["summaries_created"] == 1 and stats["summaries_extended"] == 2
+
+
+def test_a_conversation_summary_is_not_reused_for_different_turns():
+    summarizer = Summarizer()
+    manager = HistoryManager(summarizer, token_budget=30)
+    manager.render(chat(20), "asha\0c1", 0)
+    other = [{"role": "user", "content": f"other {index:02d} " + "y" * 20} for index in range(20)]
+    manager.render(other, "asha\0c1", 0)
+    assert summarizer.calls[1][0] is None
+    assert manager.stats()["summaries_created"] == 2
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from intents import IntentRouter
+
+NOW = datetime(2025, 8, 10, 12, 0, tzinfo=timezone.utc)
+
+
+def transaction(when, amount, category="groceries", merchant="DMart"):
+    return {
+        "transaction_time": when.isoformat(),
+        "transaction_amount": amount,
+        "transaction_type": category,
+        "transaction_merchant": merchant,
+    }
+
+
+# Only 2025 transactions
+TRANSACTIONS = [
+    transaction(datetime(2025, 8, 8, 18, 30, tzinfo=timezone.utc), 740.50),
+    transaction(datetime(2025, 8, 2, 9, 15, tzinfo=timezone.utc), 600.00, "dining", "Starbucks"),
+    transaction(datetime(2025, 7, 20, 20, 0, tzinfo=timezone.utc), 1200.00, "utility", "BESCOM"),
+    transaction(datetime(2025, 6, 5, 11, 0, tzinfo=timezone.utc), 150.25, "dining", "Cafe Coffee Day"),
+]
+# A complete get_user_data response for everything since March 2025
+CONTEXT = {"data": TRANSACTIONS, "next_cursor": None, "range": {"start": "2025-03-01T00:00:00+00:00", "end": None}}
+
+
+def ask(question, context=CONTEXT):
+    answer = IntentRouter().answer(context, question, now=NOW)
+    return answer[0] if answer else None
+
+
+@pytest.mark.parametrize("question, intent", [
+    ("What was my last transaction?", "latest"),
+    ("what was my biggest expense last month", "largest"),
+    ("how many transactions did I make this week", "count"),
+    ("How much did I spend on groceries in July?", "total"),
+    ("what's my average dining expense this month", "average"),
+    ("how much did I spend on 25th july", "total"),
+    ("how much did I spend since march", "total"),
+])
+def test_classify_answers_the_grammar(question, intent):
+    assert IntentRouter.classify(question, NOW) == intent
+
+
+@pytest.mark.parametrize("question", [
+    # Ranges time_window doesn't read: years, "N months", counts of transactions
+    "how much did I spend in 2024",
+    "how many transactions did I make in the last 3 months",
+    "what was my biggest expense in 2024",
+    "what was my last 5 transactions",
+    "how much did I spend this year",
+    "how much did I spend before march",
+    # Merchants, comparisons and follow-ups
+    "how much did I spend at Starbucks",
+    "was my biggest expense bigger than last month",
+    "what about that one",
+])
+def test_classify_leaves_the_rest_to_the_model(question):
+    assert IntentRouter.classify(question, NOW) is None
+
+
+def test_answers_within_the_covered_range():
+    assert ask("how much did I spend in July") == "You spent 1,200 in July 2025, across 1 transaction."
+    assert ask("how many transactions did I make this month") == "You made 2 transactions this month."
+    assert ask("how much did I spend since june") == "You spent 2,690.75 since June 2025, across 4 transactions."
+    assert ask("what was my last transaction").startswith("Your last transaction was a groceries transaction of 740.50")
+
+
+@pytest.mark.parametrize("question", [
+    "how much did I spend in 2024",
+    "how many transactions did I make in the last 3 months",
+    "what was my biggest expense in 2024",
+    "what was my last 5 transactions",
+])
+def test_reported_wrong_answers_go_to_the_model(question):
+    assert ask(question) is None
+
+
+def test_more_pages_go_to_the_model():
+    context = {**CONTEXT, "next_cursor": "abc"}
+    assert ask("what was my last transaction", context) is None
+    assert ask("how much did I spend in July", context) is None
+
+
+def test_range_beyond_the_fetched_data_goes_to_the_model():
+    last_7_days = {"data": TRANSACTIONS[:1], "next_cursor": None,
+                   "range": {"start": (NOW - timedelta(days=7)).isoformat(), "end": None}}
+    assert ask("how much did I spend last month", last_7_days) is None
+    assert ask("how much did I spend on groceries", last_7_days) is None
+    assert ask("how much did I spend today", last_7_days) == "I couldn't find any transactions today."
+    assert ask("what was my last transaction", last_7_days) is not None
+
+
+def test_custom_range_that_ends_in_the_past():
+    july = {"data": TRANSACTIONS[2:3], "next_cursor": None,
+            "range": {"start": "2025-07-01T00:00:00+00:00", "end": "2025-08-01T00:00:00+00:00"}}
+    assert ask("how much did I spend in July", july) == "You spent 1,200 in July 2025, across 1 transaction."
+    assert ask("what was my last transaction", july) is None
+
+
+def test_bare_list_covers_from_its_earliest_transaction():
+    assert ask("how much did I spend in July", TRANSACTIONS) == "You spent 1,200 in July 2025, across 1 transaction."
+    # Older transactions may exist
+    assert ask("how much did I spend in May", TRANSACTIONS) is None
+    assert ask("what was my first transaction", TRANSACTIONS) is None
+    assert ask("how much did I spend on dining", TRANSACTIONS) is None
+
+
+def test_all_time_answers_need_an_open_range():
+    everything = {"data": TRANSACTIONS, "next_cursor": None, "range": {"start": None, "end": None}}
+    assert ask("how much did I spend on dining", everything) == "You spent 750.25 on dining, across 2 transactions."
+    assert ask("what was my first transaction", everything).startswith("Your first transaction was a dining transaction")
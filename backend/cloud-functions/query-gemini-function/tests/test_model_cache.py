@@ -0,0 +1,111 @@
+import sys
+import types
+from datetime import datetime, timezone
+
+import pytest
+
+from model_cache import CachedSystemModel
+from prompt import SYSTEM_INSTRUCTION, all_transactions, build_prompt
+
+
+class FakeModel:
+    def __init__(self, name=None, system_instruction=None, cached_content=None):
+        self.name = name
+        self.system_instruction = system_instruction
+        self.cached_content = cached_content
+
+    @classmethod
+    def from_cached_content(cls, cached_content):
+        return cls(cached_content=cached_content)
+
+
+class FakeCachedContent:
+    calls = []
+    fail = False
+
+    @classmethod
+    def create(cls, **kwargs):
+        cls.calls.append(kwargs)
+        if cls.fail:
+            raise RuntimeError("400 Cached content is too small")
+        return types.SimpleNamespace(name=f"cachedContents/{len(cls.calls)}", **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def vertexai(monkeypatch):
+    FakeCachedContent.calls, FakeCachedContent.fail = [], False
+    generative_models = types.ModuleType("vertexai.generative_models")
+    generative_models.GenerativeModel = FakeModel
+    caching = types.ModuleType("vertexai.preview.caching")
+    caching.CachedContent = FakeCachedContent
+    monkeypatch.setitem(sys.modules, "vertexai", types.ModuleType("vertexai"))
+    monkeypatch.setitem(sys.modules, "vertexai.generative_models", generative_models)
+    monkeypatch.setitem(sys.modules, "vertexai.preview", types.ModuleType("vertexai.preview"))
+    monkeypatch.setitem(sys.modules, "vertexai.preview.caching", caching)
+
+
+def table(rows):
+    return all_transactions({"data": [
+        {"transaction_time": f"2025-08-{index % 28 + 1:02d}T10:00:00+00:00", "transaction_amount": 100 + index,
+         "transaction_type": "groceries", "transaction_merchant": f"Merchant {index}"}
+        for index in range(rows)
+    ]})
+
+
+def test_a_system_instruction_below_the_minimum_is_never_sent_to_the_cache():
+    models = CachedSystemModel("gemini", SYSTEM_INSTRUCTION, min_tokens=2048)
+    for _ in range(3):
+        model, cached = models.get()
+        assert cached is None and model.system_instruction == SYSTEM_INSTRUCTION
+    assert FakeCachedContent.calls == []
+
+
+def test_a_session_table_is_cached_with_the_instruction_the_second_time_it_is_seen():
+    models = CachedSystemModel("gemini", SYSTEM_INSTRUCTION, min_tokens=2048, max_tokens=8000)
+    stable = table(150)
+    assert models.get(stable)[1] is None
+    model, cached = models.get(stable)
+    assert cached == "context"
+    assert FakeCachedContent.calls[0]["system_instruction"] == SYSTEM_INSTRUCTION
+    assert FakeCachedContent.calls[0]["contents"] == [stable]
+    assert models.get(stable) == (model, "context")
+    assert len(FakeCachedContent.calls) == 1
+
+
+def test_tables_outside_the_cacheable_size_are_not_cached():
+    models = CachedSystemModel("gemini", SYSTEM_INSTRUCTION, min_tokens=2048, max_tokens=8000)
+    for stable in (table(2), table(2), table(1000), table(1000)):
+        assert models.get(stable)[1] is None
+    assert FakeCachedContent.calls == []
+    assert models.stats()["too_small"] == 2 and models.stats()["too_large"] == 2
+
+
+def test_a_failed_create_is_remembered():
+    FakeCachedContent.fail = True
+    models = CachedSystemModel("gemini", SYSTEM_INSTRUCTION, min_tokens=2048, retry_after_seconds=3600)
+    for stable in (table(150), table(150), table(150), table(200), table(200)):
+        assert models.get(stable)[1] is None
+    assert len(FakeCachedContent.calls) == 1
+    assert models.stats()["failures"] == 1
+
+
+def test_a_disabled_cache_creates_nothing():
+    models = CachedSystemModel("gemini", SYSTEM_INSTRUCTION, use_context_cache=False)
+    stable = table(150)
+    assert models.get(stable)[1] is None and models.get(stable)[1] is None
+    assert FakeCachedContent.calls == []
+
+
+def test_requests_on_a_cached_table_send_only_the_summary():
+    context = {"summary": {"count": 2, "total_amount": 201.0}, "transactions": [{"transaction_amount": 100}]}
+    prompt = build_prompt(context, {"name": "Asha"}, "", "How much?", datetime(2025, 8, 10, tzinfo=timezone.utc),
+                          transactions_cached=True)
+    assert 'summary: {"count":2,"total_amount":201.0}' in prompt
+    assert "transactions: (in [ALL_TRANSACTIONS])" in prompt
+    assert "time|category" not in prompt
+
+
+def test_only_transaction_lists_have_a_stable_table():
+    assert all_transactions("free text") is None
+    assert all_transactions({"data": []}) is None
+    assert table(1).startswith("[ALL_TRANSACTIONS]:\ntransactions:\ntime|category|amount")
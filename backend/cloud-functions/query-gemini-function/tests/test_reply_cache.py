@@ -0,0 +1,113 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from reply_cache import ReplyCache, context_fingerprint, make_key, normalize_query
+
+NOW = datetime(2025, 8, 10, 12, 0, tzinfo=timezone.utc)
+TRANSACTIONS = [
+    {"id": "a", "transaction_amount": 740.5, "transaction_type": "groceries"},
+    {"id": "b", "transaction_amount": 600.0, "transaction_type": "dining"},
+]
+CONTEXT = {"data": TRANSACTIONS, "next_cursor": None}
+RECENT = [("User", "hi"), ("Assistant", "Hello Asha!")]
+
+
+def key(**changes):
+    arguments = {"query": "How much did I spend on groceries?", "context": CONTEXT, "recent_turns": RECENT,
+                 "has_older": False, "user_name": "Asha", "now": NOW, "version": "v1", **changes}
+    return make_key(**arguments)
+
+
+@pytest.mark.parametrize("question", [
+    "how much did I spend on groceries",
+    "Hey, how much did I spend on groceries??",
+    "Can you tell me how much did I spend on groceries, please?",
+])
+def test_rephrasings_share_a_normalized_query(question):
+    assert normalize_query(question) == "how much did i spend on groceries"
+
+
+def test_contractions_and_curly_quotes_are_normalized():
+    assert normalize_query("What’s my total?") == normalize_query("what is my total") == "what is my total"
+
+
+def test_fingerprint_ignores_transaction_order_and_the_response_envelope():
+    fingerprint = context_fingerprint(CONTEXT)
+    assert fingerprint == context_fingerprint(list(reversed(TRANSACTIONS)))
+    assert fingerprint != context_fingerprint([*TRANSACTIONS, {"id": "c", "transaction_amount": 1.0}])
+    assert fingerprint != context_fingerprint([{**TRANSACTIONS[0], "transaction_amount": 741.0}, TRANSACTIONS[1]])
+    assert context_fingerprint("free text") != context_fingerprint("other text")
+
+
+def test_key_is_stable_for_the_same_question_over_the_same_data():
+    assert key() == key(query="  how much did I spend on groceries ")
+    assert key() == key(context={"data": list(reversed(TRANSACTIONS))})
+    assert key() == key(now=datetime(2025, 8, 10, 23, 59, tzinfo=timezone.utc))
+
+
+@pytest.mark.parametrize("change", [
+    {"query": "How much did I spend on dining?"},
+    {"context": {"data": TRANSACTIONS[:1]}},
+    {"recent_turns": RECENT[:1]},
+    {"has_older": True},
+    {"user_name": "Ravi"},
+    {"now": datetime(2025, 8, 11, 0, 0, tzinfo=timezone.utc)},
+    {"version": "v2"},
+])
+def test_key_changes_with_anything_that_changes_the_reply(change):
+    assert key(**change) != key()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Store:
+    def __init__(self, fail=False):
+        self.values = {}
+        self.fail = fail
+
+    def get(self, key):
+        if self.fail:
+            raise RuntimeError("Firestore unavailable")
+        return self.values.get(key)
+
+    def put(self, key, value):
+        if self.fail:
+            raise RuntimeError("Firestore unavailable")
+        self.values[key] = value
+
+
+def test_memory_entries_expire_and_fall_back_to_the_store():
+    clock, store = Clock(), Store()
+    cache = ReplyCache(ttl_seconds=600, store=store, clock=clock)
+    cache.put("k", "You spent 740.5 on groceries.")
+    assert cache.get("k") == ("You spent 740.5 on groceries.", "memory")
+    clock.now += 600
+    assert cache.get("k") == ("You spent 740.5 on groceries.", "store")
+    assert cache.get("k")[1] == "memory"
+    assert cache.get("other") is None
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["store_hits"], stats["misses"], stats["expired"]) == (2, 1, 1, 1)
+
+
+def test_store_errors_are_counted_not_raised():
+    cache = ReplyCache(store=Store(fail=True), clock=Clock())
+    cache.put("k", "reply")
+    assert cache.get("k") == ("reply", "memory")
+    assert cache.get("missing") is None
+    assert cache.stats()["errors"] == 2
+
+
+def test_least_recently_used_replies_are_evicted():
+    cache = ReplyCache(max_entries=2, clock=Clock())
+    cache.put("a", "A")
+    cache.put("b", "B")
+    cache.get("a")
+    cache.put("c", "C")
+    assert cache.get("b") is None and cache.get("a") == ("A", "memory")
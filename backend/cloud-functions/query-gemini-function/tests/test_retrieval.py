@@ -0,0 +1,120 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from retrieval import Record, category_hints, parse_time, ranking_hint, select_context, time_window
+
+# A Sunday
+NOW = datetime(2025, 8, 10, 12, 0, tzinfo=timezone.utc)
+
+
+def at(year, month, day, hour=0, minute=0):
+    return datetime(year, month, day, hour, minute, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("question, start, end, label", [
+    ("what did I spend today", at(2025, 8, 10), at(2025, 8, 11), "today"),
+    ("and yesterday?", at(2025, 8, 9), at(2025, 8, 10), "yesterday"),
+    ("spend in the last 3 days", at(2025, 8, 7, 12), NOW, "last 3 days"),
+    ("past 2 weeks", at(2025, 7, 27, 12), NOW, "last 2 weeks"),
+    ("dining this week", at(2025, 8, 4), NOW, "this week"),
+    ("groceries last week", at(2025, 7, 28), at(2025, 8, 4), "last week"),
+    ("the past week", at(2025, 8, 3, 12), NOW, "last 7 days"),
+    ("bills this month", at(2025, 8, 1), NOW, "this month"),
+    ("bills last month", at(2025, 7, 1), at(2025, 8, 1), "last month"),
+    ("spend in July", at(2025, 7, 1), at(2025, 8, 1), "July 2025"),
+    ("spend in december", at(2024, 12, 1), at(2025, 1, 1), "December 2024"),
+    ("december 2023 spend", at(2023, 12, 1), at(2024, 1, 1), "December 2023"),
+    ("what did I buy on 5th august", at(2025, 8, 5), at(2025, 8, 6), "2025-08-05"),
+    ("what did I buy on aug 15", at(2024, 8, 15), at(2024, 8, 16), "2024-08-15"),
+    ("receipts from 2025-03-04", at(2025, 3, 4), at(2025, 3, 5), "2025-03-04"),
+    ("everything since may", at(2025, 5, 1), NOW, "since May 2025"),
+    ("what did I buy on friday", at(2025, 8, 8), at(2025, 8, 9), "Friday 2025-08-08"),
+])
+def test_time_window(question, start, end, label):
+    assert time_window(question, NOW) == (start, end, label)
+
+
+@pytest.mark.parametrize("question", [
+    "may I see my biggest expense",
+    "what did I buy on feb 30",
+    "how much did I spend at Starbucks",
+])
+def test_questions_without_a_range(question):
+    assert time_window(question, NOW) is None
+
+
+def test_year_boundaries():
+    new_year = at(2026, 1, 2, 9)
+    assert time_window("last month", new_year)[:2] == (at(2025, 12, 1), at(2026, 1, 1))
+    assert time_window("last week", new_year)[:2] == (at(2025, 12, 22), at(2025, 12, 29))
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("Fri, 08 Aug 2025 18:30:00 GMT", at(2025, 8, 8, 18, 30)),
+    ("2025-08-08T18:30:00Z", at(2025, 8, 8, 18, 30)),
+    ("2025-08-08T18:30:00", at(2025, 8, 8, 18, 30)),
+    (1754677800000, at(2025, 8, 8, 18, 30)),
+    ("yesterday-ish", None),
+    (None, None),
+])
+def test_parse_time(value, expected):
+    assert parse_time(value) == expected
+
+
+def test_hints():
+    assert category_hints("coffee and medicines last week") == ["dining", "health"]
+    assert ranking_hint("what was my biggest expense") == "amount_desc"
+    assert ranking_hint("my first movie") == "oldest"
+    assert ranking_hint("how much on groceries") is None
+
+
+def test_record_falls_back_to_the_raw_model_text():
+    record = Record({
+        "transaction_time": "2025-08-08T10:00:00Z",
+        "details": '```json\n{"details": {"transaction_type": "Dining", "trasaction_amount": "1,250.50", '
+                   '"transaction_merchant": "Truffles"}}\n```',
+    })
+    assert (record.category, record.amount, record.merchant) == ("dining", 1250.5, "Truffles")
+
+
+def transaction(when, amount, category, merchant):
+    return {"transaction_time": when.isoformat(), "transaction_amount": amount,
+            "transaction_type": category, "transaction_merchant": merchant}
+
+
+CONTEXT = {"data": [
+    transaction(at(2025, 8, 8, 18), 740.5, "groceries", "DMart"),
+    transaction(at(2025, 8, 2, 9), 600.0, "dining", "Starbucks"),
+    transaction(at(2025, 7, 28, 9), 250.0, "dining", "Starbucks"),
+    transaction(at(2025, 7, 20, 20), 1200.0, "utility", "BESCOM"),
+    transaction(at(2025, 6, 5, 11), 150.25, "dining", "Cafe Coffee Day"),
+]}
+
+
+def test_select_context_filters_by_window_and_category():
+    selection, stats = select_context(CONTEXT, "How much did I spend on coffee in July?", now=NOW)
+    summary = selection["summary"]
+    assert (summary["count"], summary["total_amount"]) == (1, 250.0)
+    assert summary["time_range"]["label"] == "July 2025" and summary["categories"] == ["dining"]
+    assert [item["transaction_merchant"] for item in selection["transactions"]] == ["Starbucks"]
+    assert stats["transactions"] == 5 and stats["matching"] == 1
+
+
+def test_select_context_keeps_the_summary_of_every_match_within_the_budget():
+    selection, stats = select_context(CONTEXT, "list my spending", now=NOW, token_budget=200)
+    assert selection["summary"]["count"] == 5
+    assert selection["summary"]["total_amount"] == 2940.75
+    assert 0 < stats["included"] < 5
+    assert selection["summary"]["transactions_included"] == stats["included"]
+    assert stats["context_tokens"] <= 200
+
+
+def test_select_context_keeps_the_biggest_amounts_for_biggest():
+    selection, _ = select_context(CONTEXT, "biggest expense", now=NOW, token_budget=200)
+    # Newest first once chosen
+    assert [item["transaction_merchant"] for item in selection["transactions"]] == ["DMart", "BESCOM"]
+
+
+def test_select_context_passes_other_contexts_through():
+    assert select_context("free text", "anything", now=NOW) == ("free text", {"retrieval": "skipped"})
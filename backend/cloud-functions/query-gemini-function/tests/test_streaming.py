@@ -0,0 +1,114 @@
+import json
+
+import pytest
+from flask import Request
+from werkzeug.test import EnvironBuilder
+
+from streaming import chunk_text, encode, stream_format, stream_response
+
+
+def request(accept=None):
+    return Request(EnvironBuilder(method="POST", headers={"Accept": accept} if accept else {}).get_environ())
+
+
+@pytest.mark.parametrize("stream, accept, expected", [
+    ("sse", None, "sse"),
+    ("ndjson", "text/event-stream", "ndjson"),
+    (True, None, "sse"),
+    (False, "text/event-stream", None),
+    ("xml", None, None),
+    (None, "text/event-stream", "sse"),
+    (None, "application/x-ndjson, application/json", "ndjson"),
+    (None, "application/json", None),
+    (None, None, None),
+])
+def test_stream_format(stream, accept, expected):
+    body = {} if stream is None else {"stream": stream}
+    assert stream_format(request(accept), body) == expected
+
+
+class Chunk:
+    def __init__(self, text=None, error=None):
+        self._text = text
+        self._error = error
+
+    @property
+    def text(self):
+        if self._error:
+            raise self._error
+        return self._text
+
+
+def test_chunks_without_text_are_empty():
+    assert chunk_text(Chunk("Hello")) == "Hello"
+    assert chunk_text(Chunk(error=ValueError("no text part"))) == ""
+    assert chunk_text(Chunk(error=IndexError())) == ""
+    assert chunk_text(object()) == ""
+
+
+def test_encode():
+    assert encode("sse", "chunk", {"text": "₹600"}) == 'event: chunk\ndata: {"text": "₹600"}\n\n'
+    assert encode("ndjson", "done", {"reply": "hi"}) == '{"type": "done", "reply": "hi"}\n'
+
+
+@pytest.mark.parametrize("fmt, content_type", [("sse", "text/event-stream"), ("ndjson", "application/x-ndjson")])
+def test_stream_response(fmt, content_type):
+    events = iter([("chunk", {"text": "You spent "}), ("chunk", {"text": "600."}), ("done", {"reply": "You spent 600."})])
+    response = stream_response(events, fmt, {"Access-Control-Allow-Origin": "*"})
+    assert response.is_streamed and response.mimetype == content_type
+    assert response.headers["Cache-Control"] == "no-cache" and response.headers["X-Accel-Buffering"] == "no"
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    body = b"".join(response.iter_encoded()).decode()
+    if fmt == "ndjson":
+        lines = [json.loads(line) for line in body.splitlines()]
+        assert [line["type"] for line in lines] == ["chunk", "chunk", "done"]
+    else:
+        assert body.count("event: chunk\n") == 2 and body.endswith('event: done\ndata: {"reply": "You spent 600."}\n\n')
+
+
+class Usage:
+    prompt_token_count = 120
+    cached_content_token_count = 0
+    candidates_token_count = 8
+
+
+class StreamingModel:
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def generate_content(self, prompt, stream=False):
+        assert stream
+        for chunk in self.chunks:
+            yield chunk
+        if self.error:
+            raise self.error
+
+
+@pytest.fixture
+def main():
+    pytest.importorskip("functions_framework")
+    pytest.importorskip("vertexai")
+    import main
+
+    return main
+
+
+def test_generate_events_streams_chunks_then_the_whole_reply(main):
+    last = Chunk(error=ValueError("no text part"))
+    last.usage_metadata = Usage()
+    replies = []
+    events = list(main.generate_events(StreamingModel([Chunk("You spent "), Chunk("600."), last]), "prompt",
+                                       on_done=replies.append))
+    assert events[:2] == [("chunk", {"text": "You spent "}), ("chunk", {"text": "600."})]
+    event, body = events[2]
+    assert event == "done" and body["reply"] == "You spent 600."
+    assert body["usage"] == {"prompt_tokens": 120, "cached_tokens": 0, "output_tokens": 8}
+    assert replies == ["You spent 600."]
+
+
+def test_generate_events_ends_with_an_error_event_when_the_model_fails(main):
+    replies = []
+    events = list(main.generate_events(StreamingModel([Chunk("You spent ")], error=RuntimeError("503")), "prompt",
+                                       on_done=replies.append))
+    assert [event for event, _ in events] == ["chunk", "error"] and replies == []
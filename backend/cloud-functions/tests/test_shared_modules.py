@@ -0,0 +1,23 @@
+"""
+Each function is deployed from its own directory, so helpers used by several of
+them are copied into each one. The copies must stay identical: edit one, then
+copy it over the others.
+"""
+import filecmp
+import os
+
+import pytest
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARED_MODULES = {
+    "clients.py": ["transaction-process-function", "get-user-data-function", "query-gemini-function"],
+    "tracing.py": ["transaction-process-function", "get-user-data-function", "query-gemini-function"],
+    "singleflight.py": ["get-user-data-function", "query-gemini-function"],
+}
+
+
+@pytest.mark.parametrize("module", sorted(SHARED_MODULES))
+def test_copies_of_shared_modules_are_identical(module):
+    first, *others = [os.path.join(FUNCTIONS_DIR, function, module) for function in SHARED_MODULES[module]]
+    differing = [path for path in others if not filecmp.cmp(first, path, shallow=False)]
+    assert not differing, f"{module} differs from {first} in: {', '.join(differing)}"
@@ -0,0 +1,140 @@
+"""
+Backfills the typed transaction fields (see receipts.py) on existing documents
+that only have the raw `details` text.
+
+Pages through the collection in document-id order with query cursors, parses
+each page on a worker pool and writes the fields back with a BulkWriter.
+Progress is checkpointed to a JSON file after every page, so an interrupted
+run picks up where it stopped. Documents that already have `parse_status` are
+skipped unless --force is given.
+
+    python backfill.py --emulator localhost:8080
+    python backfill.py --page-size 500 --workers 8 --checkpoint backfill.json
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from receipts import parse_details
+
+PROJECT_ID = "graceful-byway-467117-r0"
+DATABASE = "receipt-management"
+
+
+def load_checkpoint(path, collection):
+    if not path or not os.path.exists(path):
+        return {"collection": collection, "last_document_id": None, "scanned": 0, "updated": 0}
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("collection") != collection:
+        raise SystemExit(f"Checkpoint {path} belongs to collection '{checkpoint.get('collection')}', "
+                         f"not '{collection}'. Use --restart to discard it.")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def backfill(collection_ref, cursor, checkpoint, pool, writer, page_size, workers, force=False, limit=None, save=None):
+    """
+    Parses and writes pages after `cursor` (a snapshot, or None to start at the
+    beginning) until the collection or `limit` runs out. `writer` is a BulkWriter,
+    or None for a dry run. `checkpoint` is updated after every page and saved to
+    `save` when given. Returns the number of documents scanned.
+    """
+    run_started = time.perf_counter()
+    run_scanned = 0
+    while True:
+        query = collection_ref.order_by("__name__").select(["details", "parse_status"]).limit(page_size)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        page = list(query.stream())
+        if not page:
+            break
+
+        pending = [doc for doc in page if force or not (doc.to_dict() or {}).get("parse_status")]
+        texts = [(doc.to_dict() or {}).get("details") or "" for doc in pending]
+        chunksize = max(1, len(texts) // (workers * 4))
+        for doc, fields in zip(pending, pool.map(parse_details, texts, chunksize=chunksize)):
+            if writer:
+                writer.update(doc.reference, fields)
+        if writer:
+            # Make the page durable before moving the checkpoint past it
+            writer.flush()
+
+        cursor = page[-1]
+        run_scanned += len(page)
+        checkpoint["scanned"] += len(page)
+        checkpoint["updated"] += len(pending)
+        checkpoint["last_document_id"] = cursor.id
+        elapsed = time.perf_counter() - run_started
+        print(f"{checkpoint['scanned']} scanned, {checkpoint['updated']} updated, "
+              f"{run_scanned / elapsed:.0f} docs/sec")
+        save_checkpoint(save, checkpoint)
+
+        if len(page) < page_size or (limit and run_scanned >= limit):
+            break
+    return run_scanned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="sample_transactions")
+    parser.add_argument("--project", default=PROJECT_ID)
+    parser.add_argument("--database", default=DATABASE)
+    parser.add_argument("--emulator", help="host:port of a Firestore emulator")
+    parser.add_argument("--page-size", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--checkpoint", default="backfill.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--force", action="store_true", help="re-parse documents that already have typed fields")
+    parser.add_argument("--dry-run", action="store_true", help="parse but don't write")
+    parser.add_argument("--limit", type=int, help="stop after scanning this many documents")
+    args = parser.parse_args()
+
+    if args.emulator:
+        os.environ["FIRESTORE_EMULATOR_HOST"] = args.emulator
+    from google.cloud import firestore
+
+    db = firestore.Client(project=args.project, database=args.database)
+    collection_ref = db.collection(args.collection)
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    checkpoint = load_checkpoint(args.checkpoint, args.collection)
+    if checkpoint["last_document_id"]:
+        print(f"Resuming after {checkpoint['last_document_id']} "
+              f"({checkpoint['scanned']} scanned, {checkpoint['updated']} updated so far)")
+
+    cursor = None
+    if checkpoint["last_document_id"]:
+        cursor = collection_ref.document(checkpoint["last_document_id"]).get()
+        if not cursor.exists:
+            raise SystemExit(f"Checkpoint document {checkpoint['last_document_id']} no longer exists; use --restart.")
+
+    writer = None if args.dry_run else db.bulk_writer()
+    run_started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        run_scanned = backfill(
+            collection_ref, cursor, checkpoint, pool, writer, args.page_size, args.workers,
+            force=args.force, limit=args.limit, save=None if args.dry_run else args.checkpoint,
+        )
+
+    if writer:
+        writer.close()
+
+    elapsed = time.perf_counter() - run_started
+    print(f"Done: {run_scanned} documents scanned in {elapsed:.1f}s "
+          f"({run_scanned / elapsed if elapsed else 0:.0f} docs/sec), {checkpoint['updated']} updated in total")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Clients that are created on first use and then shared across invocations.
+
+Building the Google Cloud and Vertex AI clients at import time made every cold
+start load those libraries and open their connections, even when the first
+request was a CORS preflight or failed validation. A LazyClient holds a factory
+instead, and the heavy imports live inside the factory. The client is built
+the first time a request actually needs it and is kept for the life of the
+instance, as the module-level clients were.
+"""
+import threading
+import time
+
+
+class LazyClient:
+    """
+    `factory()` builds the client. Concurrent first callers wait for a single
+    build and all get the same client. If the factory raises, the error is
+    logged and get() returns None, as the old eager initialization did. The
+    build is retried on the first call after `retry_seconds`.
+    """
+
+    def __init__(self, name, factory, retry_seconds=30.0, clock=time.monotonic):
+        self.name = name
+        self.factory = factory
+        self.retry_seconds = retry_seconds
+        self.clock = clock
+        self._client = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None and (
+                self._failed_at is None or self.clock() - self._failed_at >= self.retry_seconds
+            ):
+                started = time.perf_counter()
+                try:
+                    self._client = self.factory()
+                    self._failed_at = None
+                    print(f"Initialized {self.name} in {(time.perf_counter() - started) * 1000:.0f} ms")
+                except Exception as e:
+                    self._failed_at = self.clock()
+                    print(f"Error initializing {self.name}: {e}")
+            return self._client
+
+    @property
+    def initialized(self):
+        return self._client is not None
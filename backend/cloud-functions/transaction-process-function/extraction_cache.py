@@ -0,0 +1,107 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of receipt extractions.
+
+    Entries are keyed on a SHA-256 of the uploaded bytes, the user, and the
+    prompt/model version, so a re-upload of the same photo maps back to the
+    transaction document that was written the first time. Lookups go to an
+    in-process LRU first and then to a Firestore collection that survives
+    instance restarts and is shared by all instances.
+
+    `db` is a LazyClient for Firestore (or None to keep only the LRU); the
+    client is only created when a lookup misses the LRU.
+    """
+
+    def __init__(self, db, collection_name, max_entries=256):
+        self.db = db
+        self.collection_name = collection_name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"lru_hits": 0, "firestore_hits": 0, "misses": 0, "errors": 0}
+
+    @staticmethod
+    def make_key(upload, user, version):
+        """`upload` is the uploaded bytes or a seekable file object, read in chunks and rewound."""
+        digest = hashlib.sha256()
+        digest.update(version.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(user.encode("utf-8"))
+        digest.update(b"\0")
+        if isinstance(upload, (bytes, bytearray)):
+            digest.update(upload)
+        else:
+            upload.seek(0)
+            for chunk in iter(lambda: upload.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+            upload.seek(0)
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters["lru_hits"] += 1
+                return entry
+
+        entry = None
+        if self.db is not None:
+            try:
+                snapshot = self._collection().document(key).get()
+                if snapshot.exists:
+                    entry = snapshot.to_dict()
+            except Exception as e:
+                print(f"Error reading extraction cache entry {key}: {e}")
+                with self._lock:
+                    self.counters["errors"] += 1
+
+        with self._lock:
+            if entry is None:
+                self.counters["misses"] += 1
+            else:
+                self.counters["firestore_hits"] += 1
+                self._remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._remember(key, entry)
+        if self.db is not None:
+            try:
+                self._collection().document(key).set(entry)
+            except Exception as e:
+                print(f"Error writing extraction cache entry {key}: {e}")
+                with self._lock:
+                    self.counters["errors"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["lru_hits"] + self.counters["firestore_hits"] + self.counters["misses"]
+            hits = lookups - self.counters["misses"]
+            return {
+                **self.counters,
+                "lookups": lookups,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "lru_size": len(self._entries),
+                "lru_capacity": self.max_entries,
+            }
+
+    def _collection(self):
+        db = self.db.get()
+        if db is None:
+            raise RuntimeError("Firestore client is not available")
+        return db.collection(self.collection_name)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,66 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    """Raised when the queue cannot accept another extraction job right now."""
+
+
+class InProcessQueue:
+    """
+    Runs extraction jobs on a bounded thread pool inside this instance.
+
+    For local development only, and opt-in (EXTRACTION_QUEUE=inprocess): on a
+    Cloud Function the CPU is throttled once the 202 has been returned, so jobs
+    stall until the next request arrives and are lost with the instance.
+    """
+
+    def __init__(self, handler, workers=4, max_pending=32):
+        self.handler = handler
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extraction")
+        # Jobs running or waiting for a worker; beyond this we push back on the client
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, job):
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull("Too many extraction jobs pending")
+        self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            self.handler(job)
+        except Exception as e:
+            print(f"Extraction job for {job.get('document_id')} failed: {e}")
+        finally:
+            self._slots.release()
+
+
+class PubSubQueue:
+    """
+    Publishes extraction jobs to a Pub/Sub topic. The `process_extraction_job`
+    entry point subscribed to the topic runs them, so extraction scales out
+    independently of the upload endpoint.
+    """
+
+    def __init__(self, project_id, topic):
+        from google.cloud import pubsub_v1
+
+        self.publisher = pubsub_v1.PublisherClient()
+        self.topic_path = self.publisher.topic_path(project_id, topic)
+
+    def submit(self, job):
+        # Jobs must survive the trip through Pub/Sub, so only plain JSON goes in
+        payload = {key: value for key, value in job.items() if key != "file_bytes"}
+        self.publisher.publish(self.topic_path, json.dumps(payload).encode("utf-8")).result()
+
+
+def create_queue(backend, handler, project_id=None, topic=None, workers=4, max_pending=32):
+    """Builds the queue named by `backend` ("inprocess" or "pubsub")."""
+    if backend == "inprocess":
+        return InProcessQueue(handler, workers=workers, max_pending=max_pending)
+    if backend == "pubsub":
+        if not project_id or not topic:
+            raise ValueError("The pubsub extraction queue needs a project id and a topic.")
+        return PubSubQueue(project_id, topic)
+    raise ValueError(f"Unknown extraction queue backend '{backend}'.")
@@ -1,16 +1,44 @@
 import functions_framework
 from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-from google.cloud import storage
 import os
-from google.cloud import firestore
 from datetime import datetime,timezone
-import vertexai
-from vertexai.generative_models import GenerativeModel,Image
+import time
+import uuid
+import json
+import base64
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from clients import LazyClient
+from extraction_cache import ExtractionCache
+from extraction_queue import QueueFull, create_queue
+from model_router import ModelRouter, Tier, parse_tiers
+from preprocess import preprocess_receipt
+from receipts import TYPED_FIELDS, extraction_problems, parse_details
+import tracing
 
 # Set your Cloud Storage bucket name
 BUCKET_NAME = "wallet-images1"
+TRANSACTIONS_COLLECTION = "sample_transactions"
+# Storage layout: "flat" keeps every receipt in TRANSACTIONS_COLLECTION, "per_user"
+# writes them to users/{user}/transactions (see migrate_layout.py to move existing ones)
+TRANSACTIONS_LAYOUT = os.environ.get("TRANSACTIONS_LAYOUT", "flat")
+USERS_COLLECTION = "users"
+USER_TRANSACTIONS_SUBCOLLECTION = "transactions"
+# Per-user version counters; bumping one invalidates get-user-data's cached responses
+CACHE_VERSIONS_COLLECTION = "cache_versions"
+# One document per async upload still being extracted, keyed on the content hash, so a
+# re-upload of the same receipt before it is done gets the pending document back.
+# Markers older than PENDING_UPLOAD_TTL_SECONDS belong to lost jobs and are replaced.
+PENDING_UPLOADS_COLLECTION = "pending_uploads"
+PENDING_UPLOAD_TTL_SECONDS = float(os.environ.get("PENDING_UPLOAD_TTL_SECONDS", "900"))
+# Extraction models, cheapest first, each with its deadline in seconds and optionally
+# when to send a hedged second request ("=12/4"). A receipt goes to the next tier only
+# when the output fails validation (see model_router.py)
+EXTRACTION_TIERS = parse_tiers(os.environ.get("EXTRACTION_TIERS", "gemini-2.5-flash-lite=12,gemini-2.5-pro=40"))
+# Bump whenever the extraction prompt changes so cached extractions are not reused
+PROMPT_VERSION = "v3"
 '''
 entertainment
 health
@@ -19,17 +47,24 @@ groceries
 dining
 misc
 '''
-# Global GCS client to reuse across invocations
-storage_client = storage.Client('graceful-byway-467117-r0')
-# Initialize Firestore Client in the global scope
-# This allows the client to be reused across function invocations
-try:
-    db = firestore.Client(project="graceful-byway-467117-r0", database="receipt-management")
-except Exception as e:
-    print(f"Error initializing Firestore client: {e}")
-    db = None
-# Initialize Vertex AI in the global scope
-try:
+
+
+def create_storage_client():
+    from google.cloud import storage
+
+    return storage.Client('graceful-byway-467117-r0')
+
+
+def create_firestore_client():
+    from google.cloud import firestore
+
+    return firestore.Client(project="graceful-byway-467117-r0", database="receipt-management")
+
+
+def create_model(model_name):
+    import vertexai
+    from vertexai.generative_models import GenerativeModel
+
     # Get project and location from environment variables
     PROJECT_ID = os.environ.get("GCP_PROJECT")
     LOCATION = os.environ.get("GCP_REGION")
@@ -38,27 +73,421 @@ try:
         raise ValueError("GCP_PROJECT and GCP_REGION environment variables are not set.")
 
     vertexai.init(project=PROJECT_ID, location=LOCATION)
-    # Model name for Gemini 1.0 Pro
-    model = GenerativeModel("gemini-2.5-pro")
-except Exception as e:
-    print(f"Error initializing Vertex AI: {e}")
-    model = None
+    return GenerativeModel(model_name)
+
+
+# Clients are created on first use and reused across invocations (see clients.py),
+# so preflights and rejected requests don't load the client libraries
+storage_client = LazyClient("Cloud Storage client", create_storage_client)
+db = LazyClient("Firestore client", create_firestore_client)
+
+# Extractions that fail validation, or report a confidence below
+# EXTRACTION_MIN_CONFIDENCE, are escalated to the next tier
+EXTRACTION_MIN_CONFIDENCE = float(os.environ.get("EXTRACTION_MIN_CONFIDENCE", "0.7"))
+model_router = ModelRouter(
+    [
+        Tier(name, LazyClient(f"Vertex AI ({name})", lambda name=name: create_model(name)), deadline, hedge_after)
+        for name, deadline, hedge_after in EXTRACTION_TIERS
+    ],
+    lambda text: extraction_problems(text, EXTRACTION_MIN_CONFIDENCE),
+    retries=int(os.environ.get("EXTRACTION_RETRIES", "2")),
+    backoff=float(os.environ.get("EXTRACTION_BACKOFF_SECONDS", "0.5")),
+    budget=float(os.environ.get("EXTRACTION_BUDGET_SECONDS", "50")),
+    workers=int(os.environ.get("MODEL_CALL_WORKERS", "16")),
+)
+
+# Ingest mode: "pipelined" feeds the in-memory bytes straight to Gemini while the
+# GCS upload runs in the background; "serial" keeps the old upload -> download ->
+# generate path so the two can be compared stage by stage from the logs.
+INGEST_MODE = os.environ.get("INGEST_MODE", "pipelined")
+# Worker threads for background GCS uploads, shared across invocations
+upload_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("UPLOAD_WORKERS", "4")))
+# Batch uploads: files per request (a Firestore batch takes at most 500 writes) and
+# how many extractions an instance runs against Vertex AI at once
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "50"))
+batch_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("BATCH_MAX_CONCURRENCY", "4")))
+
+# Receipt preprocessing before storage and extraction (orientation, grayscale,
+# crop, downscale, recompress). Off until preprocess_receipts.py --extract shows
+# the extraction agrees on real receipts; cropping is a further opt-in.
+# KEEP_ORIGINAL_UPLOAD also stores the untouched upload under originals/ in the bucket.
+PREPROCESS_ENABLED = os.environ.get("PREPROCESS_ENABLED", "0") == "1"
+PREPROCESS_OPTIONS = {
+    "max_edge": int(os.environ.get("PREPROCESS_MAX_EDGE", "1600")),
+    "grayscale": os.environ.get("PREPROCESS_GRAYSCALE", "1") == "1",
+    "crop": os.environ.get("PREPROCESS_CROP", "0") == "1",
+    "quality": int(os.environ.get("PREPROCESS_QUALITY", "80")),
+}
+KEEP_ORIGINAL_UPLOAD = os.environ.get("KEEP_ORIGINAL_UPLOAD", "0") == "1"
+
+# Upload limits. Werkzeug spools multipart files larger than 500 KB to a temp file,
+# and we keep them as streams: hashed and preprocessed chunk by chunk, written to
+# GCS with chunked resumable uploads. Uploads above INLINE_MAX_BYTES that could
+# not be shrunk are handed to Gemini by GCS URI instead of inline bytes.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Room for the multipart boundaries, part headers and the other form fields
+FORM_OVERHEAD_BYTES = 64 * 1024
+# Whole-body cap for a batch request. Parsed files are spooled to /tmp, which is
+# memory on Cloud Functions, so this stays well below MAX_UPLOAD_BYTES * BATCH_MAX_FILES
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", str(100 * 1024 * 1024)))
+INLINE_MAX_BYTES = int(os.environ.get("INLINE_MAX_BYTES", str(4 * 1024 * 1024)))
+# Must be a multiple of 256 KB
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Everything that changes what the model sees for a given upload; part of the
+# extraction cache key
+EXTRACTION_VERSION = ",".join(name for name, _, _ in EXTRACTION_TIERS) + f":{PROMPT_VERSION}"
+if PREPROCESS_ENABLED:
+    EXTRACTION_VERSION += ":pp-" + "-".join(f"{key}={value}" for key, value in sorted(PREPROCESS_OPTIONS.items()))
+
+EXTRACTION_CONTEXT = '''you are a finance tracker fetch the data from upload receipt and respond in json format
+                    {
+                    "details":{
+                        "transaction_type":entertainment | health | utility | groceries | dining | misc
+                        "trasaction_amount":<total_amount>,
+                        "transaction_details:<breakdown of transaction>
+                        "transaction_location:<store address if available else na"
+                        "transaction_merchant":<store name if available else na>
+                        "confidence":<0 to 1, how sure you are of the amount and type>
+                    }
+                    }
+                    '''
+EXTRACTION_QUERY = "Extract text from this image and classify the details for the transaction:"
+EXTRACTION_PROMPT = f"""
+            Here is the user's data for context for the transaction:
+            ---
+            {EXTRACTION_CONTEXT}
+            ---
+
+            Based on the data above, please answer the following user query:
+            "{EXTRACTION_QUERY}"
+            """
+
+# Content-hash cache so re-uploads of the same receipt skip the model call
+# and return the document written the first time
+if os.environ.get("EXTRACTION_CACHE_ENABLED", "1") == "1":
+    extraction_cache = ExtractionCache(
+        db,
+        os.environ.get("EXTRACTION_CACHE_COLLECTION", "extraction_cache"),
+        max_entries=int(os.environ.get("EXTRACTION_CACHE_SIZE", "256")),
+    )
+else:
+    extraction_cache = None
+
+
+def upload_size(stream):
+    """Size of a seekable upload stream, without reading it."""
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def parse_form(request, limit):
+    """Parses the multipart body, reading at most `limit` bytes of it.
+
+    The limit is set before the first access to request.files, so werkzeug enforces it
+    while reading: a chunked request without a Content-Length is cut off too. Raises
+    RequestEntityTooLarge once the body goes past it.
+    """
+    request.max_content_length = limit
+    with tracing.stage("parse"):
+        return request.files, request.form
+
+
+def write_blob(blob, data, content_type):
+    if isinstance(data, (bytes, bytearray)):
+        blob.upload_from_string(data, content_type=content_type)
+    else:
+        # Setting a chunk size turns this into a chunked resumable upload, so
+        # only one chunk of the spooled file is in memory at a time
+        blob.chunk_size = UPLOAD_CHUNK_SIZE
+        data.seek(0)
+        blob.upload_from_file(data, content_type=content_type)
+
+
+def upload_to_gcs(filename, data, content_type, original=None):
+    """
+    Uploads the receipt (bytes or a seekable stream) to the receipts bucket and
+    returns the gs:// URI. `original` is an optional (data, content_type) pair
+    stored under originals/.
+    """
+    bucket = storage_client.get().bucket(BUCKET_NAME)
+    write_blob(bucket.blob(filename), data, content_type)
+    if original:
+        original_data, original_content_type = original
+        write_blob(bucket.blob(f"originals/{filename}"), original_data, original_content_type)
+    return f"gs://{BUCKET_NAME}/{filename}"
+
+
+def prepare_receipt(filename, upload, content_type):
+    """
+    Applies the preprocessing stage to an upload stream.
+    Returns (filename, data, content_type, original) ready for upload_to_gcs. `data`
+    is bytes, unless the upload could not be shrunk and is larger than
+    INLINE_MAX_BYTES, in which case it stays a stream.
+    """
+    if PREPROCESS_ENABLED:
+        processed, processed_type, info = preprocess_receipt(upload, **PREPROCESS_OPTIONS)
+        if processed_type is not None:
+            print(f"Preprocessed {filename}: {info['original_bytes']} -> {info['processed_bytes']} bytes, "
+                  f"{info['original_size']} -> {info['processed_size']}")
+            original = (upload, content_type) if KEEP_ORIGINAL_UPLOAD else None
+            return os.path.splitext(filename)[0] + ".jpg", processed, processed_type, original
+        print(f"Preprocessing skipped for {filename}: {info['skipped']}")
+
+    if upload_size(upload) > INLINE_MAX_BYTES:
+        return filename, upload, content_type, None
+    return filename, upload.read(), content_type, None
+
+
+def extract_receipt_details(image, content_type=None):
+    """
+    Runs the Gemini extraction prompt over the receipt image through the model tiers.
+    Returns (raw text, name of the model that served it).
+    `image` is the image bytes or the gs:// URI of the stored receipt.
+    """
+    from vertexai.generative_models import Image, Part
+
+    if isinstance(image, (bytes, bytearray)):
+        part = Image.from_bytes(image)
+    else:
+        part = Part.from_uri(image, mime_type=content_type or "image/jpeg")
+    response, model_name = model_router.generate([EXTRACTION_PROMPT, part])
+    tracing.annotate(model_tier=model_name)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        tracing.annotate(
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+        )
+    return response.text, model_name
+
+
+def ingest_receipt(filename, upload, content_type):
+    """
+    Stores the receipt in GCS and extracts its details with Gemini.
+    `upload` is the seekable upload stream.
+    Returns (gcs_uri, details, extraction_model, timings) where timings maps stage
+    name -> seconds.
+
+    In pipelined mode the upload is submitted to the background executor and the
+    model is fed the bytes we already hold, so the request pays
+    max(upload, model) instead of upload + download + model. Large uploads that
+    stay streams are uploaded first and passed to the model by URI.
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    filename, data, content_type, original = prepare_receipt(filename, upload, content_type)
+    timings["preprocess"] = time.perf_counter() - started
+
+    if INGEST_MODE == "serial" or not isinstance(data, (bytes, bytearray)):
+        stage = time.perf_counter()
+        gcs_uri = upload_to_gcs(filename, data, content_type, original)
+        timings["gcs_upload"] = time.perf_counter() - stage
+
+        if isinstance(data, (bytes, bytearray)):
+            stage = time.perf_counter()
+            data = storage_client.get().bucket(BUCKET_NAME).blob(filename).download_as_bytes()
+            timings["gcs_download"] = time.perf_counter() - stage
+        else:
+            data = gcs_uri
+
+        stage = time.perf_counter()
+        details, extraction_model = extract_receipt_details(data, content_type)
+        timings["model"] = time.perf_counter() - stage
+    else:
+        def timed_upload():
+            stage = time.perf_counter()
+            uri = upload_to_gcs(filename, data, content_type, original)
+            # Runs alongside the model call; read after upload_future.result()
+            timings["gcs_upload"] = time.perf_counter() - stage
+            return uri
+
+        upload_future = upload_executor.submit(timed_upload)
+
+        stage = time.perf_counter()
+        try:
+            details, extraction_model = extract_receipt_details(data)
+        except Exception:
+            # Let the upload finish so we don't leave a half-written object behind
+            upload_future.exception()
+            raise
+        timings["model"] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        gcs_uri = upload_future.result()
+        # Time spent waiting on the upload after the model returned (0 when fully overlapped)
+        timings["gcs_upload_wait"] = time.perf_counter() - stage
+
+    timings["ingest_total"] = time.perf_counter() - started
+    return gcs_uri, details, extraction_model, timings
+
+
+def build_transaction(user, transaction_time, gcs_uri, details, extraction_model):
+    """
+    Transaction document for an extracted receipt: the raw model text plus the
+    typed fields parsed from it, so queries can filter and sum without re-parsing,
+    and the model that produced it.
+    """
+    return {
+        "user": user,
+        "transaction_time": transaction_time,
+        "gcs_uri": gcs_uri,
+        "details": details,
+        **parse_details(details),
+        "extraction_model": extraction_model,
+        "status": "done"
+    }
+
+
+def typed_fields(doc_data):
+    return {field: doc_data.get(field) for field in TYPED_FIELDS}
+
+
+def format_timings(timings):
+    return " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in timings.items())
+
+
+def user_key(user):
+    """Document id for a user's partition ("/" is not allowed in document ids)."""
+    return str(user).replace("/", "_")
+
+
+def transactions_ref(user):
+    """Collection the given user's transactions are stored in under TRANSACTIONS_LAYOUT."""
+    if TRANSACTIONS_LAYOUT == "per_user":
+        return (
+            db.get().collection(USERS_COLLECTION).document(user_key(user))
+            .collection(USER_TRANSACTIONS_SUBCOLLECTION)
+        )
+    return db.get().collection(TRANSACTIONS_COLLECTION)
+
+
+def cache_version_update():
+    from google.cloud import firestore
+
+    return {"version": firestore.Increment(1), "updated_at": firestore.SERVER_TIMESTAMP}
+
+
+def cache_version_ref(user):
+    return db.get().collection(CACHE_VERSIONS_COLLECTION).document(user_key(user))
+
+
+def bump_cache_version(user):
+    """Invalidates get-user-data's cached responses for the user after a write."""
+    if not user:
+        return
+    try:
+        cache_version_ref(user).set(cache_version_update(), merge=True)
+    except Exception as e:
+        # Cached responses still expire after their TTL
+        print(f"Error bumping cache version for {user}: {e}")
+
+
+def run_extraction_job(job):
+    """
+    Worker side of the async mode: extracts the receipt for a pending transaction
+    document and flips its status to "done" or "failed".
+    """
+    doc_ref = transactions_ref(job.get("user")).document(job["document_id"])
+    started = time.perf_counter()
+    try:
+        # Pub/Sub jobs and large uploads carry no bytes; Gemini reads the stored object
+        image = job.get("file_bytes") or job["gcs_uri"]
+        details, extraction_model = extract_receipt_details(image, job.get("content_type"))
+    except Exception as e:
+        print(f"Extraction failed for {job['document_id']}: {e}")
+        doc_ref.set({"status": "failed", "error": str(e)}, merge=True)
+        bump_cache_version(job.get("user"))
+        release_pending_upload(job.get("content_key"))
+        return
+
+    doc_ref.set(
+        {"status": "done", "details": details, **parse_details(details), "extraction_model": extraction_model},
+        merge=True,
+    )
+    bump_cache_version(job.get("user"))
+    print(f"Extraction done for {job['document_id']} in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    if extraction_cache and job.get("cache_key"):
+        snapshot = doc_ref.get()
+        extraction_cache.put(job["cache_key"], {**snapshot.to_dict(), "document_id": doc_ref.id})
+    # After the cache entry, so a re-upload finds one or the other
+    release_pending_upload(job.get("content_key"))
+
+
+def claim_pending_upload(content_key, doc_ref, user, transaction_time):
+    """
+    Registers `doc_ref` as the pending extraction of this content. Returns None when
+    the claim succeeded, or the marker of an earlier upload of the same content
+    that is still being extracted.
+    """
+    from google.api_core.exceptions import Conflict
+
+    marker_ref = db.get().collection(PENDING_UPLOADS_COLLECTION).document(content_key)
+    marker = {"document_id": doc_ref.id, "user": user, "transaction_time": transaction_time, "created_at": time.time()}
+    try:
+        # create() fails if the document exists, so of two concurrent uploads only one wins
+        marker_ref.create(marker)
+        return None
+    except Conflict:
+        existing = marker_ref.get().to_dict()
+    if existing and time.time() - existing.get("created_at", 0) < PENDING_UPLOAD_TTL_SECONDS:
+        return existing
+    print(f"Replacing stale pending upload marker {content_key}")
+    marker_ref.set(marker)
+    return None
+
+
+def release_pending_upload(content_key):
+    if not content_key:
+        return
+    try:
+        db.get().collection(PENDING_UPLOADS_COLLECTION).document(content_key).delete()
+    except Exception as e:
+        # The marker expires after PENDING_UPLOAD_TTL_SECONDS
+        print(f"Error releasing pending upload {content_key}: {e}")
+
+
+# Queue for async uploads: "pubsub" hands them to the process_extraction_job function
+# through EXTRACTION_TOPIC. "inprocess" runs them on a bounded pool in this instance and
+# is for local development only: a Cloud Function's CPU is throttled once the 202 is
+# sent, so queued jobs stall and are lost with the instance.
+EXTRACTION_QUEUE = os.environ.get("EXTRACTION_QUEUE", "pubsub")
+EXTRACTION_TOPIC = os.environ.get("EXTRACTION_TOPIC")
+# mode=async is answered with 400 unless ASYNC_UPLOADS_ENABLED=1. The pubsub queue's
+# settings are checked here, so a deployment missing them fails at startup rather
+# than answering 500 to every async upload.
+ASYNC_UPLOADS_ENABLED = os.environ.get("ASYNC_UPLOADS_ENABLED", "0") == "1"
+if ASYNC_UPLOADS_ENABLED and EXTRACTION_QUEUE == "pubsub" and not (EXTRACTION_TOPIC and os.environ.get("GCP_PROJECT")):
+    raise RuntimeError("Async uploads with the pubsub extraction queue need EXTRACTION_TOPIC and GCP_PROJECT.")
+extraction_queue = LazyClient("extraction queue", lambda: create_queue(
+    EXTRACTION_QUEUE,
+    run_extraction_job,
+    project_id=os.environ.get("GCP_PROJECT"),
+    topic=EXTRACTION_TOPIC,
+    workers=int(os.environ.get("EXTRACTION_WORKERS", "4")),
+    max_pending=int(os.environ.get("EXTRACTION_MAX_PENDING", "32")),
+))
 
 @functions_framework.http
+@tracing.traced("upload_form_data")
 def upload_form_data(request: Request):
     """
     Accepts multipart/form-data with:
     - file: image file
     - transaction_time: string (e.g., "2025-07-26T12:34:00Z")
     - user: string (e.g., "adarsh.shaw")
+    - mode: optional, "sync" (default) or "async" (with ASYNC_UPLOADS_ENABLED=1)
     Uploads the file to GCS.
-    """
 
-    if not db:
-        return {"error": "Firestore client is not available."}, 500
-    
-    if not model:
-        return {"error": "Vertex AI model is not available."}, 500
+    In async mode the image is stored together with a `status: pending`
+    transaction document and the request returns 202 with the document id;
+    extraction runs on the extraction queue and `get_extraction_status`
+    reports progress.
+    """
 
     # Handle CORS preflight
     if request.method == "OPTIONS":
@@ -76,79 +505,94 @@ def upload_form_data(request: Request):
         return ({"error": "Only POST method is accepted"}, 405, headers)
 
     try:
+        files, form = parse_form(request, MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES)
+
         # Validate all expected fields
-        if 'file' not in request.files:
+        if 'file' not in files:
             return ({"error": "Missing 'file' in form data"}, 400, headers)
-        if 'transaction_time' not in request.form or 'user' not in request.form:
+        if 'transaction_time' not in form or 'user' not in form:
             return ({"error": "Missing 'transaction_time' or 'user' in form data"}, 400, headers)
 
-        file = request.files['file']
-        timestamp = request.form['transaction_time']
+        file = files['file']
+        timestamp = form['transaction_time']
         transaction_time = datetime.fromtimestamp(int(timestamp) / 1000, tz=timezone.utc)
-        user = request.form['user']
+        user = form['user']
+        mode = form.get('mode', request.args.get('mode', 'sync'))
 
         if file.filename == "":
             return ({"error": "No selected file"}, 400, headers)
+        if mode == "async" and not ASYNC_UPLOADS_ENABLED:
+            return ({"error": "Async uploads are not enabled."}, 400, headers)
 
         filename = secure_filename(file.filename)
-        file_bytes = file.read()
+        upload = file.stream
+        size = upload_size(upload)
+        if size > MAX_UPLOAD_BYTES:
+            return ({"error": f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit."}, 413, headers)
 
         print(f"Received file: {filename}")
-        print(f"Size: {len(file_bytes)} bytes")
+        print(f"Size: {size} bytes")
+        tracing.annotate(upload_bytes=size, mode=mode)
         print(f"transaction_time: {transaction_time}")
         print(f"User: {user}")
 
-        # Upload to GCS
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(filename)
-        blob.upload_from_string(file_bytes, content_type=file.content_type)
-        gcs_uri= f"gs://{BUCKET_NAME}/{filename}",
+        if not db.get():
+            return ({"error": "Firestore client is not available."}, 500, headers)
+        if not model_router.available():
+            return ({"error": "Vertex AI model is not available."}, 500, headers)
 
-        print(f"File uploaded to GCS: gs://{BUCKET_NAME}/{filename}")
-        try:
-            # Construct the prompt for Gemini
-            context='''you are a finance tracker fetch the data from upload receipt and respond in json format
-                    {
-                    "details":{
-                        "transaction_type":entertainment | health | utility | groceries | dining | misc
-                        "trasaction_amount":<total_amount>,
-                        "transaction_details:<breakdown of transaction>
-                        "transaction_location:<store address if available else na"
-                    }
-                    }
-                    '''
-            user_query="Extract text from this image and classify the details for the transaction:"
-            prompt = f"""
-            Here is the user's data for context for the transaction:
-            ---
-            {context}
-            ---
+        cache_key = None
+        if extraction_cache:
+            with tracing.stage("hash"):
+                cache_key = ExtractionCache.make_key(upload, user, EXTRACTION_VERSION)
+            with tracing.stage("cache_lookup"):
+                cached = extraction_cache.get(cache_key)
+            tracing.annotate(cache="hit" if cached else "miss")
+            if cached:
+                print(f"Extraction cache hit for {filename}: {cached['document_id']}")
+                return ({
+                    "message": f"File '{filename}' was already uploaded.",
+                    "gcs_uri": cached["gcs_uri"],
+                    "user": user,
+                    "transaction_time": cached["transaction_time"],
+                    "document_id": cached["document_id"],
+                    "details": cached["details"],
+                    **typed_fields(cached),
+                    "cached": True
+                }, 200, headers)
 
-            Based on the data above, please answer the following user query:
-            "{user_query}"
-            """
-
-            image_bytes = blob.download_as_bytes()
-            img = Image.from_bytes(image_bytes)
-
-
-            # Generate content
-            response = model.generate_content([prompt, img])
+        if mode == "async":
+            with tracing.stage("hash"):
+                content_key = cache_key or ExtractionCache.make_key(upload, user, EXTRACTION_VERSION)
+            return enqueue_extraction(
+                filename, upload, file.content_type, user, transaction_time, cache_key, content_key, headers
+            )
 
+        try:
+            gcs_uri, details, extraction_model, timings = ingest_receipt(filename, upload, file.content_type)
         except Exception as e:
-            print(f"An error occurred while calling Gemini API: {e}")
+            print(f"An error occurred while uploading or calling Gemini API: {e}")
             return ({"error": "An internal error occurred while processing the request."}, 500, headers)
-        collection_name='sample_transactions'
-        doc_ref = db.collection(collection_name).document()
+        print(f"File uploaded to GCS: {gcs_uri}")
 
-        doc_data = {
-            "user": user,
-            "transaction_time": transaction_time,
-            "gcs_uri": gcs_uri,
-            "details":response.text
-        }
+        doc_ref = transactions_ref(user).document()
+
+        doc_data = build_transaction(user, transaction_time, gcs_uri, details, extraction_model)
+        stage = time.perf_counter()
         doc_ref.set(doc_data)
+        timings["firestore_write"] = time.perf_counter() - stage
+        # Timed on its own so firestore_write stays the document write measured above
+        with tracing.stage("cache_version"):
+            bump_cache_version(user)
         print(f"Saved to Firestore: {doc_ref.id}")
+        print(f"Ingest timings ({INGEST_MODE}): {format_timings(timings)}")
+        for name, seconds in timings.items():
+            if name != "ingest_total":
+                tracing.record(name, seconds)
+        tracing.annotate(document_id=doc_ref.id, parse_status=doc_data.get("parse_status"))
+
+        if cache_key:
+            extraction_cache.put(cache_key, {**doc_data, "document_id": doc_ref.id})
 
         template_wallet = {
             "id": "3388000000022969024.simple_class",
@@ -211,14 +655,338 @@ def upload_form_data(request: Request):
             "user": user,
             "transaction_time": transaction_time,
             "document_id": doc_ref.id,
-            "details":response.text
+            "details": details,
+            **typed_fields(doc_data),
+            "cached": False
         }, 200, headers)
 
+    except RequestEntityTooLarge:
+        return ({"error": f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit."}, 413, headers)
     except Exception as e:
         print(f"Error: {e}")
         return ({"error": "Failed to process form data or upload to GCS."}, 500, headers)
 
 
+@functions_framework.http
+@tracing.traced("upload_form_data_batch")
+def upload_form_data_batch(request: Request):
+    """
+    Batch variant of upload_form_data. Accepts multipart/form-data with:
+    - file: one or more image files
+    - transaction_time: one value per file (same order), or a single value for all
+    - user: string
+    Extractions run concurrently (capped by BATCH_MAX_CONCURRENCY) and the new
+    transaction documents are committed in a single batched write. Returns a
+    result per file; 207 when only some of them succeeded. A file sent twice in the
+    same batch is extracted once and the copy reported as "cached".
+    """
+    if request.method == "OPTIONS":
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "POST",
+            "Access-Control-Allow-Headers": "Content-Type",
+            "Access-Control-Max-Age": "3600",
+        }
+        return ("", 204, headers)
+
+    headers = {"Access-Control-Allow-Origin": "*"}
+
+    if request.method != "POST":
+        return ({"error": "Only POST method is accepted"}, 405, headers)
+
+    try:
+        files, form = parse_form(request, BATCH_MAX_BYTES)
+    except RequestEntityTooLarge:
+        return ({"error": f"Batch exceeds the {BATCH_MAX_BYTES} byte limit."}, 413, headers)
+    files = files.getlist('file')
+    timestamps = form.getlist('transaction_time')
+    user = form.get('user')
+
+    if not files:
+        return ({"error": "Missing 'file' in form data"}, 400, headers)
+    if not timestamps or not user:
+        return ({"error": "Missing 'transaction_time' or 'user' in form data"}, 400, headers)
+    if len(files) > BATCH_MAX_FILES:
+        return ({"error": f"At most {BATCH_MAX_FILES} files are accepted per batch."}, 413, headers)
+    if len(timestamps) == 1:
+        timestamps = timestamps * len(files)
+    elif len(timestamps) != len(files):
+        return ({"error": "Send one 'transaction_time' per file, or a single one for all files."}, 400, headers)
+
+    if not db.get():
+        return ({"error": "Firestore client is not available."}, 500, headers)
+    if not model_router.available():
+        return ({"error": "Vertex AI model is not available."}, 500, headers)
+
+    print(f"Received batch of {len(files)} files for user: {user}")
+    tracing.annotate(files=len(files))
+    started = time.perf_counter()
+
+    results = [None] * len(files)
+    pending = {}
+    # Object names are prefixed with the batch id and the file's index, so files
+    # that share a name don't overwrite each other in the bucket
+    batch_id = uuid.uuid4().hex
+    # content key -> index of the first file with that content, and later copies
+    first_seen = {}
+    duplicates = {}
+    for index, (file, timestamp) in enumerate(zip(files, timestamps)):
+        result = {"index": index, "filename": file.filename}
+        results[index] = result
+        try:
+            if file.filename == "":
+                raise ValueError("No selected file")
+            transaction_time = datetime.fromtimestamp(int(timestamp) / 1000, tz=timezone.utc)
+            filename = f"{batch_id}-{index}-{secure_filename(file.filename)}"
+            upload = file.stream
+            if upload_size(upload) > MAX_UPLOAD_BYTES:
+                raise ValueError(f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+        except Exception as e:
+            result.update({"status": "error", "error": str(e)})
+            continue
+
+        content_key = ExtractionCache.make_key(upload, user, EXTRACTION_VERSION)
+        if content_key in first_seen:
+            duplicates[index] = first_seen[content_key]
+            continue
+        first_seen[content_key] = index
+
+        cache_key = None
+        if extraction_cache:
+            cache_key = content_key
+            cached = extraction_cache.get(cache_key)
+            if cached:
+                result.update({
+                    "status": "cached",
+                    "document_id": cached["document_id"],
+                    "gcs_uri": cached["gcs_uri"],
+                    "transaction_time": cached["transaction_time"],
+                    "details": cached["details"],
+                    **typed_fields(cached)
+                })
+                continue
+
+        future = batch_executor.submit(ingest_receipt, filename, upload, file.content_type)
+        pending[index] = (future, transaction_time, cache_key)
+
+    batch = db.get().batch()
+    written = []
+    for index, (future, transaction_time, cache_key) in pending.items():
+        result = results[index]
+        try:
+            # Extractions run side by side; this is the wall time spent waiting on them
+            with tracing.stage("ingest"):
+                gcs_uri, details, extraction_model, _ = future.result()
+        except Exception as e:
+            print(f"Extraction failed for {result['filename']}: {e}")
+            result.update({"status": "error", "error": "Failed to upload or extract the receipt."})
+            continue
+
+        doc_ref = transactions_ref(user).document()
+        doc_data = build_transaction(user, transaction_time, gcs_uri, details, extraction_model)
+        batch.set(doc_ref, doc_data)
+        written.append((result, doc_ref, doc_data, cache_key))
+
+    if written:
+        batch.set(cache_version_ref(user), cache_version_update(), merge=True)
+        try:
+            with tracing.stage("firestore_write"):
+                batch.commit()
+        except Exception as e:
+            print(f"Error committing batch to Firestore: {e}")
+            for result, _, _, _ in written:
+                result.update({"status": "error", "error": "Failed to save the transaction."})
+            written = []
+
+    for result, doc_ref, doc_data, cache_key in written:
+        result.update({
+            "status": "ok",
+            "document_id": doc_ref.id,
+            "gcs_uri": doc_data["gcs_uri"],
+            "transaction_time": doc_data["transaction_time"],
+            "details": doc_data["details"],
+            **typed_fields(doc_data)
+        })
+        if cache_key:
+            extraction_cache.put(cache_key, {**doc_data, "document_id": doc_ref.id})
+
+    for index, first in duplicates.items():
+        copied = {key: value for key, value in results[first].items() if key not in ("index", "filename")}
+        if copied["status"] == "ok":
+            copied["status"] = "cached"
+        results[index].update(copied)
+
+    failed = sum(1 for result in results if result["status"] == "error")
+    print(f"Batch done: {len(results) - failed} ok, {failed} failed in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    if failed == len(results):
+        status_code = 500
+    elif failed:
+        status_code = 207
+    else:
+        status_code = 200
+    return ({
+        "user": user,
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "results": results
+    }, status_code, headers)
+
+
+def enqueue_extraction(filename, upload, content_type, user, transaction_time, cache_key, content_key, headers):
+    """
+    Async half of upload_form_data: persist image + pending document, queue the extraction.
+    `content_key` identifies the upload's content; while one upload of it is pending,
+    another gets that upload's document back instead of a second extraction.
+    """
+    queue = extraction_queue.get()
+    if not queue:
+        return ({"error": "Extraction queue is not available."}, 500, headers)
+
+    doc_ref = transactions_ref(user).document()
+    try:
+        with tracing.stage("firestore_write"):
+            existing = claim_pending_upload(content_key, doc_ref, user, transaction_time)
+    except Exception as e:
+        print(f"Error claiming pending upload {content_key}: {e}")
+        return ({"error": "An internal error occurred while processing the request."}, 500, headers)
+    if existing:
+        print(f"Upload of {filename} is already pending as {existing['document_id']}")
+        tracing.annotate(document_id=existing["document_id"], duplicate=True)
+        return ({
+            "message": f"File '{filename}' is already being processed.",
+            "user": user,
+            "transaction_time": existing["transaction_time"],
+            "document_id": existing["document_id"],
+            "status": "pending",
+            "duplicate": True
+        }, 202, headers)
+
+    try:
+        with tracing.stage("preprocess"):
+            filename, data, content_type, original = prepare_receipt(filename, upload, content_type)
+        with tracing.stage("gcs_upload"):
+            gcs_uri = upload_to_gcs(filename, data, content_type, original)
+        with tracing.stage("firestore_write"):
+            doc_ref.set({
+                "user": user,
+                "transaction_time": transaction_time,
+                "gcs_uri": gcs_uri,
+                "details": None,
+                "status": "pending"
+            })
+        with tracing.stage("cache_version"):
+            bump_cache_version(user)
+    except Exception as e:
+        print(f"Error storing pending upload: {e}")
+        release_pending_upload(content_key)
+        return ({"error": "Failed to process form data or upload to GCS."}, 500, headers)
+
+    try:
+        queue.submit({
+            "document_id": doc_ref.id,
+            "user": user,
+            "filename": filename,
+            "gcs_uri": gcs_uri,
+            "content_type": content_type,
+            "cache_key": cache_key,
+            "content_key": content_key,
+            "file_bytes": data if isinstance(data, (bytes, bytearray)) else None
+        })
+    except QueueFull:
+        doc_ref.set({"status": "failed", "error": "Extraction queue is full"}, merge=True)
+        release_pending_upload(content_key)
+        return ({"error": "Too many uploads in progress, retry shortly.", "document_id": doc_ref.id}, 503,
+                {**headers, "Retry-After": "5"})
+    except Exception as e:
+        print(f"Error queueing extraction for {doc_ref.id}: {e}")
+        doc_ref.set({"status": "failed", "error": "Could not queue extraction"}, merge=True)
+        release_pending_upload(content_key)
+        return ({"error": "An internal error occurred while processing the request."}, 500, headers)
+
+    print(f"Queued extraction for {doc_ref.id}")
+    return ({
+        "message": f"File '{filename}' accepted for processing.",
+        "gcs_uri": gcs_uri,
+        "user": user,
+        "transaction_time": transaction_time,
+        "document_id": doc_ref.id,
+        "status": "pending"
+    }, 202, headers)
+
+
+@functions_framework.cloud_event
+def process_extraction_job(cloud_event):
+    """Pub/Sub-triggered worker for jobs published by the "pubsub" extraction queue."""
+    job = json.loads(base64.b64decode(cloud_event.data["message"]["data"]))
+    run_extraction_job(job)
+
+
+@functions_framework.http
+@tracing.traced("get_extraction_status")
+def get_extraction_status(request: Request):
+    """
+    Reports the extraction status of a transaction document.
+    Accepts `document_id` (and `user`, required with the per_user layout) as query
+    parameters or in a JSON body and returns {"document_id", "status", "details"}
+    with status pending | done | failed.
+    """
+    if request.method == "OPTIONS":
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST",
+            "Access-Control-Allow-Headers": "Content-Type",
+            "Access-Control-Max-Age": "3600",
+        }
+        return ("", 204, headers)
+
+    headers = {"Access-Control-Allow-Origin": "*"}
+
+    request_json = request.get_json(silent=True) or {}
+    document_id = request.args.get("document_id") or request_json.get("document_id")
+    if not document_id:
+        return ({"error": "Missing 'document_id'"}, 400, headers)
+    user = request.args.get("user") or request_json.get("user")
+    if TRANSACTIONS_LAYOUT == "per_user" and not user:
+        return ({"error": "Missing 'user'"}, 400, headers)
+
+    if not db.get():
+        return ({"error": "Firestore client is not available."}, 500, headers)
+
+    with tracing.stage("firestore_read"):
+        snapshot = transactions_ref(user).document(document_id).get()
+    if not snapshot.exists:
+        return ({"error": f"Transaction '{document_id}' not found."}, 404, headers)
+
+    data = snapshot.to_dict()
+    body = {
+        "document_id": document_id,
+        # Documents written before the status field existed were always extracted inline
+        "status": data.get("status", "done"),
+        "details": data.get("details"),
+        **typed_fields(data)
+    }
+    if data.get("error"):
+        body["error"] = data["error"]
+    return (body, 200, headers)
+
+
+@functions_framework.http
+def extraction_model_stats(request: Request):
+    """Returns how many receipts each model tier served, and the escalation, retry and hedge counters."""
+    headers = {"Access-Control-Allow-Origin": "*"}
+    return ({"tiers": [name for name, _, _ in EXTRACTION_TIERS], **model_router.stats()}, 200, headers)
+
+
+@functions_framework.http
+def extraction_cache_stats(request: Request):
+    """Returns the extraction cache hit/miss counters for this instance."""
+    headers = {"Access-Control-Allow-Origin": "*"}
+    if not extraction_cache:
+        return ({"enabled": False}, 200, headers)
+    return ({"enabled": True, **extraction_cache.stats()}, 200, headers)
+
+
 def testwallet():
     import json
     import requests
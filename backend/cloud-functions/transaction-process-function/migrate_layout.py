@@ -0,0 +1,142 @@
+"""
+Copies transactions from the flat collection into the per-user layout
+(users/{user}/transactions/{id}) used with TRANSACTIONS_LAYOUT=per_user, then
+verifies that every user's partition holds as many documents as the source.
+
+The source is split into ranges with a partitioned collection group query and
+the ranges are copied in parallel, each with its own BulkWriter. The group also
+matches subcollections that share the source's name, so their documents are
+skipped, and a source named like the per-user subcollection is refused: the
+copies would be read back as source documents. Documents keep their ids,
+so rerunning the migration overwrites instead of duplicating. The source
+collection is left untouched.
+
+    python migrate_layout.py --emulator localhost:8080
+    python migrate_layout.py --partitions 32 --workers 8
+    python migrate_layout.py --verify-only
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ID = "graceful-byway-467117-r0"
+DATABASE = "receipt-management"
+USERS_COLLECTION = "users"
+USER_TRANSACTIONS_SUBCOLLECTION = "transactions"
+# Uploads without a user are stored as "NA" by the UI
+UNKNOWN_USER = "NA"
+
+
+def user_key(user):
+    return str(user).replace("/", "_")
+
+
+def destination(db, user):
+    return db.collection(USERS_COLLECTION).document(user_key(user)).collection(USER_TRANSACTIONS_SUBCOLLECTION)
+
+
+def copy_partition(db, partition, dry_run):
+    """Copies one range of the source; returns {user: documents copied}."""
+    copied = Counter()
+    writer = None if dry_run else db.bulk_writer()
+    for doc in partition.query().stream():
+        # Only the top-level collection; the group query also returns nested ones of that name
+        if doc.reference.parent.parent is not None:
+            continue
+        data = doc.to_dict() or {}
+        user = data.get("user") or UNKNOWN_USER
+        if writer:
+            writer.set(destination(db, user).document(doc.id), data)
+        copied[user] += 1
+    if writer:
+        writer.close()
+    return copied
+
+
+def source_counts(db, collection):
+    """{user: documents} in the source collection, from a projection of the user field."""
+    counts = Counter()
+    for doc in db.collection(collection).select(["user"]).stream():
+        counts[(doc.to_dict() or {}).get("user") or UNKNOWN_USER] += 1
+    return counts
+
+
+def count(query):
+    return int(query.count(alias="count").get()[0][0].value)
+
+
+def verify(db, collection, expected, workers):
+    """Compares per-user counts in the new layout with the source. Returns the mismatches."""
+    source_total = count(db.collection(collection))
+    if source_total != sum(expected.values()):
+        print(f"Source holds {source_total} documents but {sum(expected.values())} were seen; "
+              f"it changed during the run")
+
+    # Users whose names only differ in "/" share a partition
+    per_key = Counter()
+    for user, expected_count in expected.items():
+        per_key[user_key(user)] += expected_count
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        actual = dict(zip(per_key, pool.map(lambda key: count(
+            db.collection(USERS_COLLECTION).document(key).collection(USER_TRANSACTIONS_SUBCOLLECTION)
+        ), per_key)))
+
+    mismatches = []
+    for key, expected_count in sorted(per_key.items()):
+        if actual[key] != expected_count:
+            print(f"MISMATCH {key}: expected {expected_count}, found {actual[key]}")
+            mismatches.append(key)
+    print(f"Verified {len(per_key)} users, {sum(per_key.values())} documents: {len(mismatches)} mismatched")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="sample_transactions", help="flat source collection")
+    parser.add_argument("--project", default=PROJECT_ID)
+    parser.add_argument("--database", default=DATABASE)
+    parser.add_argument("--emulator", help="host:port of a Firestore emulator")
+    parser.add_argument("--partitions", type=int, default=16, help="ranges to split the source into")
+    parser.add_argument("--workers", type=int, default=8, help="ranges copied at once")
+    parser.add_argument("--dry-run", action="store_true", help="read and count but don't write")
+    parser.add_argument("--verify-only", action="store_true", help="only compare counts")
+    args = parser.parse_args()
+    if args.collection == USER_TRANSACTIONS_SUBCOLLECTION:
+        parser.error(f"the source can't be named '{USER_TRANSACTIONS_SUBCOLLECTION}', like the per-user subcollections")
+
+    if args.emulator:
+        os.environ["FIRESTORE_EMULATOR_HOST"] = args.emulator
+    from google.cloud import firestore
+
+    db = firestore.Client(project=args.project, database=args.database)
+    started = time.perf_counter()
+
+    if args.verify_only:
+        expected = source_counts(db, args.collection)
+    else:
+        # A collection group query over the source's id partitions the flat collection
+        partitions = list(db.collection_group(args.collection).get_partitions(args.partitions))
+        print(f"Copying {args.collection} in {len(partitions)} partitions with {args.workers} workers")
+        expected = Counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            for copied in pool.map(lambda partition: copy_partition(db, partition, args.dry_run), partitions):
+                expected.update(copied)
+                done = sum(expected.values())
+                elapsed = time.perf_counter() - started
+                print(f"{done} documents copied, {done / elapsed:.0f} docs/sec")
+        if args.dry_run:
+            print(f"Dry run: {sum(expected.values())} documents for {len(expected)} users")
+            return
+
+    mismatches = verify(db, args.collection, expected, args.workers)
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
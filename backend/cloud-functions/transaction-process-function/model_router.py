@@ -0,0 +1,163 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# HTTP statuses of model errors worth another attempt: throttling and server-side failures
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+MAX_BACKOFF_SECONDS = 4.0
+
+
+def parse_tiers(spec):
+    """
+    "gemini-2.5-flash-lite=12/4,gemini-2.5-pro=40" ->
+    [("gemini-2.5-flash-lite", 12.0, 4.0), ("gemini-2.5-pro", 40.0, None)], cheapest
+    first. The numbers are the tier's deadline and, optionally, when to hedge, in seconds.
+    """
+    tiers = []
+    for entry in spec.split(","):
+        name, _, timing = entry.strip().partition("=")
+        deadline, _, hedge_after = timing.partition("/")
+        if name:
+            tiers.append((name.strip(), float(deadline or 30), float(hedge_after) if hedge_after else None))
+    if not tiers:
+        raise ValueError(f"No model tiers in {spec!r}")
+    return tiers
+
+
+def is_retryable(error):
+    """Timeouts, throttling (429) and 5xx from the Vertex AI client (google.api_core errors carry `code`)."""
+    if isinstance(error, TimeoutError):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_CODES
+
+
+class Tier:
+    def __init__(self, name, model, deadline, hedge_after=None):
+        self.name = name
+        # LazyClient of the GenerativeModel
+        self.model = model
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+
+
+class ModelRouter:
+    """
+    Sends a prompt to the cheapest model tier first and escalates to the next
+    tier only when the output fails `validate(text)`, which returns a list of
+    problems (empty when the output is good enough).
+
+    Each call gets the tier's deadline. Timeouts, throttling and 5xx are
+    retried up to `retries` times with full-jitter exponential backoff; a tier
+    that still fails hands over to the next one. For a tier with `hedge_after`,
+    an attempt that has not answered by then is sent a second time and the
+    first answer wins. Nothing starts after `budget` seconds.
+
+    Calls run on a pool of their own, so a call past its deadline is abandoned
+    rather than awaited. The client has no way to cancel it; it finishes in the
+    background and its result is dropped.
+    """
+
+    def __init__(self, tiers, validate, retries=2, backoff=0.5, budget=None, workers=16):
+        self.tiers = tiers
+        self.validate = validate
+        self.retries = retries
+        self.backoff = backoff
+        self.budget = budget
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self.counters = {"served": {tier.name: 0 for tier in tiers}, "escalations": 0, "retries": 0,
+                         "timeouts": 0, "hedges": 0, "failures": 0}
+
+    def available(self):
+        """Whether any tier's model could be created; stops at the first that can."""
+        return any(tier.model.get() is not None for tier in self.tiers)
+
+    def generate(self, contents):
+        """
+        (response, tier name) of the first tier whose output validates. If none
+        does, the output of the last tier that answered; if none answered, the
+        last error is raised.
+        """
+        ends_at = time.monotonic() + self.budget if self.budget else None
+        fallback, error = None, None
+        for tier in self.tiers:
+            try:
+                response = self._call_with_retries(tier, contents, ends_at)
+            except Exception as e:
+                print(f"Extraction with {tier.name} failed: {e}")
+                self._count("failures")
+                error = e
+                continue
+
+            problems = self.validate(response.text)
+            if not problems:
+                self._count_served(tier.name)
+                return response, tier.name
+            print(f"Extraction with {tier.name} needs a better model: {', '.join(problems)}")
+            self._count("escalations")
+            fallback = (response, tier.name)
+
+        if fallback:
+            self._count_served(fallback[1])
+            return fallback
+        raise error
+
+    def _call_with_retries(self, tier, contents, ends_at):
+        for attempt in range(self.retries + 1):
+            timeout = tier.deadline
+            if ends_at is not None:
+                timeout = min(timeout, ends_at - time.monotonic())
+                if timeout <= 0:
+                    raise TimeoutError("Extraction time budget used up")
+            try:
+                return self._attempt(tier, contents, timeout)
+            except Exception as e:
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, self.backoff * 2 ** attempt))
+                print(f"Retrying {tier.name} in {delay * 1000:.0f}ms after: {e}")
+                self._count("retries")
+                time.sleep(delay)
+
+    def _attempt(self, tier, contents, timeout):
+        model = tier.model.get()
+        if model is None:
+            raise RuntimeError(f"{tier.name} is not available")
+
+        started = time.monotonic()
+        pending = {self._executor.submit(model.generate_content, contents)}
+        hedged = tier.hedge_after is None
+        while True:
+            now = time.monotonic()
+            wait_until = started + timeout
+            if not hedged:
+                wait_until = min(wait_until, started + tier.hedge_after)
+            done, pending = wait(pending, timeout=max(0.0, wait_until - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            # Every call in flight failed (or the only one did, before a hedge went out)
+            if done and (not pending or not hedged):
+                raise next(iter(done)).exception()
+
+            now = time.monotonic()
+            if now - started >= timeout:
+                self._count("timeouts")
+                raise TimeoutError(f"{tier.name} did not answer within {timeout:.1f}s")
+            if not hedged and now - started >= tier.hedge_after:
+                self._count("hedges")
+                pending.add(self._executor.submit(model.generate_content, contents))
+                hedged = True
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _count_served(self, tier_name):
+        with self._lock:
+            self.counters["served"][tier_name] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "served": dict(self.counters["served"])}
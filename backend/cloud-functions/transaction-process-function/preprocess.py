@@ -0,0 +1,134 @@
+from io import BytesIO
+
+# Cropping only happens when the paper clearly stands out from the background:
+# the two brightness classes Otsu's method splits the image into must be at least
+# this many gray levels apart. Unevenly lit receipts without a background don't
+# split that cleanly and are left alone.
+CROP_MIN_CONTRAST = 80
+# Rows and columns with fewer paper pixels than this share are background
+CROP_LINE_MIN = 0.02
+# ...and the crop must keep at least this share of the paper pixels
+CROP_MIN_KEPT = 0.99
+# Don't crop unless the detected paper covers at least this share of the frame,
+# otherwise a dark receipt or a glare spot could crop away real content
+CROP_MIN_AREA = 0.2
+CROP_MARGIN = 0.02
+
+def preprocess_receipt(upload, max_edge=1600, grayscale=True, crop=False, quality=80):
+    """
+    Normalizes a receipt photo before it is stored and sent to Gemini:
+    applies the EXIF orientation, optionally converts to grayscale and crops to
+    the paper, downscales so the longest edge is at most `max_edge` and
+    recompresses as JPEG.
+
+    `upload` is the uploaded bytes or a seekable file object; file objects are
+    decoded straight from the (spooled) stream and rewound afterwards.
+
+    Returns (bytes, content_type, info). If the upload can't be decoded or the
+    result would not be smaller, the original upload is returned with
+    content_type None and info["skipped"] set.
+    """
+    if isinstance(upload, (bytes, bytearray)):
+        source = BytesIO(upload)
+        original_bytes = len(upload)
+    else:
+        source = upload
+        source.seek(0, 2)
+        original_bytes = source.tell()
+        source.seek(0)
+
+    try:
+        from PIL import Image, ImageOps
+
+        with Image.open(source) as img:
+            original_size = img.size
+            # Lets the JPEG decoder downscale by a power of two while decoding
+            img.draft("L" if grayscale else "RGB", (max_edge, max_edge))
+            img = ImageOps.exif_transpose(img)
+            img = img.convert("L" if grayscale else "RGB")
+
+            if crop:
+                img = crop_to_paper(img)
+
+            if max(img.size) > max_edge:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            out = BytesIO()
+            img.save(out, "JPEG", quality=quality, optimize=True)
+            processed = out.getvalue()
+            processed_size = img.size
+    except Exception as e:
+        return upload, None, {"skipped": f"could not preprocess: {e}"}
+    finally:
+        source.seek(0)
+
+    if len(processed) >= original_bytes:
+        return upload, None, {"skipped": "preprocessed image is not smaller"}
+
+    return processed, "image/jpeg", {
+        "original_bytes": original_bytes,
+        "processed_bytes": len(processed),
+        "original_size": original_size,
+        "processed_size": processed_size,
+    }
+
+
+def otsu_threshold(histogram):
+    """(threshold, mean below, mean above) of the split that best separates a 256-bin histogram."""
+    total = sum(histogram)
+    weighted_total = sum(value * count for value, count in enumerate(histogram))
+    best = (0.0, 0, 0.0, 0.0)
+    below = weighted_below = 0
+    for value in range(255):
+        below += histogram[value]
+        weighted_below += value * histogram[value]
+        above = total - below
+        if not below or not above:
+            continue
+        mean_below = weighted_below / below
+        mean_above = (weighted_total - weighted_below) / above
+        variance = below * above * (mean_above - mean_below) ** 2
+        if variance > best[0]:
+            best = (variance, value, mean_below, mean_above)
+    return best[1:]
+
+
+def _paper_span(profile, length):
+    """First and last index (exclusive) of a row/column profile above CROP_LINE_MIN."""
+    lines = [index for index in range(length) if profile[index] / 255 >= CROP_LINE_MIN]
+    return (lines[0], lines[-1] + 1) if lines else (0, length)
+
+
+def crop_to_paper(img):
+    """
+    Crops a grayscale/RGB image to the paper, if the paper clearly contrasts
+    with a darker background; otherwise returns the image unchanged.
+    """
+    from PIL import Image
+
+    gray = img if img.mode == "L" else img.convert("L")
+    threshold, mean_below, mean_above = otsu_threshold(gray.histogram())
+    if mean_above - mean_below < CROP_MIN_CONTRAST:
+        return img
+
+    paper = gray.point(lambda p: 255 if p > threshold else 0)
+    width, height = img.size
+    # Share of paper pixels in every column and row
+    left, right = _paper_span(list(paper.resize((width, 1), Image.BOX).getdata()), width)
+    top, bottom = _paper_span(list(paper.resize((1, height), Image.BOX).getdata()), height)
+    if (right - left) * (bottom - top) < CROP_MIN_AREA * width * height:
+        return img
+
+    paper_pixels = paper.histogram()[255]
+    kept = paper.crop((left, top, right, bottom)).histogram()[255]
+    if not paper_pixels or kept < CROP_MIN_KEPT * paper_pixels:
+        return img
+
+    margin_x = int(width * CROP_MARGIN)
+    margin_y = int(height * CROP_MARGIN)
+    return img.crop((
+        max(0, left - margin_x),
+        max(0, top - margin_y),
+        min(width, right + margin_x),
+        min(height, bottom + margin_y),
+    ))
@@ -0,0 +1,181 @@
+import json
+import re
+
+CATEGORIES = ("entertainment", "health", "utility", "groceries", "dining", "misc")
+
+# Spellings the model (or older prompts) use for the fixed categories
+CATEGORY_ALIASES = {
+    "grocery": "groceries",
+    "supermarket": "groceries",
+    "food": "dining",
+    "restaurant": "dining",
+    "restaurants": "dining",
+    "cafe": "dining",
+    "utilities": "utility",
+    "bills": "utility",
+    "medical": "health",
+    "pharmacy": "health",
+    "healthcare": "health",
+    "movie": "entertainment",
+    "movies": "entertainment",
+    "miscellaneous": "misc",
+    "other": "misc",
+    "others": "misc",
+}
+
+# Typed fields written next to the raw `details` text
+TYPED_FIELDS = (
+    "transaction_type",
+    "transaction_amount",
+    "transaction_merchant",
+    "transaction_location",
+    "transaction_items",
+    "parse_status",
+)
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_MISSING_VALUES = {"", "na", "n/a", "none", "null", "unknown", "not available"}
+
+
+def extract_json(text):
+    """Returns the first JSON object in the model output (fenced or bare), or None."""
+    if not text:
+        return None
+    fenced = _FENCE_RE.search(text)
+    candidate = fenced.group(1) if fenced else text
+
+    start = candidate.find("{")
+    if start == -1:
+        return None
+    # Walk to the matching closing brace, skipping braces inside strings
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(candidate)):
+        char = candidate[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                body = candidate[start:index + 1]
+                try:
+                    return json.loads(body)
+                except ValueError:
+                    try:
+                        return json.loads(_TRAILING_COMMA_RE.sub(r"\1", body))
+                    except ValueError:
+                        return None
+    return None
+
+
+def parse_amount(value):
+    """Normalizes an amount like 1234.5, "₹1,234.50" or "Rs. 450/-" to a float, or None."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return round(float(value), 2)
+    match = re.search(r"-?\d[\d,]*(?:\.\d+)?", str(value))
+    if not match:
+        return None
+    try:
+        return round(float(match.group(0).replace(",", "")), 2)
+    except ValueError:
+        return None
+
+
+def normalize_category(value):
+    """Maps the model's category to one of CATEGORIES, falling back to "misc"."""
+    category = str(value or "").strip().lower()
+    if category in CATEGORIES:
+        return category
+    if category in CATEGORY_ALIASES:
+        return CATEGORY_ALIASES[category]
+    for word in re.findall(r"[a-z]+", category):
+        if word in CATEGORIES:
+            return word
+        if word in CATEGORY_ALIASES:
+            return CATEGORY_ALIASES[word]
+    return "misc"
+
+
+def _text_or_none(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return None if text.lower() in _MISSING_VALUES else text
+
+
+def parse_details(text):
+    """
+    Parses the raw extraction text into typed transaction fields (see TYPED_FIELDS).
+    parse_status is "ok" when category and amount were found, "partial" when
+    only some fields could be read and "failed" when no JSON was found.
+    """
+    data = extract_json(text)
+    if not isinstance(data, dict):
+        return {field: None for field in TYPED_FIELDS} | {"parse_status": "failed"}
+
+    details = data.get("details", data)
+    if not isinstance(details, dict):
+        details = data
+
+    raw_type = details.get("transaction_type")
+    amount = parse_amount(details.get("transaction_amount", details.get("trasaction_amount")))
+    items = details.get("transaction_details")
+    if isinstance(items, (dict, list)):
+        items = json.dumps(items, ensure_ascii=False)
+
+    return {
+        "transaction_type": normalize_category(raw_type),
+        "transaction_amount": amount,
+        "transaction_merchant": _text_or_none(details.get("transaction_merchant")),
+        "transaction_location": _text_or_none(details.get("transaction_location")),
+        "transaction_items": _text_or_none(items),
+        "parse_status": "ok" if raw_type and amount is not None else "partial",
+    }
+
+
+def parse_confidence(value):
+    """The model's confidence as a fraction (0.85 or "85%" -> 0.85), or None."""
+    confidence = parse_amount(value)
+    if confidence is None or confidence < 0:
+        return None
+    return confidence / 100 if confidence > 1 else confidence
+
+
+def extraction_problems(text, min_confidence=0.0):
+    """
+    Why an extraction is not good enough to store as is: no JSON, no category,
+    no amount or one that is not positive, or a confidence the model reported
+    below `min_confidence`. Empty when it is fine.
+    """
+    data = extract_json(text)
+    if not isinstance(data, dict):
+        return ["no JSON"]
+    details = data.get("details", data)
+    if not isinstance(details, dict):
+        details = data
+
+    problems = []
+    if not _text_or_none(details.get("transaction_type")):
+        problems.append("no category")
+    amount = parse_amount(details.get("transaction_amount", details.get("trasaction_amount")))
+    if amount is None:
+        problems.append("no amount")
+    elif amount <= 0:
+        problems.append(f"amount {amount}")
+    confidence = parse_confidence(details.get("confidence", data.get("confidence")))
+    if confidence is not None and confidence < min_confidence:
+        problems.append(f"confidence {confidence:.2f}")
+    return problems
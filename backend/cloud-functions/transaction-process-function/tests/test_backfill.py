@@ -0,0 +1,118 @@
+import json
+
+import pytest
+
+import backfill
+
+PARSED = {"parse_status": "ok", "details": '{"transaction_type": "dining", "transaction_amount": 1}'}
+
+
+class Snapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.reference = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class Collection:
+    """Documents in id order; order_by/select/limit/start_after as the backfill chains them."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.after = None
+        self.page_size = None
+
+    def order_by(self, field):
+        assert field == "__name__"
+        return self
+
+    def select(self, fields):
+        return self
+
+    def limit(self, count):
+        query = Collection(self.documents)
+        query.page_size = count
+        return query
+
+    def start_after(self, snapshot):
+        self.after = snapshot.id
+        return self
+
+    def stream(self):
+        ids = sorted(doc_id for doc_id in self.documents if self.after is None or doc_id > self.after)
+        return [Snapshot(doc_id, self.documents[doc_id]) for doc_id in ids[:self.page_size]]
+
+
+class Pool:
+    def map(self, fn, items, chunksize=1):
+        return map(fn, items)
+
+
+class Writer:
+    def __init__(self, documents):
+        self.documents = documents
+        self.flushes = 0
+
+    def update(self, doc_id, fields):
+        self.documents[doc_id].update(fields)
+
+    def flush(self):
+        self.flushes += 1
+
+
+def receipts(count):
+    return {f"doc-{index:02d}": {"details": f'{{"transaction_type": "groceries", "transaction_amount": {index + 1}}}'}
+            for index in range(count)}
+
+
+def run(documents, checkpoint=None, cursor=None, writer=True, **options):
+    checkpoint = checkpoint or backfill.load_checkpoint(None, "sample_transactions")
+    writer = Writer(documents) if writer else None
+    scanned = backfill.backfill(Collection(documents), cursor, checkpoint, Pool(), writer, 3, 1, **options)
+    return scanned, checkpoint, writer
+
+
+def test_every_page_is_parsed_written_and_checkpointed(tmp_path):
+    documents = {**receipts(7), "doc-99": dict(PARSED)}
+    path = str(tmp_path / "checkpoint.json")
+    scanned, checkpoint, writer = run(documents, save=path)
+    assert scanned == 8 and writer.flushes == 3
+    assert (checkpoint["scanned"], checkpoint["updated"], checkpoint["last_document_id"]) == (8, 7, "doc-99")
+    assert documents["doc-06"]["transaction_amount"] == 7.0 and documents["doc-06"]["parse_status"] == "ok"
+    with open(path) as f:
+        assert json.load(f) == checkpoint
+
+
+def test_force_reparses_documents_that_already_have_fields():
+    documents = {"doc-00": dict(PARSED)}
+    assert run(documents)[1]["updated"] == 0
+    assert run(documents, force=True)[1]["updated"] == 1
+
+
+def test_an_interrupted_run_resumes_after_its_checkpoint(tmp_path):
+    documents = receipts(8)
+    path = str(tmp_path / "checkpoint.json")
+    scanned, checkpoint, _ = run(documents, save=path, limit=3)
+    assert scanned == 3 and checkpoint["last_document_id"] == "doc-02"
+
+    resumed = backfill.load_checkpoint(path, "sample_transactions")
+    scanned, checkpoint, _ = run(documents, checkpoint=resumed, cursor=Snapshot("doc-02", {}))
+    assert scanned == 5 and (checkpoint["scanned"], checkpoint["updated"]) == (8, 8)
+
+
+def test_a_dry_run_parses_without_writing():
+    documents = receipts(4)
+    scanned, checkpoint, _ = run(documents, writer=False)
+    assert scanned == 4 and checkpoint["updated"] == 4
+    assert "parse_status" not in documents["doc-00"]
+
+
+def test_a_checkpoint_of_another_collection_is_refused(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    backfill.save_checkpoint(path, backfill.load_checkpoint(None, "archive"))
+    with pytest.raises(SystemExit, match="--restart"):
+        backfill.load_checkpoint(path, "sample_transactions")
+    assert not (tmp_path / "checkpoint.json.tmp").exists()
@@ -0,0 +1,103 @@
+from io import BytesIO
+from itertools import count
+
+import pytest
+
+pytest.importorskip("functions_framework")
+pytest.importorskip("google.cloud.firestore")
+
+from flask import Request
+from werkzeug.test import EnvironBuilder
+
+import main
+from extraction_cache import ExtractionCache
+
+
+class Document:
+    ids = count()
+
+    def __init__(self):
+        self.id = f"doc-{next(self.ids)}"
+
+
+class Collection:
+    def document(self, doc_id=None):
+        return Document()
+
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+
+    def set(self, reference, data, merge=False):
+        self.db.pending.append(data)
+
+    def commit(self):
+        self.db.committed += self.db.pending
+        self.db.pending = []
+
+
+class Firestore:
+    def __init__(self):
+        self.pending = []
+        self.committed = []
+
+    def collection(self, name):
+        return Collection()
+
+    def batch(self):
+        return Batch(self)
+
+
+@pytest.fixture
+def ingested(monkeypatch):
+    """Object names passed to ingest_receipt; files whose bytes start with "bad" fail."""
+    names = []
+
+    def ingest_receipt(filename, upload, content_type):
+        names.append(filename)
+        if upload.read().startswith(b"bad"):
+            raise RuntimeError("503 Service unavailable")
+        return f"gs://{main.BUCKET_NAME}/{filename}", '{"transaction_type": "dining", "transaction_amount": 600}', "flash", {}
+
+    firestore = Firestore()
+    monkeypatch.setattr(main, "ingest_receipt", ingest_receipt)
+    monkeypatch.setattr(main, "db", type("Client", (), {"get": lambda self: firestore})())
+    monkeypatch.setattr(main.model_router, "available", lambda: True)
+    monkeypatch.setattr(main, "extraction_cache", ExtractionCache(None, "extraction_cache"))
+    return names
+
+
+def batch_request(*files):
+    return Request(EnvironBuilder(method="POST", data={
+        "file": [(BytesIO(data), name) for name, data in files],
+        "transaction_time": "1754677800000",
+        "user": "asha",
+    }).get_environ())
+
+
+def test_files_with_the_same_name_get_their_own_objects(ingested):
+    body, status, _ = main.upload_form_data_batch(batch_request(("receipt.jpg", b"one"), ("receipt.jpg", b"two")))
+    assert status == 200 and [result["status"] for result in body["results"]] == ["ok", "ok"]
+    assert len(set(ingested)) == 2 and all(name.endswith("-receipt.jpg") for name in ingested)
+    assert body["results"][0]["gcs_uri"] != body["results"][1]["gcs_uri"]
+
+
+def test_a_file_sent_twice_is_extracted_once(ingested):
+    body, status, _ = main.upload_form_data_batch(batch_request(("a.jpg", b"same"), ("b.jpg", b"same")))
+    first, copy = body["results"]
+    assert status == 200 and len(ingested) == 1
+    assert (first["status"], copy["status"]) == ("ok", "cached")
+    assert copy["document_id"] == first["document_id"] and copy["filename"] == "b.jpg"
+
+
+def test_partial_failure_answers_207_with_a_result_per_file(ingested):
+    body, status, _ = main.upload_form_data_batch(batch_request(("a.jpg", b"good"), ("b.jpg", b"bad"), ("c.jpg", b"bad too")))
+    assert status == 207 and (body["succeeded"], body["failed"]) == (1, 2)
+    assert [result["status"] for result in body["results"]] == ["ok", "error", "error"]
+    assert [result["index"] for result in body["results"]] == [0, 1, 2]
+
+
+def test_a_batch_where_every_file_fails_answers_500(ingested):
+    body, status, _ = main.upload_form_data_batch(batch_request(("a.jpg", b"bad one"), ("b.jpg", b"bad two")))
+    assert status == 500 and body["failed"] == 2
@@ -0,0 +1,87 @@
+from io import BytesIO
+
+from extraction_cache import ExtractionCache
+
+
+class Snapshot:
+    def __init__(self, data):
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class Document:
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def get(self):
+        self.store.check()
+        return Snapshot(self.store.documents.get(self.key))
+
+    def set(self, data):
+        self.store.check()
+        self.store.documents[self.key] = dict(data)
+
+
+class Firestore:
+    """LazyClient stand-in: get() returns the client itself."""
+
+    def __init__(self, fail=False):
+        self.documents = {}
+        self.fail = fail
+
+    def check(self):
+        if self.fail:
+            raise RuntimeError("Firestore unavailable")
+
+    def get(self):
+        return self
+
+    def collection(self, name):
+        assert name == "extraction_cache"
+        return self
+
+    def document(self, key):
+        return Document(self, key)
+
+
+def test_key_covers_content_user_and_version_and_rewinds_the_upload():
+    upload = BytesIO(b"receipt bytes" * 100_000)
+    key = ExtractionCache.make_key(upload, "asha", "v1")
+    assert upload.tell() == 0
+    assert key == ExtractionCache.make_key(b"receipt bytes" * 100_000, "asha", "v1")
+    assert key != ExtractionCache.make_key(upload, "ravi", "v1")
+    assert key != ExtractionCache.make_key(upload, "asha", "v2")
+    assert key != ExtractionCache.make_key(b"other receipt", "asha", "v1")
+
+
+def test_memory_serves_first_and_evicts_the_least_recently_used():
+    cache = ExtractionCache(None, "extraction_cache", max_entries=2)
+    cache.put("a", {"document_id": "1"})
+    cache.put("b", {"document_id": "2"})
+    assert cache.get("a") == {"document_id": "1"}
+    cache.put("c", {"document_id": "3"})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"document_id": "1"} and cache.get("c") == {"document_id": "3"}
+    assert cache.stats()["lru_hits"] == 3 and cache.stats()["misses"] == 1
+
+
+def test_other_instances_find_entries_in_firestore():
+    firestore = Firestore()
+    ExtractionCache(firestore, "extraction_cache").put("k", {"document_id": "1"})
+    restarted = ExtractionCache(firestore, "extraction_cache")
+    assert restarted.get("k") == {"document_id": "1"}
+    assert restarted.get("k") == {"document_id": "1"}
+    stats = restarted.stats()
+    assert (stats["firestore_hits"], stats["lru_hits"], stats["hit_rate"]) == (1, 1, 1.0)
+
+
+def test_firestore_errors_are_counted_and_treated_as_misses():
+    cache = ExtractionCache(Firestore(fail=True), "extraction_cache")
+    cache.put("k", {"document_id": "1"})
+    assert cache.get("k") == {"document_id": "1"}
+    assert cache.get("other") is None
+    assert cache.stats()["errors"] == 2 and cache.stats()["misses"] == 1
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from extraction_queue import InProcessQueue, QueueFull, create_queue
+
+FUNCTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def submit_when_free(queue, job):
+    """Submits `job` as soon as a slot frees up; slots are released after the handler returns."""
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            return queue.submit(job)
+        except QueueFull:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.001)
+
+
+def test_a_full_queue_pushes_back_until_a_job_finishes():
+    release, done = threading.Event(), []
+
+    def handler(job):
+        release.wait()
+        done.append(job["document_id"])
+
+    queue = InProcessQueue(handler, workers=1, max_pending=2)
+    queue.submit({"document_id": "a"})
+    queue.submit({"document_id": "b"})
+    with pytest.raises(QueueFull):
+        queue.submit({"document_id": "c"})
+
+    release.set()
+    submit_when_free(queue, {"document_id": "c"})
+    assert done[:2] == ["a", "b"]
+
+
+def test_a_failed_job_frees_its_slot(capsys):
+    finished = threading.Event()
+
+    def handler(job):
+        try:
+            raise RuntimeError("503 Service unavailable")
+        finally:
+            finished.set()
+
+    queue = InProcessQueue(handler, workers=1, max_pending=1)
+    queue.submit({"document_id": "a"})
+    assert finished.wait(5)
+    submit_when_free(queue, {"document_id": "b"})
+    assert "Extraction job for a failed: 503 Service unavailable" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("backend, options", [
+    ("pubsub", {"project_id": "receipts"}),
+    ("pubsub", {"topic": "extractions"}),
+    ("celery", {}),
+])
+def test_create_queue_rejects_incomplete_settings(backend, options):
+    with pytest.raises(ValueError):
+        create_queue(backend, print, **options)
+
+
+def import_main(**environ):
+    return subprocess.run([sys.executable, "-c", "import main"], cwd=FUNCTION_DIR, capture_output=True, text=True,
+                          env={**os.environ, "EXTRACTION_TOPIC": "", "EXTRACTION_QUEUE": "pubsub", **environ})
+
+
+def test_async_uploads_without_a_topic_fail_at_startup():
+    pytest.importorskip("functions_framework")
+    pytest.importorskip("google.cloud.firestore")
+    failed = import_main(ASYNC_UPLOADS_ENABLED="1", GCP_PROJECT="receipts")
+    assert failed.returncode != 0 and "EXTRACTION_TOPIC" in failed.stderr
+    assert import_main(ASYNC_UPLOADS_ENABLED="1", GCP_PROJECT="receipts", EXTRACTION_TOPIC="extractions").returncode == 0
+    assert import_main(ASYNC_UPLOADS_ENABLED="0").returncode == 0
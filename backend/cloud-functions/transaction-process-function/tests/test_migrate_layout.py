@@ -0,0 +1,126 @@
+import sys
+from collections import Counter
+
+import pytest
+
+import migrate_layout
+
+
+class Reference:
+    def __init__(self, parent=None):
+        self.parent = parent
+
+
+class Collection:
+    """A collection at `path`; `parent` is the document it hangs off, None at the top level."""
+
+    def __init__(self, db, path, parent=None):
+        self.db = db
+        self.path = path
+        self.parent = parent
+
+    def document(self, doc_id):
+        return Document(self.db, f"{self.path}/{doc_id}")
+
+    def count(self, alias=None):
+        return self
+
+    def get(self):
+        value = sum(1 for path in self.db.documents if path.rsplit("/", 1)[0] == self.path)
+        return [[type("Result", (), {"value": value})()]]
+
+
+class Document:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[1]
+
+    def collection(self, name):
+        return Collection(self.db, f"{self.path}/{name}", parent=self)
+
+
+class Snapshot:
+    def __init__(self, doc_id, data, parent):
+        self.id = doc_id
+        self._data = data
+        self.reference = Reference(parent)
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class Partition:
+    def __init__(self, snapshots):
+        self.snapshots = snapshots
+
+    def query(self):
+        return self
+
+    def stream(self):
+        return iter(self.snapshots)
+
+
+class Writer:
+    def __init__(self, db):
+        self.db = db
+        self.closed = False
+
+    def set(self, reference, data):
+        self.db.documents[reference.path] = data
+
+    def close(self):
+        self.closed = True
+
+
+class Firestore:
+    def __init__(self, documents=None):
+        self.documents = dict(documents or {})
+        self.writers = []
+
+    def collection(self, name):
+        return Collection(self, name)
+
+    def bulk_writer(self):
+        self.writers.append(Writer(self))
+        return self.writers[-1]
+
+
+def top_level(doc_id, user):
+    return Snapshot(doc_id, {"user": user} if user else {}, Collection(None, "sample_transactions"))
+
+
+def nested(doc_id, user):
+    return Snapshot(doc_id, {"user": user}, Collection(None, f"users/{user}/sample_transactions", parent=object()))
+
+
+def test_copy_partition_writes_each_document_under_its_user():
+    db = Firestore()
+    copied = migrate_layout.copy_partition(db, Partition([
+        top_level("a", "asha"), top_level("b", "team/ops"), top_level("c", None), nested("d", "asha"),
+    ]), dry_run=False)
+    assert copied == Counter({"asha": 1, "team/ops": 1, "NA": 1})
+    assert set(db.documents) == {"users/asha/transactions/a", "users/team_ops/transactions/b", "users/NA/transactions/c"}
+    assert db.writers[0].closed
+
+
+def test_a_dry_run_counts_without_writing():
+    db = Firestore()
+    assert migrate_layout.copy_partition(db, Partition([top_level("a", "asha")]), dry_run=True) == {"asha": 1}
+    assert db.documents == {} and db.writers == []
+
+
+def test_verify_reports_users_whose_counts_differ(capsys):
+    db = Firestore({
+        "sample_transactions/a": {}, "sample_transactions/b": {}, "sample_transactions/c": {},
+        "users/asha/transactions/a": {}, "users/asha/transactions/b": {},
+    })
+    assert migrate_layout.verify(db, "sample_transactions", Counter({"asha": 2, "ravi": 1}), workers=2) == ["ravi"]
+    assert "MISMATCH ravi: expected 1, found 0" in capsys.readouterr().out
+
+
+def test_a_source_named_like_the_subcollection_is_refused(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["migrate_layout.py", "--collection", "transactions"])
+    with pytest.raises(SystemExit) as exit_info:
+        migrate_layout.main()
+    assert exit_info.value.code == 2 and "can't be named 'transactions'" in capsys.readouterr().err
@@ -0,0 +1,165 @@
+import threading
+import time
+
+import pytest
+
+import model_router
+from model_router import ModelRouter, Tier, is_retryable, parse_tiers
+from receipts import extraction_problems
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"{code} from Vertex AI")
+        self.code = code
+
+
+class Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class Model:
+    """Plays `script` in order: a reply text, an exception to raise, or (seconds, text) to answer late."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        return self
+
+    def generate_content(self, contents):
+        with self._lock:
+            self.calls += 1
+            step = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        if isinstance(step, Exception):
+            raise step
+        if isinstance(step, tuple):
+            time.sleep(step[0])
+            step = step[1]
+        return Response(step)
+
+
+def validate(text):
+    return [] if text.startswith("good") else ["not good"]
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Upper bounds of the backoff delays drawn; the delays themselves are 0."""
+    drawn = []
+
+    def uniform(low, high):
+        drawn.append((low, high))
+        return 0.0
+
+    monkeypatch.setattr(model_router.random, "uniform", uniform)
+    return drawn
+
+
+def router(*tiers, **options):
+    return ModelRouter([Tier(f"tier{index}", model, deadline, hedge) for index, (model, deadline, hedge)
+                        in enumerate(tiers)], validate, **options)
+
+
+def test_parse_tiers():
+    assert parse_tiers("flash-lite=12/4, pro=40,cheap") == [("flash-lite", 12.0, 4.0), ("pro", 40.0, None),
+                                                             ("cheap", 30.0, None)]
+    with pytest.raises(ValueError):
+        parse_tiers(" , ")
+
+
+@pytest.mark.parametrize("error, expected", [
+    (TimeoutError(), True),
+    (ApiError(429), True),
+    (ApiError(503), True),
+    (ApiError(400), False),
+    (ValueError("bad"), False),
+])
+def test_is_retryable(error, expected):
+    assert is_retryable(error) is expected
+
+
+@pytest.mark.parametrize("text, min_confidence, expected", [
+    ('{"details": {"transaction_type": "dining", "trasaction_amount": 600, "confidence": 0.9}}', 0.6, []),
+    ('{"details": {"transaction_type": "dining", "trasaction_amount": 600, "confidence": "45%"}}', 0.6,
+     ["confidence 0.45"]),
+    ('{"details": {"transaction_type": "", "trasaction_amount": 0}}', 0.0, ["no category", "amount 0.0"]),
+    ('{"details": {"transaction_type": "misc", "trasaction_amount": "na"}}', 0.0, ["no amount"]),
+    ("sorry", 0.0, ["no JSON"]),
+])
+def test_extraction_problems(text, min_confidence, expected):
+    assert extraction_problems(text, min_confidence) == expected
+
+
+def test_output_that_fails_validation_goes_to_the_next_tier():
+    cheap, better = Model("meh"), Model("good answer")
+    response, name = router((cheap, 5, None), (better, 5, None)).generate(["prompt"])
+    assert (response.text, name) == ("good answer", "tier1")
+    assert (cheap.calls, better.calls) == (1, 1)
+
+
+def test_when_no_tier_validates_the_last_answer_is_kept():
+    models = router((Model("meh"), 5, None), (Model("still meh"), 5, None))
+    response, name = models.generate(["prompt"])
+    assert (response.text, name) == ("still meh", "tier1")
+    assert models.stats()["escalations"] == 2 and models.stats()["served"] == {"tier0": 0, "tier1": 1}
+
+
+def test_retryable_errors_are_retried_with_jittered_exponential_backoff(delays):
+    model = Model(ApiError(503), ApiError(429), "good answer")
+    models = router((model, 5, None), retries=2, backoff=0.5)
+    assert models.generate(["prompt"])[0].text == "good answer"
+    assert delays == [(0, 0.5), (0, 1.0)]
+    assert model.calls == 3 and models.stats()["retries"] == 2
+
+
+def test_backoff_is_capped(delays):
+    models = router((Model(ApiError(503), ApiError(503), "good"), 5, None), retries=2, backoff=3.0)
+    models.generate(["prompt"])
+    assert delays == [(0, 3.0), (0, model_router.MAX_BACKOFF_SECONDS)]
+
+
+def test_other_errors_go_straight_to_the_next_tier(delays):
+    cheap = Model(ApiError(400))
+    response, name = router((cheap, 5, None), (Model("good answer"), 5, None)).generate(["prompt"])
+    assert name == "tier1" and cheap.calls == 1 and delays == []
+
+
+def test_a_tier_that_keeps_failing_raises_the_last_error(delays):
+    models = router((Model(ApiError(503)), 5, None), retries=1)
+    with pytest.raises(ApiError):
+        models.generate(["prompt"])
+    assert models.stats()["failures"] == 1
+
+
+def test_a_call_past_its_deadline_is_abandoned(delays):
+    slow = Model((1.0, "good but late"))
+    models = router((slow, 0.05, None), (Model("good answer"), 5, None), retries=0)
+    started = time.monotonic()
+    response, name = models.generate(["prompt"])
+    assert name == "tier1" and time.monotonic() - started < 0.5
+    assert models.stats()["timeouts"] == 1
+
+
+def test_a_slow_call_is_hedged_and_the_first_answer_wins():
+    model = Model((1.0, "good but late"), "good hedged answer")
+    models = router((model, 5, 0.05))
+    started = time.monotonic()
+    assert models.generate(["prompt"])[0].text == "good hedged answer"
+    assert time.monotonic() - started < 0.5
+    assert model.calls == 2 and models.stats()["hedges"] == 1
+
+
+def test_a_failed_hedge_waits_for_the_first_call():
+    model = Model((0.2, "good first answer"), ApiError(400))
+    models = router((model, 5, 0.05))
+    assert models.generate(["prompt"])[0].text == "good first answer"
+
+
+def test_nothing_starts_once_the_budget_is_used_up(delays):
+    models = router((Model((0.2, "meh")), 5, None), (Model("good answer"), 5, None), budget=0.1)
+    with pytest.raises(TimeoutError):
+        models.generate(["prompt"])
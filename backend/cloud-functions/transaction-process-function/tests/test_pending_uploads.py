@@ -0,0 +1,84 @@
+import pytest
+
+pytest.importorskip("functions_framework")
+pytest.importorskip("google.cloud.firestore")
+
+from google.api_core.exceptions import Conflict
+
+import main
+
+
+class Snapshot:
+    def __init__(self, data):
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class Marker:
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def create(self, data):
+        if self.key in self.store:
+            raise Conflict("Document already exists")
+        self.store[self.key] = data
+
+    def get(self):
+        return Snapshot(self.store.get(self.key))
+
+    def set(self, data):
+        self.store[self.key] = data
+
+    def delete(self):
+        self.store.pop(self.key, None)
+
+
+class Firestore:
+    def __init__(self):
+        self.markers = {}
+
+    def get(self):
+        return self
+
+    def collection(self, name):
+        assert name == main.PENDING_UPLOADS_COLLECTION
+        return self
+
+    def document(self, key):
+        return Marker(self.markers, key)
+
+
+class Document:
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    firestore = Firestore()
+    monkeypatch.setattr(main, "db", firestore)
+    return firestore
+
+
+def test_the_first_upload_claims_the_content_and_a_repeat_gets_its_marker(firestore):
+    assert main.claim_pending_upload("hash", Document("first"), "asha", "2025-08-08") is None
+    existing = main.claim_pending_upload("hash", Document("second"), "asha", "2025-08-08")
+    assert existing["document_id"] == "first"
+    assert main.claim_pending_upload("other", Document("third"), "asha", "2025-08-08") is None
+
+
+def test_a_stale_marker_is_replaced(firestore):
+    main.claim_pending_upload("hash", Document("lost"), "asha", "2025-08-08")
+    firestore.markers["hash"]["created_at"] -= main.PENDING_UPLOAD_TTL_SECONDS + 1
+    assert main.claim_pending_upload("hash", Document("retry"), "asha", "2025-08-08") is None
+    assert firestore.markers["hash"]["document_id"] == "retry"
+
+
+def test_a_released_claim_can_be_taken_again(firestore):
+    main.claim_pending_upload("hash", Document("first"), "asha", "2025-08-08")
+    main.release_pending_upload("hash")
+    main.release_pending_upload(None)
+    assert main.claim_pending_upload("hash", Document("second"), "asha", "2025-08-08") is None
@@ -0,0 +1,63 @@
+from io import BytesIO
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+from preprocess import crop_to_paper, preprocess_receipt
+
+
+def receipt(size=(1200, 1600), background=None, paper_box=None, shade_from=None):
+    """A receipt with text lines down to a TOTAL line at y=1480 (in paper coordinates)."""
+    width, height = size
+    img = Image.new("L", size, background if background is not None else 235)
+    draw = ImageDraw.Draw(img)
+    left, top, right, bottom = paper_box or (0, 0, width, height)
+    for y in range(top, bottom):
+        # Lighting falls off towards the bottom of the paper
+        level = 235
+        if shade_from is not None and y - top > shade_from:
+            level = int(235 - (y - top - shade_from) * 0.12)
+        draw.line((left, y, right - 1, y), fill=level)
+    for y in range(top + 80, min(bottom, top + 1500), 100):
+        draw.rectangle((left + 100, y, right - 100, y + 20), fill=30)
+    return img
+
+
+def test_unevenly_lit_receipt_is_not_cropped():
+    img = receipt(shade_from=700)
+    assert crop_to_paper(img).size == img.size
+
+
+def test_receipt_filling_the_frame_is_not_cropped():
+    img = receipt()
+    assert crop_to_paper(img).size == img.size
+
+
+def test_receipt_on_a_dark_table_is_cropped_to_the_paper():
+    img = receipt(size=(1600, 2000), background=40, paper_box=(200, 150, 1400, 1850), shade_from=900)
+    cropped = crop_to_paper(img)
+    width, height = cropped.size
+    # The whole paper, including the shaded TOTAL line, plus the margin
+    assert 1200 <= width <= 1300
+    assert 1700 <= height <= 1800
+
+
+def test_preprocess_crops_only_when_asked():
+    buffer = BytesIO()
+    receipt(size=(1600, 2000), background=40, paper_box=(200, 150, 1400, 1850)).convert("RGB").save(
+        buffer, "JPEG", quality=95
+    )
+    data = buffer.getvalue()
+    _, _, info = preprocess_receipt(data)
+    assert info["processed_size"] == (1280, 1600)
+    _, _, info = preprocess_receipt(data, crop=True)
+    assert info["processed_size"][1] == 1600
+    assert info["processed_size"][0] < 1280
+
+
+def test_undecodable_upload_is_returned_unchanged():
+    data = b"not an image"
+    processed, content_type, info = preprocess_receipt(data)
+    assert processed is data and content_type is None and "skipped" in info
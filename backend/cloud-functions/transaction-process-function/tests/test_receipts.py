@@ -0,0 +1,84 @@
+import pytest
+
+from receipts import TYPED_FIELDS, extract_json, normalize_category, parse_amount, parse_details
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('```json\n{"details": {"transaction_type": "dining"}}\n```', {"details": {"transaction_type": "dining"}}),
+    ('Here you go: {"a": 1} and {"b": 2}', {"a": 1}),
+    ('{"note": "a } inside a string", "a": 1}', {"note": "a } inside a string", "a": 1}),
+    ('{"items": [1, 2,], "a": 1,}', {"items": [1, 2], "a": 1}),
+    ('{"details": {"merchant": "Joe\'s \\"Diner\\" {1}", "tax": {"gst": 18}}} trailing',
+     {"details": {"merchant": 'Joe\'s "Diner" {1}', "tax": {"gst": 18}}}),
+    ("no JSON here", None),
+    ('{"unterminated": ', None),
+    ("", None),
+])
+def test_extract_json(text, expected):
+    assert extract_json(text) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1234.5, 1234.5),
+    (12, 12.0),
+    ("₹1,234.50", 1234.5),
+    ("Rs. 450/-", 450.0),
+    ("-20.50", -20.5),
+    ("na", None),
+    (None, None),
+    (True, None),
+])
+def test_parse_amount(value, expected):
+    assert parse_amount(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("Groceries", "groceries"),
+    ("supermarket", "groceries"),
+    ("Food & Drinks", "dining"),
+    ("medical bills", "health"),
+    ("Groceries & Household", "groceries"),
+    ("Pharmacy purchase", "health"),
+    ("travel", "misc"),
+    (None, "misc"),
+])
+def test_normalize_category(value, expected):
+    assert normalize_category(value) == expected
+
+
+def test_parse_details_reads_typed_fields_and_the_misspelled_amount():
+    text = ('```json\n{"details": {"transaction_type": "Restaurant", "trasaction_amount": "₹ 600", '
+            '"transaction_merchant": "Truffles", "transaction_location": "N/A", '
+            '"transaction_details": ["Burger", "Coke"]}}\n```')
+    assert parse_details(text) == {
+        "transaction_type": "dining",
+        "transaction_amount": 600.0,
+        "transaction_merchant": "Truffles",
+        "transaction_location": None,
+        "transaction_items": '["Burger", "Coke"]',
+        "parse_status": "ok",
+    }
+
+
+def test_parse_details_without_an_amount_is_partial():
+    details = parse_details('{"transaction_type": "utility", "transaction_amount": "unknown"}')
+    assert details["transaction_amount"] is None and details["parse_status"] == "partial"
+
+
+def test_parse_details_without_json_fails():
+    details = parse_details("The image is not a receipt.")
+    assert details["parse_status"] == "failed"
+    assert details["transaction_type"] is None and details["transaction_amount"] is None
+
+
+def test_parse_details_reads_json_without_the_details_wrapper():
+    details = parse_details('{"transaction_type": "Movies", "transaction_amount": 450, '
+                            '"transaction_details": {"tickets": 2, "seat": "Ré 12"}}')
+    assert (details["transaction_type"], details["transaction_amount"]) == ("entertainment", 450.0)
+    assert details["transaction_items"] == '{"tickets": 2, "seat": "Ré 12"}'
+
+
+@pytest.mark.parametrize("text", ['{"details": {"transaction_type": "dining", "trasaction_amount": 1}}',
+                                  '{"transaction_type": "dining"}', "no JSON"])
+def test_parse_details_always_returns_every_typed_field(text):
+    assert tuple(parse_details(text)) == TYPED_FIELDS
@@ -0,0 +1,41 @@
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("functions_framework")
+pytest.importorskip("google.cloud.firestore")
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.test import EnvironBuilder
+
+import main
+
+
+def form_request(size, chunked=False):
+    environ = EnvironBuilder(method="POST", data={
+        "file": (BytesIO(b"x" * size), "receipt.jpg"),
+        "transaction_time": "1754677800000",
+        "user": "asha",
+    }).get_environ()
+    if chunked:
+        # What the server hands over for Transfer-Encoding: chunked
+        del environ["CONTENT_LENGTH"]
+        environ["wsgi.input_terminated"] = True
+    return Request(environ)
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_parse_form_stops_reading_past_the_limit(chunked):
+    with pytest.raises(RequestEntityTooLarge):
+        main.parse_form(form_request(10_000, chunked), 5_000)
+    files, form = main.parse_form(form_request(1_000, chunked), 5_000)
+    assert files["file"].read() == b"x" * 1_000 and form["user"] == "asha"
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_oversized_uploads_get_413(chunked, monkeypatch):
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 5_000)
+    monkeypatch.setattr(main, "BATCH_MAX_BYTES", 5_000)
+    assert main.upload_form_data(form_request(100_000, chunked))[1] == 413
+    assert main.upload_form_data_batch(form_request(100_000, chunked))[1] == 413
@@ -0,0 +1,193 @@
+"""
+Per-request stage timings, returned as a Server-Timing header and logged as
+one JSON line per request.
+
+`traced(name)` wraps an entry point. While it runs, `stage("model")` times a
+block, `record(name, seconds)` adds a timing measured elsewhere (another
+thread, an existing timings dict), and `annotate(**fields)` adds fields such
+as token counts to the log line. Outside a traced request, or with
+TRACING_ENABLED=0, these do nothing.
+
+Cloud Logging turns JSON lines on stdout into structured entries. "severity"
+and "message" are its own fields. "logging.googleapis.com/trace" links the
+entry to the request's trace when the X-Cloud-Trace-Context header is present.
+
+A streamed reply's header can only hold the stages before the stream starts.
+Its log line is written when the stream ends and covers the whole request.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+ENABLED = os.environ.get("TRACING_ENABLED", "1") == "1"
+
+_local = threading.local()
+
+
+class Trace:
+    def __init__(self, function, request_id, trace_id=None):
+        self.function = function
+        self.request_id = request_id
+        self.trace_id = trace_id
+        self.started = time.perf_counter()
+        # Stage name -> seconds; a stage that runs more than once is summed
+        self.stages = {}
+        self.fields = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def annotate(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        with self._lock:
+            stages = list(self.stages.items())
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def log(self, status):
+        with self._lock:
+            stages = {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+            fields = dict(self.fields)
+        total_ms = round(self.elapsed() * 1000, 1)
+        entry = {
+            "severity": "ERROR" if status >= 500 else "WARNING" if status >= 400 else "INFO",
+            "message": f"{self.function} {status} in {total_ms}ms",
+            "function": self.function,
+            "request_id": self.request_id,
+            "status": status,
+            "total_ms": total_ms,
+            "stages_ms": stages,
+            **fields,
+        }
+        project = os.environ.get("GCP_PROJECT")
+        if self.trace_id and project:
+            entry["logging.googleapis.com/trace"] = f"projects/{project}/traces/{self.trace_id}"
+        print(json.dumps(entry, default=str))
+
+
+def current():
+    """The trace of the request running on this thread, or None."""
+    return getattr(_local, "trace", None)
+
+
+def stage(name):
+    trace = current()
+    return trace.stage(name) if trace else nullcontext()
+
+
+def record(name, seconds):
+    trace = current()
+    if trace:
+        trace.record(name, seconds)
+
+
+def annotate(**fields):
+    trace = current()
+    if trace:
+        trace.annotate(**fields)
+
+
+def request_ids(request):
+    """(request id, Cloud Trace id or None) from the request headers."""
+    trace_context = request.headers.get("X-Cloud-Trace-Context", "")
+    trace_id = trace_context.split("/", 1)[0] or None
+    return request.headers.get("X-Request-Id") or trace_id or uuid.uuid4().hex, trace_id
+
+
+def _with_headers(headers, trace):
+    headers = dict(headers or {})
+    exposed = [name.strip() for name in headers.get("Access-Control-Expose-Headers", "").split(",") if name.strip()]
+    headers["Access-Control-Expose-Headers"] = ", ".join(exposed + ["Server-Timing", "X-Request-Id"])
+    # Lets the browser read Server-Timing on cross-origin responses
+    headers["Timing-Allow-Origin"] = "*"
+    headers["Server-Timing"] = trace.server_timing()
+    headers["X-Request-Id"] = trace.request_id
+    return headers
+
+
+def _stream(trace, chunks, status):
+    """Yields a streamed body with the trace active while each chunk is produced, then logs."""
+    iterator = iter(chunks)
+    try:
+        while True:
+            _local.trace = trace
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _local.trace = None
+            yield chunk
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
+        trace.log(status)
+
+
+def finish(trace, response):
+    """Adds the trace headers to a handler's return value and logs the request."""
+    if isinstance(response, tuple):
+        body, status, *rest = response
+        headers = _with_headers(rest[0] if rest else None, trace)
+        trace.log(status)
+        return (body, status, headers)
+
+    # A flask Response; streamed bodies are logged once the stream ends
+    for name, value in _with_headers({
+        "Access-Control-Expose-Headers": response.headers.get("Access-Control-Expose-Headers", "")
+    }, trace).items():
+        response.headers[name] = value
+    if response.is_streamed:
+        response.response = _stream(trace, response.response, response.status_code)
+    else:
+        trace.log(response.status_code)
+    return response
+
+
+def traced(function):
+    """Decorator for an HTTP entry point; CORS preflights are not traced."""
+    def decorator(handler):
+        if not ENABLED:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(request):
+            if request.method == "OPTIONS":
+                return handler(request)
+            request_id, trace_id = request_ids(request)
+            trace = Trace(function, request_id, trace_id)
+            _local.trace = trace
+            try:
+                response = handler(request)
+            except Exception:
+                trace.log(500)
+                raise
+            finally:
+                _local.trace = None
+            return finish(trace, response)
+
+        return wrapper
+
+    return decorator
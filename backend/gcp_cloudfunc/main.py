@@ -1,6 +1,23 @@
+import os
+
 from firebase_functions import firestore_fn
 from firebase_admin import initialize_app, firestore
 
+from rollups import apply_change
+
+DATABASE = "receipt-management"
+# Collection the transaction-process function writes receipts to
+TRANSACTIONS_COLLECTION = "sample_transactions"
+# Follow transaction-process's TRANSACTIONS_LAYOUT: "per_user" stores receipts
+# under users/{user}/transactions instead of the flat collection
+TRANSACTIONS_LAYOUT = os.environ.get("TRANSACTIONS_LAYOUT", "flat")
+TRANSACTIONS_DOCUMENT = (
+    "users/{userId}/transactions/{transactionId}" if TRANSACTIONS_LAYOUT == "per_user"
+    else TRANSACTIONS_COLLECTION + "/{transactionId}"
+)
+
+initialize_app()
+
 
 @firestore_fn.on_document_created(
     document="transactions/{transactionId}", # Example collection
@@ -12,6 +29,12 @@ def add_status_to_transaction(event: firestore_fn.Event[firestore_fn.DocumentSna
 
     print(f"New transaction created in 'receipt-management': {transaction_id}")
 
+    # Async uploads from transaction-process are created with a status already;
+    # don't overwrite it (the extraction worker may have moved it on to done/failed)
+    if event.data.to_dict().get("status"):
+        print(f"Transaction {transaction_id} already has a status, skipping")
+        return None
+
     data_to_add = {
         "status": "pending",
         "processedBy": "cloudFunction"
@@ -23,4 +46,32 @@ def add_status_to_transaction(event: firestore_fn.Event[firestore_fn.DocumentSna
     except Exception as e:
         print(f"Error adding status to transaction {transaction_id}: {e}")
         raise
-    return None
\ No newline at end of file
+    return None
+
+
+@firestore_fn.on_document_written(
+    document=TRANSACTIONS_DOCUMENT,
+    database=DATABASE
+)
+def maintain_spend_rollups(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]):
+    """
+    Keeps the per-user, per-day spend rollups (see rollups.py) in step with the
+    transactions collection on every create, update and delete, so range
+    summaries read one document per day instead of every transaction.
+    """
+    transaction_id = event.params["transactionId"]
+    before = event.data.before.to_dict() if event.data.before else None
+    after = event.data.after.to_dict() if event.data.after else None
+
+    db = firestore.client(database_id=DATABASE)
+
+    @firestore.transactional
+    def update_rollups(transaction):
+        apply_change(transaction, db, transaction_id, before, after)
+
+    try:
+        update_rollups(db.transaction())
+    except Exception as e:
+        print(f"Error updating spend rollups for transaction {transaction_id}: {e}")
+        raise
+    return None
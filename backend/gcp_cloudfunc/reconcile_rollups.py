@@ -0,0 +1,122 @@
+"""
+Rebuilds the spend rollups from the raw transactions collection and verifies
+them against what the maintain_spend_rollups trigger has written.
+
+Reports every user/day whose stored rollup differs from the rebuilt one
+(missing, stale, or with different transactions/totals). With --fix the
+rebuilt rollups are written back and stale days are deleted.
+
+    python reconcile_rollups.py
+    python reconcile_rollups.py --fix
+    python reconcile_rollups.py --emulator localhost:8080 --fix
+    python reconcile_rollups.py --layout per_user
+    python reconcile_rollups.py --shards 8 --fix   # after changing ROLLUP_SHARDS
+"""
+import argparse
+import os
+import time
+
+from rollups import DAYS_SUBCOLLECTION, ROLLUP_SHARDS, contribution, day_ref, shard_of, summarize, user_key
+
+DATABASE = "receipt-management"
+TRANSACTIONS_COLLECTION = "sample_transactions"
+USERS_COLLECTION = "users"
+USER_TRANSACTIONS_SUBCOLLECTION = "transactions"
+BATCH_SIZE = 400
+
+
+def transaction_docs(db, collection, layout, fields):
+    if layout != "per_user":
+        return db.collection(collection).select(fields).stream()
+    # users/{user}/transactions only; other collections may share the "transactions" id
+    return (
+        doc for doc in db.collection_group(USER_TRANSACTIONS_SUBCOLLECTION).select(fields).stream()
+        if doc.reference.parent.parent is not None and doc.reference.parent.parent.parent.id == USERS_COLLECTION
+    )
+
+
+def rebuild(db, collection, layout="flat", shards=ROLLUP_SHARDS):
+    """{(user, date, shard): rollup document} computed from scratch."""
+    days = {}
+    fields = ["user", "transaction_time", "transaction_amount", "transaction_type"]
+    for doc in transaction_docs(db, collection, layout, fields):
+        side = contribution(doc.to_dict())
+        if side:
+            user, date, entry = side
+            days.setdefault((user, date, shard_of(doc.id, shards)), {})[doc.id] = entry
+    return {key: summarize(key[0], key[1], transactions) for key, transactions in days.items()}
+
+
+def stored(db):
+    """{(user_key, document id): (reference, rollup document)} for every stored rollup shard."""
+    return {
+        (doc.reference.parent.parent.id, doc.id): (doc.reference, doc.to_dict())
+        for doc in db.collection_group(DAYS_SUBCOLLECTION).stream()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default=TRANSACTIONS_COLLECTION)
+    parser.add_argument("--database", default=DATABASE)
+    parser.add_argument("--layout", choices=("flat", "per_user"), default="flat",
+                        help="where transactions are stored (TRANSACTIONS_LAYOUT)")
+    parser.add_argument("--emulator", help="host:port of a Firestore emulator")
+    parser.add_argument("--shards", type=int, default=ROLLUP_SHARDS,
+                        help="shards per user-day (ROLLUP_SHARDS of the trigger)")
+    parser.add_argument("--fix", action="store_true", help="write the rebuilt rollups back")
+    args = parser.parse_args()
+
+    if args.emulator:
+        os.environ["FIRESTORE_EMULATOR_HOST"] = args.emulator
+
+    import firebase_admin
+    from firebase_admin import firestore
+
+    firebase_admin.initialize_app()
+    db = firestore.client(database_id=args.database)
+
+    started = time.perf_counter()
+    expected = rebuild(db, args.collection, args.layout, args.shards)
+    actual = stored(db)
+    print(f"Rebuilt {len(expected)} user-day shards, found {len(actual)} stored, "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    writes = []
+    expected_keys = set()
+    for (user, date, shard), rollup in expected.items():
+        reference = day_ref(db, user, date, shard)
+        key = (user_key(user), reference.id)
+        expected_keys.add(key)
+        current = actual.get(key)
+        if current is None:
+            print(f"MISSING  {user} {reference.id}: {rollup['count']} transactions, total {rollup['total']}")
+        elif current[1] != rollup:
+            print(f"MISMATCH {user} {reference.id}: stored {current[1].get('count')} / {current[1].get('total')}, "
+                  f"expected {rollup['count']} / {rollup['total']}")
+        else:
+            continue
+        writes.append(("set", reference, rollup))
+
+    for key, (reference, rollup) in actual.items():
+        if key not in expected_keys:
+            print(f"STALE    {rollup.get('user')} {key[1]}: no transactions left for this shard")
+            writes.append(("delete", reference, None))
+
+    print(f"{len(writes)} user-day shards out of sync")
+    if not args.fix or not writes:
+        return
+
+    for start in range(0, len(writes), BATCH_SIZE):
+        batch = db.batch()
+        for action, reference, rollup in writes[start:start + BATCH_SIZE]:
+            if action == "set":
+                batch.set(reference, rollup)
+            else:
+                batch.delete(reference)
+        batch.commit()
+    print(f"Fixed {len(writes)} user-day shards")
+
+
+if __name__ == "__main__":
+    main()
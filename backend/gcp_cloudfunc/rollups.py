@@ -0,0 +1,136 @@
+"""
+Per-user, per-day spend rollups maintained from the transactions collection.
+
+A user's day is split over ROLLUP_SHARDS documents at
+spend_rollups/{user}/days/{YYYY-MM-DD}_{shard}, and a transaction always goes
+to the shard picked by its id. A batch upload writes many receipts with the
+same transaction_time at once; with a single document per day their trigger
+transactions would all contend for it. Each shard keeps the contribution of
+its transactions keyed by transaction id, next to the totals derived from them:
+
+    {
+        "user": "adarsh.shaw",
+        "date": "2025-07-25",
+        "count": 4,
+        "total": 1240.5,
+        "unparsed_count": 1,
+        "by_category": {"groceries": {"count": 2, "total": 1000.5}, ...},
+        "transactions": {"<transaction id>": {"amount": 500.0, "category": "groceries"}, ...}
+    }
+
+The counts follow get-user-data's aggregation path: `count` is every
+transaction of the day, including ones without an amount (still pending or
+unparsed), which are also counted in `unparsed_count`. `by_category` counts
+the transactions that have a category, with or without an amount.
+
+Keying contributions by transaction id makes applying a change idempotent, so
+redelivered trigger events and the reconciliation job can't double count.
+Readers select the shards by their `date` field and add them up.
+"""
+import os
+import zlib
+
+ROLLUPS_COLLECTION = "spend_rollups"
+DAYS_SUBCOLLECTION = "days"
+# Changing this needs `reconcile_rollups.py --fix` to move the existing rollups
+ROLLUP_SHARDS = int(os.environ.get("ROLLUP_SHARDS", "4"))
+
+
+def user_key(user):
+    """Document id for a user's rollups ("/" is not allowed in document ids)."""
+    return str(user).replace("/", "_")
+
+
+def shard_of(transaction_id, shards=None):
+    """Shard of a user's day that a transaction's contribution goes to; stable across processes."""
+    return zlib.crc32(transaction_id.encode("utf-8")) % (shards or ROLLUP_SHARDS)
+
+
+def contribution(data):
+    """
+    (user, date, {"amount", "category"}) for a transaction document's data, or
+    None when it doesn't count towards rollups (deleted, or without a user or
+    time). Amount and category are None until the receipt has been extracted.
+    """
+    if not data:
+        return None
+    user = data.get("user")
+    transaction_time = data.get("transaction_time")
+    if not user or transaction_time is None:
+        return None
+    amount = data.get("transaction_amount")
+    return user, transaction_time.date().isoformat(), {
+        "amount": float(amount) if amount is not None else None,
+        "category": data.get("transaction_type"),
+    }
+
+
+def summarize(user, date, transactions):
+    """Full rollup document for a day's shard from its per-transaction contributions."""
+    by_category = {}
+    total = 0.0
+    unparsed = 0
+    for entry in transactions.values():
+        amount = entry["amount"]
+        if amount is None:
+            unparsed += 1
+        else:
+            total += amount
+        if entry["category"]:
+            category = by_category.setdefault(entry["category"], {"count": 0, "total": 0.0})
+            category["count"] += 1
+            category["total"] = round(category["total"] + (amount or 0.0), 2)
+    return {
+        "user": user,
+        "date": date,
+        "count": len(transactions),
+        "total": round(total, 2),
+        "unparsed_count": unparsed,
+        "by_category": by_category,
+        "transactions": transactions,
+    }
+
+
+def day_ref(db, user, date, shard):
+    return (
+        db.collection(ROLLUPS_COLLECTION).document(user_key(user))
+        .collection(DAYS_SUBCOLLECTION).document(f"{date}_{shard}")
+    )
+
+
+def apply_change(transaction, db, transaction_id, before, after):
+    """
+    Moves a transaction's contribution from its old day (before) to its new day
+    (after) inside a Firestore transaction. Either side may be None (create/delete).
+    Both sides are in the transaction's shard of their day.
+    """
+    old = contribution(before)
+    new = contribution(after)
+    if old == new:
+        return
+
+    shard = shard_of(transaction_id)
+    days = {}
+    for side in (old, new):
+        if side:
+            user, date, _ = side
+            days[(user, date)] = day_ref(db, user, date, shard)
+
+    # Firestore transactions need all reads before any write
+    current = {}
+    for key, ref in days.items():
+        snapshot = ref.get(transaction=transaction)
+        current[key] = dict((snapshot.to_dict() or {}).get("transactions") or {}) if snapshot.exists else {}
+
+    if old:
+        user, date, _ = old
+        current[(user, date)].pop(transaction_id, None)
+    if new:
+        user, date, entry = new
+        current[(user, date)][transaction_id] = entry
+
+    for (user, date), transactions in current.items():
+        if transactions:
+            transaction.set(days[(user, date)], summarize(user, date, transactions))
+        else:
+            transaction.delete(days[(user, date)])
@@ -0,0 +1,101 @@
+from datetime import datetime, timezone
+
+from rollups import apply_change, contribution, day_ref, shard_of, summarize
+
+
+class Snapshot:
+    def __init__(self, data):
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class Ref:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        self.id = path.rsplit("/", 1)[1]
+
+    def collection(self, name):
+        return Ref(self.store, f"{self.path}/{name}")
+
+    def document(self, doc_id):
+        return Ref(self.store, f"{self.path}/{doc_id}")
+
+    def get(self, transaction=None):
+        return Snapshot(self.store.get(self.path))
+
+
+class Db:
+    def __init__(self):
+        self.store = {}
+
+    def collection(self, name):
+        return Ref(self.store, f"/{name}")
+
+
+class Transaction:
+    def __init__(self, store):
+        self.store = store
+
+    def set(self, ref, data):
+        self.store[ref.path] = data
+
+    def delete(self, ref):
+        self.store.pop(ref.path, None)
+
+
+def receipt(amount=100.0, category="groceries", day=25):
+    return {
+        "user": "adarsh.shaw",
+        "transaction_time": datetime(2025, 7, day, 12, tzinfo=timezone.utc),
+        "transaction_amount": amount,
+        "transaction_type": category,
+    }
+
+
+def test_pending_receipts_count_without_an_amount():
+    assert contribution(receipt(amount=None, category=None)) == (
+        "adarsh.shaw", "2025-07-25", {"amount": None, "category": None}
+    )
+    assert contribution({"transaction_time": datetime(2025, 7, 25, tzinfo=timezone.utc)}) is None
+    assert contribution(None) is None
+
+
+def test_summary_counts_like_the_aggregation_path():
+    rollup = summarize("adarsh.shaw", "2025-07-25", {
+        "a": {"amount": 100.0, "category": "groceries"},
+        "b": {"amount": None, "category": "groceries"},
+        "c": {"amount": None, "category": None},
+        "d": {"amount": 20.5, "category": "dining"},
+    })
+    assert rollup["count"] == 4
+    assert rollup["total"] == 120.5
+    assert rollup["unparsed_count"] == 2
+    assert rollup["by_category"] == {"groceries": {"count": 2, "total": 100.0}, "dining": {"count": 1, "total": 20.5}}
+
+
+def test_shards_are_stable_and_spread_transactions():
+    assert shard_of("abc", 4) == shard_of("abc", 4)
+    assert len({shard_of(f"doc{i}", 4) for i in range(100)}) == 4
+
+
+def test_apply_change_moves_a_transaction_within_its_shard():
+    db = Db()
+    transaction = Transaction(db.store)
+    apply_change(transaction, db, "t1", None, receipt(amount=None, category=None))
+    apply_change(transaction, db, "t1", receipt(amount=None, category=None), receipt(amount=40.0, day=26))
+
+    shard = shard_of("t1")
+    assert day_ref(db, "adarsh.shaw", "2025-07-25", shard).path not in db.store
+    rollup = db.store[day_ref(db, "adarsh.shaw", "2025-07-26", shard).path]
+    assert (rollup["count"], rollup["total"], rollup["unparsed_count"]) == (1, 40.0, 0)
+
+    # Redelivered events don't double count
+    apply_change(transaction, db, "t1", None, receipt(amount=40.0, day=26))
+    assert db.store[day_ref(db, "adarsh.shaw", "2025-07-26", shard).path]["count"] == 1
+
+    apply_change(transaction, db, "t1", receipt(amount=40.0, day=26), None)
+    assert db.store == {}
@@ -0,0 +1,76 @@
+"""
+Loads the cloud functions' main.py files side by side in one process, for the
+service mode and the benchmarks.
+"""
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import os
+import sys
+import types
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cloud-functions")
+
+
+class FunctionImporter(importlib.abc.MetaPathFinder):
+    """
+    While a function's main.py is being executed, resolves top-level imports of the
+    modules next to it (`clients`, `tracing`, ...) to copies named
+    <package>.<module>, so every function gets its own helpers even where the
+    file names are the same.
+    """
+
+    def __init__(self, package, source_dir):
+        self.package = package
+        self.source_dir = source_dir
+        self.names = {name[:-3] for name in os.listdir(source_dir) if name.endswith(".py") and name != "main.py"}
+
+    def find_spec(self, fullname, path=None, target=None):
+        if path is not None or fullname not in self.names:
+            return None
+        qualified = f"{self.package}.{fullname}"
+        path = os.path.join(self.source_dir, f"{fullname}.py")
+        return importlib.util.spec_from_file_location(qualified, path, loader=LocalLoader(qualified, path))
+
+
+class LocalLoader(importlib.machinery.SourceFileLoader):
+    def exec_module(self, module):
+        # Later imports of the short name while the same function loads find this copy
+        sys.modules[module.__name__.rpartition(".")[2]] = module
+        super().exec_module(module)
+
+
+def load_function(directory, package=None):
+    """
+    Imports <cloud-functions>/<directory>/main.py once, as <package>.main, with its
+    helper modules under the same package. The function dirs each have their own
+    clients.py, tracing.py and singleflight.py; resolved through a shared sys.path
+    they would all get the first function's copies.
+    """
+    package = package or "functions_" + directory.replace("-", "_")
+    module_name = f"{package}.main"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    source_dir = os.path.join(FUNCTIONS_DIR, directory)
+    sys.modules[package] = types.ModuleType(package)
+    sys.modules[package].__path__ = [source_dir]
+
+    importer = FunctionImporter(package, source_dir)
+    # Short names already imported belong to another function (or nothing); hide them
+    hidden = {name: sys.modules.pop(name) for name in importer.names if name in sys.modules}
+    sys.meta_path.insert(0, importer)
+    try:
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(source_dir, "main.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except Exception:
+            del sys.modules[module_name]
+            raise
+    finally:
+        sys.meta_path.remove(importer)
+        for name in importer.names:
+            sys.modules.pop(name, None)
+        sys.modules.update(hidden)
+    return module
@@ -0,0 +1,242 @@
+"""
+Service mode: upload_form_data, get_user_data and query_gemini behind one
+threaded ASGI wrapper.
+
+Deployed as Cloud Functions, each instance handles one request at a time and
+spends most of it waiting on Vertex AI or Firestore. This wrapper imports the
+three functions' main.py unchanged and serves their synchronous handlers from
+one process on worker threads. It does not use the async Firestore or Vertex AI
+clients:
+
+- Each function is loaded as a package of its own (function_loader.py), so
+  their same-named helper modules don't collide.
+- Each request runs its handler on a worker thread, so one process keeps many
+  model and Firestore calls in flight. The client libraries release the GIL
+  while they wait on the network, but they block the thread. Only the request
+  plumbing (admission, body reads, response writes) runs on the event loop.
+- Every endpoint has its own limit on requests in flight (streamed replies
+  count until the stream ends) and on requests waiting for a slot. Beyond
+  that it answers 503 with Retry-After, so a burst of uploads can't starve
+  chat replies. The limit is also the size of the endpoint's thread pool,
+  and the threads are what actually cap concurrency.
+- The endpoints share one Firestore client, and the Cloud Storage client's
+  HTTP pool is sized for the upload limit.
+
+The handlers stay synchronous, so the functions-framework entry points work
+as before and each endpoint's logic exists once.
+
+From the repository root:
+
+    pip install -r backend/service/requirements.txt
+    uvicorn --factory --app-dir backend/service threaded_app:create_app --port 8080
+"""
+import os
+import sys
+import tempfile
+
+import anyio
+from flask import Flask
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from function_loader import load_function
+
+# Path -> (function directory, entry point, default limit on requests in flight).
+# Override with <ENTRY_POINT>_CONCURRENCY and <ENTRY_POINT>_MAX_WAITING, e.g.
+# QUERY_GEMINI_CONCURRENCY. Uploads also spend CPU on preprocessing, so they get fewer.
+ENDPOINTS = {
+    "/transaction-process": ("transaction-process-function", "upload_form_data", 16),
+    "/get-user-data": ("get-user-data-function", "get_user_data", 64),
+    "/query-gemini": ("query-gemini-function", "query_gemini", 128),
+}
+METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+
+# Request bodies above SPOOL_BYTES go to a temp file, like werkzeug does for
+# multipart files; above SERVICE_MAX_BODY_BYTES they get 413
+SPOOL_BYTES = 512 * 1024
+MAX_BODY_BYTES = int(os.environ.get("SERVICE_MAX_BODY_BYTES", str(32 * 1024 * 1024)))
+
+# Turns the handlers' return values into responses, as functions-framework does
+flask_app = Flask(__name__)
+
+
+def share_clients(modules, upload_limit):
+    """
+    Points every function's Firestore LazyClient at one shared client, and
+    gives the Cloud Storage client an HTTP pool as large as the upload limit.
+    """
+    upload = modules["transaction-process-function"]
+    firestore = upload.LazyClient("shared Firestore client", upload.create_firestore_client)
+
+    def shared_firestore():
+        client = firestore.get()
+        if client is None:
+            raise RuntimeError("the shared Firestore client is not available")
+        return client
+
+    def create_storage_client():
+        from requests.adapters import HTTPAdapter
+
+        client = upload.create_storage_client()
+        # requests keeps 10 connections per host; concurrent uploads would open and drop the rest
+        client._http.mount("https://", HTTPAdapter(pool_connections=upload_limit, pool_maxsize=upload_limit))
+        return client
+
+    for module in modules.values():
+        module.db.factory = shared_firestore
+    upload.storage_client.factory = create_storage_client
+
+
+def wsgi_environ(scope, body, length):
+    """The WSGI environ of an ASGI HTTP request whose body has been read into `body`."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name == "CONTENT_LENGTH":
+            continue
+        key = name if name == "CONTENT_TYPE" else f"HTTP_{name}"
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class Endpoint:
+    """
+    ASGI app for one entry point. At most `limit` requests run at once and
+    `max_waiting` more wait for a slot; the rest get 503.
+    """
+
+    def __init__(self, name, handler, limit, max_waiting):
+        self.name = name
+        self.handler = handler
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.slots = anyio.Semaphore(limit)
+        # A request uses at most one worker thread at a time
+        self.threads = anyio.CapacityLimiter(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.counters = {"requests": 0, "rejected": 0, "peak_in_flight": 0}
+
+    async def __call__(self, scope, receive, send):
+        # Counters are only touched on the event loop, so they need no lock
+        if self.slots.value == 0 and self.waiting >= self.max_waiting:
+            self.counters["rejected"] += 1
+            response = JSONResponse(
+                {"error": "Too many requests in progress, retry shortly."}, status_code=503,
+                headers={"Access-Control-Allow-Origin": "*", "Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.counters["requests"] += 1
+        self.counters["peak_in_flight"] = max(self.counters["peak_in_flight"], self.in_flight)
+        try:
+            response = await self.respond(Request(scope, receive))
+            await response(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            self.slots.release()
+
+    async def respond(self, request):
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as body:
+            length = 0
+            async for chunk in request.stream():
+                length += len(chunk)
+                if length > MAX_BODY_BYTES:
+                    return JSONResponse(
+                        {"error": "Request body is too large."}, status_code=413,
+                        headers={"Access-Control-Allow-Origin": "*"},
+                    )
+                body.write(chunk)
+            body.seek(0)
+            response = await anyio.to_thread.run_sync(
+                self.call, wsgi_environ(request.scope, body, length), limiter=self.threads
+            )
+
+        headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+        if response.is_streamed:
+            result = StreamingResponse(self.stream(response), status_code=response.status_code)
+        else:
+            result = Response(response.get_data(), status_code=response.status_code)
+            response.close()
+        result.raw_headers = headers
+        return result
+
+    def call(self, environ):
+        with flask_app.request_context(environ) as context:
+            return flask_app.make_response(self.handler(context.request))
+
+    async def stream(self, response):
+        """The body of a streamed response, each chunk produced on a worker thread."""
+        chunks = response.iter_encoded()
+        try:
+            while True:
+                chunk = await anyio.to_thread.run_sync(next, chunks, None, limiter=self.threads)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            response.close()
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "max_waiting": self.max_waiting,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            **self.counters,
+        }
+
+
+def create_app(limits=None):
+    """
+    The threaded ASGI wrapper. `limits` maps entry points to (limit, max_waiting), over the
+    environment and the defaults in ENDPOINTS.
+    """
+    limits = limits or {}
+    modules, endpoints = {}, {}
+    for path, (directory, entry_point, default_limit) in ENDPOINTS.items():
+        module = modules[directory] = load_function(directory)
+        limit = int(os.environ.get(f"{entry_point.upper()}_CONCURRENCY", default_limit))
+        max_waiting = int(os.environ.get(f"{entry_point.upper()}_MAX_WAITING", limit))
+        limit, max_waiting = limits.get(entry_point, (limit, max_waiting))
+        endpoints[path] = Endpoint(entry_point, getattr(module, entry_point), limit, max_waiting)
+    share_clients(modules, endpoints["/transaction-process"].limit)
+
+    async def service_stats(request):
+        return JSONResponse({path: endpoint.stats() for path, endpoint in endpoints.items()})
+
+    routes = [Route(path, endpoint, methods=METHODS) for path, endpoint in endpoints.items()]
+    routes.append(Route("/service-stats", service_stats))
+    app = Starlette(routes=routes)
+    app.state.modules = modules
+    app.state.endpoints = endpoints
+    return app
@@ -38,12 +38,17 @@ export default function ChatTab({ user }: UserProps) {
   const [transactionContext, setTransactionContext] = useState<any[]>([]);
   const [loading, setLoading] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement | null>(null);
+  // Last response per request body, revalidated with its ETag (304 = unchanged)
+  const responseCache = useRef<Map<string, { etag: string; data: any }>>(new Map());
+  // Lets the function reuse its summary of messages that no longer fit in chat_history
+  const conversationId = useRef(crypto.randomUUID());
 
   useEffect(() => {
     const triggerFetch = async () => {
       const payload: any = {
         collection: "sample_transactions",
         query_type: queryType,
+        user: user?.name || "NA",
       };
 
       if (queryType === "custom_time_range") {
@@ -52,17 +57,29 @@ export default function ChatTab({ user }: UserProps) {
         payload.end_date = customEnd;
       }
 
+      const body = JSON.stringify(payload);
+      const cached = responseCache.current.get(body);
+      const headers: Record<string, string> = { "Content-Type": "application/json" };
+      if (cached) headers["If-None-Match"] = cached.etag;
+
       try {
         const response = await fetch(
           "https://us-central1-graceful-byway-467117-r0.cloudfunctions.net/get-user-data",
           {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify(payload),
+            headers,
+            body,
           }
         );
 
+        if (response.status === 304 && cached) {
+          setTransactionContext(cached.data);
+          return;
+        }
+
         const data = await response.json();
+        const etag = response.headers.get("ETag");
+        if (response.ok && etag) responseCache.current.set(body, { etag, data });
         setTransactionContext(data);
       } catch (error) {
         console.error("❌ Failed to fetch transactions:", error);
@@ -70,7 +87,7 @@ export default function ChatTab({ user }: UserProps) {
     };
 
     triggerFetch();
-  }, [queryType, customStart, customEnd]);
+  }, [queryType, customStart, customEnd, user?.name]);
 
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -90,6 +107,15 @@ export default function ChatTab({ user }: UserProps) {
     setInputValue("");
     setLoading(true);
 
+    const aiMessageId = messages.length + 2;
+    const showReply = (text: string) => {
+      setMessages(prev =>
+        prev.some(m => m.id === aiMessageId)
+          ? prev.map(m => (m.id === aiMessageId ? { ...m, text } : m))
+          : [...prev, { id: aiMessageId, text, isUser: false, timestamp: "Just now" }]
+      );
+    };
+
     try {
       const response = await fetch(
         "https://us-central1-graceful-byway-467117-r0.cloudfunctions.net/query-gemini",
@@ -104,32 +130,54 @@ export default function ChatTab({ user }: UserProps) {
             },
             user_query: inputValue,
             context: transactionContext,
-            chat_history: messages.slice(-5).map(m => ({
+            // The function keeps recent turns verbatim and summarizes older ones
+            chat_history: messages.slice(-40).map(m => ({
               role: m.isUser ? "user" : "ai",
               content: m.text
             })),
+            conversation_id: conversationId.current,
+            history_offset: Math.max(0, messages.length - 40),
+            // Show the reply as it is generated
+            stream: "ndjson",
           }),
         }
       );
 
-      const result = await response.json();
-
-      const aiMessage: Message = {
-        id: messages.length + 2,
-        text: result?.reply || "🤖 No response from AI.",
-        isUser: false,
-        timestamp: "Just now"
-      };
+      const contentType = response.headers.get("Content-Type") || "";
+      if (!response.body || !contentType.includes("application/x-ndjson")) {
+        const result = await response.json();
+        showReply(result?.reply || "🤖 No response from AI.");
+        return;
+      }
 
-      setMessages(prev => [...prev, aiMessage]);
+      // One JSON object per line: {"type": "chunk", "text"}, then "done" or "error"
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = "";
+      let reply = "";
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split("\n");
+        buffered = lines.pop() || "";
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const event = JSON.parse(line);
+          if (event.type === "chunk") {
+            reply += event.text;
+            setLoading(false);
+            showReply(reply);
+          } else if (event.type === "done") {
+            reply = event.reply || reply;
+          } else if (event.type === "error") {
+            throw new Error(event.error);
+          }
+        }
+      }
+      showReply(reply || "🤖 No response from AI.");
     } catch (error) {
-      const errorMessage: Message = {
-        id: messages.length + 2,
-        text: `❌ Error from AI: ${error instanceof Error ? error.message : "Unknown error"}`,
-        isUser: false,
-        timestamp: "Just now"
-      };
-      setMessages(prev => [...prev, errorMessage]);
+      showReply(`❌ Error from AI: ${error instanceof Error ? error.message : "Unknown error"}`);
     } finally {
       setLoading(false);
     }
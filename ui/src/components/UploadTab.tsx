@@ -76,7 +76,7 @@ interface UserProps {
 }
 
 // Function to fetch user data
-const fetchUserData = async () => {
+const fetchUserData = async (userName: string) => {
   try {
     const response = await fetch(
       'https://us-central1-graceful-byway-467117-r0.cloudfunctions.net/get-user-data',
@@ -86,6 +86,7 @@ const fetchUserData = async () => {
         body: JSON.stringify({
           collection: 'sample_transactions',
           query_type: 'last_7_days',
+          user: userName,
         }),
       }
     );
@@ -213,7 +214,7 @@ export default function UploadTab({ user }: UserProps) {
 
       setUploadSuccess(true);
       setError('');
-      await fetchUserData(); // Call after upload
+      await fetchUserData(user?.name || 'NA'); // Call after upload
     } catch (err: any) {
       console.error('Upload error:', err);
       setError(`Failed to upload image: ${err.message || 'Unknown error'}`);
@@ -238,7 +239,7 @@ export default function UploadTab({ user }: UserProps) {
   };
 
   useEffect(() => {
-    fetchUserData(); // Call on component load
+    fetchUserData(user?.name || 'NA'); // Call on component load
     return () => {
       stopCamera();
     };